@@ -5,13 +5,16 @@ This version was not importable so the functions had to be copied here.
 We will be importing conda-smithy functionality.
 '''
 import datetime
+import json
 import logging
 import netrc
 import os
 import glob
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from github import Github, GithubException
-import git
 import markdown
 import pandas as pd
 import requests
@@ -19,15 +22,159 @@ from bs4 import BeautifulSoup
 from tabulate import tabulate
 
 from nsls2forge_utils.io import (
+    _github_graphql,
     _write_list_to_file,
     read_file_to_list
 )
 
 logger = logging.getLogger(__name__)
 
+FEEDSTOCK_URL = 'https://github.com/{organization}/{name}-feedstock.git'
+# Incremental listings in a row before the cached repository listing
+# is replaced by a full one
+FULL_LISTING_EVERY = 10
+
+REPOSITORIES_QUERY = '''
+query($organization: String!, $cursor: String) {
+  organization(login: $organization) {
+    repositories(first: 100, after: $cursor,
+                 orderBy: {field: UPDATED_AT, direction: DESC}) {
+      totalCount
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        name
+        isArchived
+        pushedAt
+        updatedAt
+        defaultBranchRef { name }
+      }
+    }
+  }
+}
+'''
+
+
+def _feedstock_names(repos, include_archived=False):
+    names = []
+    for name, repo in repos.items():
+        if repo['archived'] and not include_archived:
+            continue
+        if name.endswith("-feedstock"):
+            names.append(name.split("-feedstock")[0])
+    return names
+
+
+def _load_listing_cache(cache_path, organization):
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+    with open(cache_path, 'r') as f:
+        listing = json.load(f)
+    if listing.get('organization') != organization:
+        return None
+    return listing
+
+
+def get_all_feedstocks_from_graphql(organization=None, token=None,
+                                    include_archived=False, cache_path=None,
+                                    url=None, full_listing_every=None):
+    '''
+    Gets all feedstock repository names from the GitHub organization using
+    the GraphQL API, which lists 100 repositories per request.
+
+    When cache_path is given, the listing (name, archived, default branch,
+    pushedAt and updatedAt of every repository) is stored there with the
+    time of the most recent update seen. The next call only pages through
+    repositories updated since then and falls back to a full listing if
+    the number of repositories does not add up (e.g. one was deleted).
+    As the number is unchanged when a repository is deleted and another
+    one last updated before the listing (e.g. transferred from another
+    organization) is added, every full_listing_every-th call lists all
+    repositories again.
+
+    Parameters
+    ----------
+    organization: str
+        Name of organization on GitHub.
+    token: str, optional
+        GitHub token for authentication.
+        Uses value from ~/.netrc if not specified.
+    include_archived: bool, optional
+        Includes archived feedstocks in returned list
+        when set to True.
+    cache_path: str, optional
+        JSON file to store the repository listing in.
+    url: str, optional
+        GraphQL endpoint to query. Default is the GitHub API.
+    full_listing_every: int, optional
+        Number of incremental listings in a row after which the full
+        listing is fetched. Default is FULL_LISTING_EVERY.
+
+    Returns
+    -------
+    names: list, None
+        List of repository names that end with '-feedstock' (stripped).
+        None if no organization is specified.
+    '''
+    if organization is None:
+        logger.critical('No GitHub organization sepcified.')
+        return None
+    if full_listing_every is None:
+        full_listing_every = FULL_LISTING_EVERY
+    listing = _load_listing_cache(cache_path, organization)
+    if listing is not None and listing.get('incremental_runs', 0) >= full_listing_every:
+        logger.info(f'Listing all repositories of {organization} after '
+                    f'{listing["incremental_runs"]} incremental listings')
+        listing = None
+    for attempt in ('incremental', 'full'):
+        if attempt == 'full' or listing is None:
+            listing = {'organization': organization, 'timestamp': None, 'repos': {}}
+        full = listing['timestamp'] is None
+        since = listing['timestamp']
+        repos = dict(listing['repos'])
+        newest = since
+        cursor = None
+        while True:
+            data = _github_graphql(REPOSITORIES_QUERY,
+                                   variables={'organization': organization,
+                                              'cursor': cursor},
+                                   token=token, url=url)
+            page = data['organization']['repositories']
+            total = page['totalCount']
+            stop = False
+            for node in page['nodes']:
+                if since is not None and node['updatedAt'] < since:
+                    stop = True
+                    break
+                if newest is None or node['updatedAt'] > newest:
+                    newest = node['updatedAt']
+                branch = node['defaultBranchRef'] or {}
+                repos[node['name']] = {
+                    'archived': node['isArchived'],
+                    'default_branch': branch.get('name'),
+                    'pushed_at': node['pushedAt'],
+                    'updated_at': node['updatedAt'],
+                }
+            if stop or not page['pageInfo']['hasNextPage']:
+                break
+            cursor = page['pageInfo']['endCursor']
+        if len(repos) == total:
+            break
+        logger.info(f'Cached listing of {organization} is out of date '
+                    f'({len(repos)} repositories, {total} on GitHub)')
+    listing['timestamp'] = newest
+    listing['repos'] = repos
+    listing['incremental_runs'] = 0 if full else listing.get('incremental_runs', 0) + 1
+    if cache_path is not None:
+        with open(cache_path, 'w') as f:
+            json.dump(listing, f, indent=2, sort_keys=True)
+    names = _feedstock_names(repos, include_archived=include_archived)
+    logger.info(f'Found {len(names)} feedstocks from {organization}.')
+    return names
+
 
 def get_all_feedstocks_from_github(organization=None, username=None, token=None,
-                                   include_archived=False):
+                                   include_archived=False, graphql=False,
+                                   cache_path=None):
     '''
     Gets all public feedstock repository names from the GitHub organization
     (e.g. nsls-ii-forge).
@@ -45,6 +192,11 @@ def get_all_feedstocks_from_github(organization=None, username=None, token=None,
     include_archived: bool, optional
         Includes archived feedstocks in returned list
         when set to True.
+    graphql: bool, optional
+        Uses the GraphQL API (see get_all_feedstocks_from_graphql)
+        instead of paging through the REST API.
+    cache_path: str, optional
+        JSON file to cache the repository listing in when graphql is True.
 
     Returns
     -------
@@ -55,6 +207,10 @@ def get_all_feedstocks_from_github(organization=None, username=None, token=None,
     if organization is None:
         logger.critical('No GitHub organization sepcified.')
         return None
+    if graphql:
+        return get_all_feedstocks_from_graphql(organization=organization, token=token,
+                                               include_archived=include_archived,
+                                               cache_path=cache_path)
     if username is None:
         netrc_file = netrc.netrc()
         username, _, token = netrc_file.hosts['github.com']
@@ -126,10 +282,48 @@ def get_all_feedstocks(cached=False, filepath='names.txt',
     return names
 
 
-def clone_all_feedstocks(organization, feedstocks_dir):
+def _git(*args, cwd=None):
+    return subprocess.run(['git', *args], cwd=cwd, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def _clone_or_update(name, organization, feedstocks_dir, depth=None,
+                     blob_filter=False, url_template=FEEDSTOCK_URL):
+    '''
+    Clones a feedstock, or fetches and fast-forwards it if it has
+    already been cloned.
+
+    Returns
+    -------
+    tuple
+        ('cloned' or 'updated', seconds taken)
+    '''
+    start = time.time()
+    repo_path = os.path.join(feedstocks_dir, f'{name}-feedstock')
+    if os.path.isdir(os.path.join(repo_path, '.git')):
+        _git('fetch', '--quiet', 'origin', cwd=repo_path)
+        _git('merge', '--quiet', '--ff-only', '@{u}', cwd=repo_path)
+        action = 'updated'
+    else:
+        args = ['clone', '--quiet']
+        if depth is not None:
+            args.append(f'--depth={depth}')
+        if blob_filter:
+            args.append('--filter=blob:none')
+        url = url_template.format(organization=organization, name=name)
+        _git(*args, url, repo_path)
+        action = 'cloned'
+    return action, time.time() - start
+
+
+def clone_all_feedstocks(organization, feedstocks_dir, jobs=None, depth=None,
+                         blob_filter=False, names=None, url_template=FEEDSTOCK_URL):
     '''
     Clones all feedstock repos from organization to local feedstocks_dir.
-    Uses conda-smithy's clone all utility.
+    Uses conda-smithy's clone all utility unless jobs is given, in which
+    case missing feedstocks are cloned and existing clones are fetched and
+    fast-forwarded using jobs parallel git processes.
 
     Parameters
     ----------
@@ -137,14 +331,150 @@ def clone_all_feedstocks(organization, feedstocks_dir):
         GitHub organization to clone feedstock repos from.
     feedstocks_dir: str
         Path to local directory to place cloned feedstocks.
+    jobs: int, optional
+        Number of feedstocks to clone/update in parallel.
+    depth: int, optional
+        Create shallow clones with this many commits (--depth).
+        Requires jobs.
+    blob_filter: bool, optional
+        Create partial clones without file contents of old
+        commits (--filter=blob:none). Requires jobs.
+    names: list, optional
+        Feedstock names to clone. Default is all feedstocks in organization.
+    url_template: str, optional
+        Git URL of a feedstock with {organization} and {name} placeholders.
+
+    Returns
+    -------
+    results: dict or None
+        Maps each name to (action, seconds, error) where action is 'cloned',
+        'updated' or None if it failed. None when using conda-smithy.
+    '''
+    if jobs is None and (depth is not None or blob_filter):
+        raise ValueError('depth and blob_filter can only be used together with jobs')
+    if jobs is None:
+        from conda_smithy import feedstocks
+        print(f'Cloning all feedstocks from {organization}...')
+        feedstocks.clone_all(gh_org=organization,
+                             feedstocks_dir=feedstocks_dir)
+        return None
+    if names is None:
+        names = get_all_feedstocks(organization=organization)
+    os.makedirs(feedstocks_dir, exist_ok=True)
+    print(f'Cloning/updating {len(names)} feedstocks from {organization} '
+          f'with {jobs} jobs...')
+    start = time.time()
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            name: pool.submit(_clone_or_update, name, organization, feedstocks_dir,
+                              depth=depth, blob_filter=blob_filter,
+                              url_template=url_template)
+            for name in names
+        }
+        for name, future in futures.items():
+            try:
+                action, seconds = future.result()
+            except subprocess.CalledProcessError as e:
+                results[name] = (None, None, e.stderr.strip())
+                print(f'{name:<40} failed: {e.stderr.strip()}')
+            except OSError as e:
+                # e.g. git is not installed or the disk is full
+                results[name] = (None, None, str(e))
+                print(f'{name:<40} failed: {e}')
+            else:
+                results[name] = (action, seconds, None)
+                print(f'{name:<40} {action:<8} {seconds:6.2f}s')
+    n_failed = sum(1 for action, _, _ in results.values() if action is None)
+    print(f'Finished {len(results)} feedstocks in {time.time() - start:.2f}s '
+          f'({n_failed} failed)')
+    return results
+
+
+def _version_from_recipe(repo_path):
+    '''
+    Reads the package version from a cloned feedstock's recipe/meta.yaml
+    '''
+    from conda_forge_tick.utils import parse_meta_yaml
+    import jinja2
+    import yaml
+    with open(os.path.join(repo_path, 'recipe', 'meta.yaml')) as f:
+        text = f.read()
+    try:
+        meta_yaml = parse_meta_yaml(text)
+    except (jinja2.TemplateError, yaml.YAMLError) as e:
+        raise ValueError(f'Could not parse recipe/meta.yaml: {e}') from e
+    return str(meta_yaml['package']['version'])
+
+
+def _version_from_badge(repo_path):
+    '''
+    Reads the package version from the Conda Version badge in a cloned
+    feedstock's README.md by requesting the badge svg
     '''
-    from conda_smithy import feedstocks
-    print(f'Cloning all feedstocks from {organization}...')
-    feedstocks.clone_all(gh_org=organization,
-                         feedstocks_dir=feedstocks_dir)
+    with open(os.path.join(repo_path, 'README.md')) as f:
+        html_text = markdown.markdown(f.read())
+    html = BeautifulSoup(html_text, features='lxml')
+    svg = html.findAll('img', attrs={'alt': 'Conda Version'})[0]
+    r = requests.get(svg.attrs['src'])
+    svg_html = BeautifulSoup(r.text, features='lxml')
+    version_tag = svg_html.findAll('text')[-1]
+    return version_tag.text
 
 
-def all_feedstocks_info(feedstocks_dir='./feedstocks/'):
+def _read_branch(repo_path):
+    '''
+    Reads the checked out branch of a repository from .git/HEAD without
+    spawning git. Returns 'HEAD' when the HEAD is detached, like
+    git rev-parse --abbrev-ref HEAD.
+    '''
+    git_dir = os.path.join(repo_path, '.git')
+    if os.path.isfile(git_dir):
+        # worktrees and submodules point to the real git directory
+        with open(git_dir) as f:
+            git_dir = os.path.join(repo_path, f.read().strip()[len('gitdir: '):])
+    with open(os.path.join(git_dir, 'HEAD')) as f:
+        head = f.read().strip()
+    if head.startswith('ref: refs/heads/'):
+        return head[len('ref: refs/heads/'):]
+    return 'HEAD'
+
+
+def _repo_status(repo_path):
+    '''
+    Returns the branch of a repository and whether tracked files have
+    uncommitted changes, using a single git process.
+    '''
+    status = _git('status', '--porcelain', '--untracked-files=no', cwd=repo_path)
+    return _read_branch(repo_path), bool(status.stdout.strip())
+
+
+def _badge_version(feedstock, repo_path):
+    try:
+        return _version_from_badge(repo_path)
+    except (OSError, IndexError, KeyError, requests.RequestException) as e:
+        logger.warning(f'Could not read version of {feedstock} from its badge: {e!r}')
+        return ''
+
+
+def _feedstock_info(repo_path, badge_fallback=False, from_recipe=True):
+    feedstock = os.path.basename(os.path.normpath(repo_path))
+    print(f'Getting info from {feedstock}...')
+    if not from_recipe:
+        version = _badge_version(feedstock, repo_path) if badge_fallback else ''
+    else:
+        try:
+            version = _version_from_recipe(repo_path)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f'Could not read version of {feedstock} from its recipe: {e!r}')
+            version = _badge_version(feedstock, repo_path) if badge_fallback else ''
+
+    branch, changed = _repo_status(repo_path)
+    return [feedstock, branch, changed, version]
+
+
+def all_feedstocks_info(feedstocks_dir='./feedstocks/', max_workers=None,
+                        badge_fallback=False):
     '''
     Gathers and prints version and other Git info about all currently cloned
     feedstocks
@@ -153,6 +483,15 @@ def all_feedstocks_info(feedstocks_dir='./feedstocks/'):
     ----------
     feedstocks_dir: str, optional
         Directory where cloned feedstocks are. Default is './feedstocks/'.
+    max_workers: int, optional
+        Number of feedstocks to inspect concurrently.
+        Default is ThreadPoolExecutor's default.
+    badge_fallback: bool, optional
+        When the version can't be read from recipe/meta.yaml, read it
+        from the Conda Version badge in README.md instead (one network
+        request per feedstock). When conda_forge_tick, which parses
+        recipes, is not installed, versions are only read from the badge
+        if this is set and are left empty otherwise.
 
     Returns
     -------
@@ -160,27 +499,23 @@ def all_feedstocks_info(feedstocks_dir='./feedstocks/'):
         Table with name, branch, changed, and version info
     '''
     all_feedstocks = get_all_feedstocks(cached=True, feedstocks_dir=feedstocks_dir)
-    info = []
-    for i, feedstock in enumerate(all_feedstocks):
-        feedstock += '-feedstock'
-        print(f'Getting info from {feedstock}...')
-        repo_path = os.path.join(feedstocks_dir, feedstock)
-        # Get version info from README.md's badge via requesting the info from svg:
-        try:
-            with open(os.path.join(repo_path, 'README.md')) as f:
-                html_text = markdown.markdown(f.read())
-                html = BeautifulSoup(html_text, features='lxml')
-                svg = html.findAll('img', attrs={'alt': 'Conda Version'})[0]
-                r = requests.get(svg.attrs['src'])
-                svg_html = BeautifulSoup(r.text, features='lxml')
-                version_tag = svg_html.findAll('text')[-1]
-                version = version_tag.text
-        except Exception:
-            version = ''
-
-        # Extract info from git:
-        repo = git.Repo(repo_path)
-        info.append([feedstock, repo.active_branch.name, repo.is_dirty(), version])
+    repo_paths = [os.path.join(feedstocks_dir, f'{feedstock}-feedstock')
+                  for feedstock in all_feedstocks]
+    try:
+        import conda_forge_tick.utils  # noqa: F401
+    except ImportError:
+        if badge_fallback:
+            print('conda_forge_tick is not installed, reading versions from README badges')
+        else:
+            print('conda_forge_tick is not installed, versions are left empty. '
+                  'Use --badge to read them from README badges.')
+        from_recipe = False
+    else:
+        from_recipe = True
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        info = list(pool.map(lambda path: _feedstock_info(path, badge_fallback=badge_fallback,
+                                                          from_recipe=from_recipe),
+                             repo_paths))
 
     columns = ['Name', 'Branch', 'Changed?', 'Version']
     df = pd.DataFrame(info, columns=columns)
@@ -189,12 +524,18 @@ def all_feedstocks_info(feedstocks_dir='./feedstocks/'):
 
 
 def _info_handle_args(args):
-    all_feedstocks_info(feedstocks_dir=args.feedstocks_dir)
+    all_feedstocks_info(feedstocks_dir=args.feedstocks_dir, max_workers=args.jobs,
+                        badge_fallback=args.badge)
 
 
 def _clone_all_handle_args(args):
+    if args.jobs is None and (args.depth is not None or args.blob_filter):
+        print('ERROR: --depth and --filter-blobs require --jobs. '
+              'Use -h or --help for help.')
+        return
     print(f'Cloning feestocks from {args.organization}...')
-    clone_all_feedstocks(args.organization, args.feedstocks_dir)
+    clone_all_feedstocks(args.organization, args.feedstocks_dir, jobs=args.jobs,
+                         depth=args.depth, blob_filter=args.blob_filter)
 
 
 def _list_all_handle_args(args):
@@ -207,7 +548,9 @@ def _list_all_handle_args(args):
                                username=args.username,
                                token=args.token,
                                filepath=args.filepath,
-                               include_archived=args.include_archived)
+                               include_archived=args.include_archived,
+                               graphql=args.graphql,
+                               cache_path=args.listing_cache)
     names = sorted(names)
     if args.write:
         print(f'Writing names to {args.filepath}...')
@@ -0,0 +1,392 @@
+'''
+Persistent on-disk caches used to avoid re-downloading files
+that have not changed since the last run.
+'''
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'nsls2forge-utils')
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+DEFAULT_SOURCE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+
+def _evict_lru(entries, total_size, max_size):
+    '''
+    Removes least recently used files until total_size is within max_size.
+
+    Parameters
+    ----------
+    entries: list
+        Paths of cached files
+    total_size: int
+        Current combined size of the cached files in bytes
+    max_size: int
+        Maximum combined size of the cached files in bytes
+
+    Returns
+    -------
+    int
+        Combined size of the remaining files in bytes
+    '''
+    if total_size <= max_size:
+        return total_size
+    stats = []
+    for path in entries:
+        try:
+            stats.append((os.stat(path), path))
+        except FileNotFoundError:
+            continue
+    for stat, path in sorted(stats, key=lambda s: s[0].st_mtime):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        logger.info(f'Evicted {path} from cache')
+        total_size -= stat.st_size
+    return total_size
+
+
+class FetchCache:
+    '''
+    Cache of files fetched from GitHub that stores each body along with
+    its ETag and Last-Modified headers so that it can be revalidated
+    with a conditional request. Entries are evicted least recently
+    used first once the cache grows beyond max_size.
+
+    Parameters
+    ----------
+    cache_dir: str, optional
+        Directory to store cached files in.
+        Default is ~/.cache/nsls2forge-utils/files.
+    max_size: int, optional
+        Maximum size of the cache in bytes. Default is 100 MB.
+    '''
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(DEFAULT_CACHE_DIR, 'files')
+        if max_size is None:
+            max_size = DEFAULT_MAX_SIZE
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entries())
+
+    @staticmethod
+    def key(organization, name, branch, filepath):
+        return f'{organization}/{name}/{branch}/{filepath}'
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.json')
+
+    def _entries(self):
+        return [entry.path for entry in os.scandir(self.cache_dir)
+                if entry.name.endswith('.json')]
+
+    def get(self, key):
+        '''
+        Returns the cached entry for key (a dict with text, etag and
+        last_modified) or None if it is not cached.
+        '''
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def conditional_headers(self, entry):
+        '''
+        Returns the request headers needed to revalidate entry.
+        '''
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def hit(self, key):
+        '''
+        Records that the cached entry for key is still valid.
+        '''
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, text, etag=None, last_modified=None):
+        '''
+        Stores text for key. Nothing is stored if the server sent
+        neither an ETag nor a Last-Modified header since the entry
+        could never be revalidated.
+        '''
+        if etag is None and last_modified is None:
+            return
+        path = self._path(key)
+        data = json.dumps({'key': key, 'etag': etag,
+                           'last_modified': last_modified, 'text': text})
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self._size = _evict_lru(self._entries(), self._size, self.max_size)
+
+    def summary(self):
+        total = self.hits + self.misses
+        return (f'Fetch cache: {self.hits} hits, {self.misses} misses '
+                f'({total} requests, {self._size / 1024:.1f} KiB in {self.cache_dir})')
+
+
+@contextmanager
+def fetch_cache(cache_dir=None, max_size=None, enabled=True):
+    '''
+    Enables the fetch cache for all files fetched within the context
+    and prints the number of cache hits and misses on exit.
+
+    Parameters
+    ----------
+    cache_dir: str, optional
+        Directory to store cached files in.
+    max_size: int, optional
+        Maximum size of the cache in bytes.
+    enabled: bool, optional
+        When False, files are fetched without the cache.
+
+    Yields
+    ------
+    FetchCache or None
+        The cache in use, None if disabled
+    '''
+    from . import io
+    if not enabled:
+        yield None
+        return
+    cache = FetchCache(cache_dir=cache_dir, max_size=max_size)
+    previous = io.FETCH_CACHE
+    io.FETCH_CACHE = cache
+    try:
+        yield cache
+    finally:
+        io.FETCH_CACHE = previous
+        print(cache.summary())
+
+
+class SourceCache:
+    '''
+    Content-addressed cache of downloaded package sources. Files are
+    stored under their sha256 hash, and an index records the URLs they
+    were downloaded from. Only sources with a sha256 in the recipe are
+    cached, since nothing tells whether the file behind a URL changed.
+    Files are evicted least recently used first once the cache grows
+    beyond max_size.
+
+    Parameters
+    ----------
+    cache_dir: str, optional
+        Directory to store sources in.
+        Default is ~/.cache/nsls2forge-utils/sources.
+    max_size: int, optional
+        Maximum size of the cache in bytes. Default is 2 GB.
+    '''
+    def __init__(self, cache_dir=None, max_size=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(DEFAULT_CACHE_DIR, 'sources')
+        if max_size is None:
+            max_size = DEFAULT_SOURCE_MAX_SIZE
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._blobs())
+
+    def _path(self, sha256):
+        return os.path.join(self.cache_dir, sha256.lower())
+
+    def _blobs(self):
+        return [entry.path for entry in os.scandir(self.cache_dir)
+                if len(entry.name) == 64 and entry.is_file()]
+
+    def _read_index(self):
+        try:
+            with open(self._index_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        tmp_path = f'{self._index_path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._index_path)
+
+    def _evict(self, max_size):
+        '''
+        Evicts least recently used sources until the cache is within
+        max_size bytes and drops the index entries of evicted sources.
+        Must be called with the lock held.
+        '''
+        self._size = _evict_lru(self._blobs(), self._size, max_size)
+        cached = {os.path.basename(path) for path in self._blobs()}
+        index = self._read_index()
+        kept = {url: sha256 for url, sha256 in index.items() if sha256 in cached}
+        if kept != index:
+            self._write_index(kept)
+
+    def lookup(self, sha256):
+        '''
+        Returns the path of the cached source with the given sha256 and
+        marks it as recently used. Returns None if it is not cached.
+        '''
+        path = self._path(sha256)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            path = None
+        with self._lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def add(self, filename, sha256, url=None):
+        '''
+        Copies the source at filename, whose hash is sha256, into the
+        cache and records that it was downloaded from url.
+
+        Returns
+        -------
+        str
+            Path of the cached copy
+        '''
+        path = self._path(sha256)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        shutil.copyfile(filename, tmp_path)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._size += os.path.getsize(path)
+            if url is not None:
+                index = self._read_index()
+                index[url] = sha256.lower()
+                self._write_index(index)
+            if self._size > self.max_size:
+                self._evict(self.max_size)
+        return path
+
+    def entries(self):
+        '''
+        Returns a list of dicts with the sha256, size, last use and URLs
+        of every cached source, most recently used first.
+        '''
+        urls = {}
+        for url, sha256 in self._read_index().items():
+            urls.setdefault(sha256, []).append(url)
+        entries = []
+        for path in self._blobs():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            sha256 = os.path.basename(path)
+            entries.append({
+                'sha256': sha256,
+                'size': stat.st_size,
+                'last_used': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime)),
+                'urls': sorted(urls.get(sha256, [])),
+            })
+        return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+    def prune(self, max_size=None):
+        '''
+        Evicts least recently used sources until the cache is within
+        max_size bytes (default is the cache's max_size) and drops
+        index entries of sources that are no longer cached.
+
+        Returns
+        -------
+        int
+            Number of bytes freed
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        with self._lock:
+            before = self._size
+            self._evict(max_size)
+        return before - self._size
+
+    def summary(self):
+        return (f'Source cache: {self.hits} hits, {self.misses} misses '
+                f'({self._size / 1024**2:.1f} MiB in {self.cache_dir})')
+
+
+@contextmanager
+def source_cache(cache_dir=None, max_size=None, enabled=True):
+    '''
+    Enables the source cache for all sources downloaded within the
+    context and prints the number of cache hits and misses on exit.
+
+    Parameters
+    ----------
+    cache_dir: str, optional
+        Directory to store sources in.
+    max_size: int, optional
+        Maximum size of the cache in bytes.
+    enabled: bool, optional
+        When False, sources are always downloaded.
+
+    Yields
+    ------
+    SourceCache or None
+        The cache in use, None if disabled
+    '''
+    from . import meta_utils
+    if not enabled:
+        yield None
+        return
+    cache = SourceCache(cache_dir=cache_dir, max_size=max_size)
+    previous = meta_utils.SOURCE_CACHE
+    meta_utils.SOURCE_CACHE = cache
+    try:
+        yield cache
+    finally:
+        meta_utils.SOURCE_CACHE = previous
+        print(cache.summary())
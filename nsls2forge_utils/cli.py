@@ -1,10 +1,13 @@
 import logging
 logging.captureWarnings(True)
 import argparse  # noqa: E402
+import json  # noqa: E402
 import sys  # noqa: E402
 
+from .cache import fetch_cache, source_cache, SourceCache  # noqa: E402
 from .check_results import check_conda_channels, check_package_version  # noqa: E402
-from .meta_utils import get_attribute, download_from_source  # noqa: E402
+from .io import read_file_to_list  # noqa: E402
+from .meta_utils import get_attributes, download_from_source, download_sources  # noqa: E402
 from .all_feedstocks import (  # noqa: E402
     _list_all_handle_args,
     _clone_all_handle_args,
@@ -16,6 +19,86 @@ from .graph_utils import (  # noqa: E402
     _query_graph_handle_args,
     _update_handle_args
 )
+from .graph_query import QUERIES  # noqa: E402
+from .graph_server import DEFAULT_PORT, _serve_handle_args  # noqa: E402
+from .graph_store import _convert_handle_args  # noqa: E402
+
+
+def _add_fetch_cache_arguments(parser):
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        default=None, type=str,
+                        help=('Directory to cache fetched recipe files in '
+                              '(default is ~/.cache/nsls2forge-utils/files)'))
+
+    parser.add_argument('--cache-max-size', dest='cache_max_size',
+                        default=100, type=int,
+                        help=('Maximum size of the fetched file cache in MB '
+                              '(default is 100)'))
+
+    parser.add_argument('--no-cache', dest='no_cache',
+                        action='store_true',
+                        help=('Fetch recipe files without revalidating against '
+                              'the local cache'))
+
+
+def _fetch_cache_from_args(args):
+    return fetch_cache(cache_dir=args.cache_dir,
+                       max_size=args.cache_max_size * 1024 * 1024,
+                       enabled=not args.no_cache)
+
+
+def _add_source_cache_arguments(parser):
+    parser.add_argument('--source-cache-dir', dest='source_cache_dir',
+                        default=None, type=str,
+                        help=('Directory to cache downloaded sources in '
+                              '(default is ~/.cache/nsls2forge-utils/sources)'))
+
+    parser.add_argument('--source-cache-max-size', dest='source_cache_max_size',
+                        default=2048, type=int,
+                        help=('Maximum size of the source cache in MB '
+                              '(default is 2048)'))
+
+
+def _source_cache_from_args(args):
+    return source_cache(cache_dir=args.source_cache_dir,
+                        max_size=args.source_cache_max_size * 1024 * 1024,
+                        enabled=not args.no_cache)
+
+
+def _source_cache_handle_args(args):
+    cache = SourceCache(cache_dir=args.source_cache_dir,
+                        max_size=args.source_cache_max_size * 1024 * 1024)
+    if args.clear:
+        freed = cache.prune(max_size=0)
+        print(f'Removed {freed / 1024**2:.1f} MiB from {cache.cache_dir}')
+    elif args.prune:
+        freed = cache.prune()
+        print(f'Removed {freed / 1024**2:.1f} MiB from {cache.cache_dir}')
+    entries = cache.entries()
+    for entry in entries:
+        print(f'{entry["sha256"][:12]}  {entry["size"] / 1024**2:9.1f} MiB  '
+              f'{entry["last_used"]}  {" ".join(entry["urls"])}')
+    total = sum(entry['size'] for entry in entries)
+    print(f'{len(entries)} sources, {total / 1024**2:.1f} MiB in {cache.cache_dir}')
+
+
+def _download_handle_args(args, packages):
+    if len(packages) == 1 and args.report is None:
+        url, sha256 = download_from_source(packages[0],
+                                           organization=args.organization,
+                                           cached=args.cached)
+        print(f'Successfully downloaded {url}\nsha256: {sha256}')
+        return
+    report = download_sources(packages, organization=args.organization,
+                              cached=args.cached, max_workers=args.jobs)
+    if args.report == '-':
+        print(json.dumps(report, indent=2))
+    elif args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    n_failed = sum(1 for entry in report if not entry['ok'])
+    print(f'Verified {len(report)} sources of {len(packages)} packages '
+          f'({n_failed} failed)')
 
 
 def check_results():
@@ -116,6 +199,16 @@ def all_feedstocks():
                              help=('Includes archived feedstocks in returned list '
                                    'when set to True.'))
 
+    list_parser.add_argument('-g', '--graphql', dest='graphql',
+                             action='store_true',
+                             help=('List repositories with the GitHub GraphQL API, '
+                                   '100 per request, instead of the REST API'))
+
+    list_parser.add_argument('--listing-cache', dest='listing_cache',
+                             default=None, type=str,
+                             help=('JSON file to cache the GraphQL repository listing in; '
+                                   'later runs only fetch repositories updated since'))
+
     # Set function to handle arguments
     list_parser.set_defaults(func=_list_all_handle_args)
 
@@ -131,6 +224,22 @@ def all_feedstocks():
                               help=('Directory to clone feedstocks to. Default is '
                                     './feedstocks'))
 
+    clone_parser.add_argument('-j', '--jobs', dest='jobs',
+                              default=None, type=int,
+                              help=('Clone missing feedstocks and fetch/fast-forward existing '
+                                    'clones with this many parallel git processes instead of '
+                                    'using conda-smithy'))
+
+    clone_parser.add_argument('--depth', dest='depth',
+                              default=None, type=int,
+                              help=('Create shallow clones with this many commits '
+                                    '(requires --jobs)'))
+
+    clone_parser.add_argument('--filter-blobs', dest='blob_filter',
+                              action='store_true',
+                              help=('Create partial clones with --filter=blob:none '
+                                    '(requires --jobs)'))
+
     # Set function to handle arguments
     clone_parser.set_defaults(func=_clone_all_handle_args)
 
@@ -143,6 +252,17 @@ def all_feedstocks():
                              help=('Directory where cloned feedstocks are; '
                                    'default is ./feedstocks/'))
 
+    info_parser.add_argument('-j', '--jobs', dest='jobs',
+                             default=None, type=int,
+                             help=('Number of feedstocks to inspect concurrently'))
+
+    info_parser.add_argument('-b', '--badge', dest='badge',
+                             action='store_true',
+                             help=('Fall back to reading the version from the Conda Version '
+                                   'badge in README.md (requires network access) when it '
+                                   'cannot be read from recipe/meta.yaml or conda_forge_tick '
+                                   'is not installed'))
+
     info_parser.set_defaults(func=_info_handle_args)
 
     args = parser.parse_args()
@@ -162,8 +282,9 @@ def meta_utils():
 
     # Get attribute from meta.yaml
     parser.add_argument('-g', '--get', dest='attributes',
-                        nargs='+',
-                        help=('Get an attribute from meta.yaml file '))
+                        nargs='+', action='append',
+                        help=('Get an attribute from meta.yaml file '
+                              '(repeat to get several, e.g. -g about home -g about dev_url)'))
 
     # Download package flag
     parser.add_argument('-d', '--download', dest='download',
@@ -177,9 +298,15 @@ def meta_utils():
                               '(must be specified if not cached)'))
 
     # Package name
-    parser.add_argument('-p', '--package', dest='package',
+    parser.add_argument('-p', '--package', dest='packages',
+                        default=None, type=str, nargs='+',
+                        help=('Software package name(s) with feedstock available'))
+
+    # Package names from file
+    parser.add_argument('-n', '--names', dest='names',
                         default=None, type=str,
-                        help=('Software package name with feedstock available'))
+                        help=('filepath to text file containing package names, '
+                              'e.g. names.txt from all-feedstocks list (used with -d)'))
 
     # Cached flag
     parser.add_argument('-c', '--cached', dest='cached',
@@ -188,18 +315,55 @@ def meta_utils():
                               'in feedstocks/ dir in current working directory. '
                               'Works well with default behavior of all-feedstocks clone'))
 
+    parser.add_argument('-j', '--jobs', dest='jobs',
+                        default=None, type=int,
+                        help=('Number of sources to download at once when downloading '
+                              'several packages'))
+
+    parser.add_argument('-r', '--report', dest='report',
+                        default=None, type=str,
+                        help=('filepath to write a JSON report of the downloaded sources to '
+                              '(- for stdout)'))
+
+    _add_fetch_cache_arguments(parser)
+    _add_source_cache_arguments(parser)
+
+    subparsers = parser.add_subparsers(dest='command')
+
+    # Inspect and prune the source cache
+    cache_parser = subparsers.add_parser('cache', help='Inspect or prune the cache of downloaded sources')
+
+    cache_parser.add_argument('--prune', dest='prune',
+                              action='store_true',
+                              help=('Evict least recently used sources until the cache is '
+                                    'within --source-cache-max-size'))
+
+    cache_parser.add_argument('--clear', dest='clear',
+                              action='store_true',
+                              help=('Remove all cached sources'))
+
+    _add_source_cache_arguments(cache_parser)
+
     args = parser.parse_args()
-    if args.download:
-        url, sha256 = download_from_source(args.package,
-                                           organization=args.organization,
-                                           cached=args.cached)
-        print(f'Successfully downloaded {url}\nsha256: {sha256}')
-    else:
-        args.attributes = ' '.join(args.attributes)
-        attr = get_attribute(args.attributes, args.package,
-                             organization=args.organization,
-                             cached=args.cached)
-        print(f'{args.attributes}: {attr}')
+    if args.command == 'cache':
+        _source_cache_handle_args(args)
+        return
+    packages = list(args.packages or [])
+    if args.names is not None:
+        packages.extend(name for name in read_file_to_list(args.names) if name)
+    with _fetch_cache_from_args(args):
+        if args.download:
+            with _source_cache_from_args(args):
+                _download_handle_args(args, packages)
+        else:
+            attributes = [' '.join(attribute) for attribute in args.attributes]
+            results = get_attributes(packages, attributes,
+                                     organization=args.organization,
+                                     cached=args.cached)
+            for package, values in results.items():
+                prefix = f'{package} ' if len(results) > 1 else ''
+                for attribute, value in values.items():
+                    print(f'{prefix}{attribute}: {value}')
 
 
 def dashboard():
@@ -215,9 +379,32 @@ def dashboard():
                         default='README.md', type=str,
                         help=('filepath to markdown file to write output to'))
 
+    parser.add_argument('-j', '--jobs', dest='jobs',
+                        default=None, type=int,
+                        help=('Number of recipes to fetch at once (default is 20)'))
+
+    parser.add_argument('--from-graph', dest='graph',
+                        default=None, type=str,
+                        help=('filepath to graph.json from graph-utils make; rows are built '
+                              'from the recipes stored with the graph without network requests'))
+
+    parser.add_argument('-i', '--incremental', dest='incremental',
+                        action='store_true',
+                        help=('Only look up packages whose recipe changed since the last run '
+                              '(tracked in <write>.index.json) and only rewrite the file if '
+                              'its content changed'))
+
+    _add_fetch_cache_arguments(parser)
+
     args = parser.parse_args()
 
-    create_dashboard(names=args.names)
+    if args.graph is not None:
+        create_dashboard(names=args.names, write_to=args.write, graph=args.graph,
+                         incremental=args.incremental)
+        return
+    with _fetch_cache_from_args(args):
+        create_dashboard(names=args.names, write_to=args.write, max_workers=args.jobs,
+                         incremental=args.incremental)
 
 
 def graph_utils():
@@ -253,6 +440,36 @@ def graph_utils():
                              help=('Maximum number of workers in process pool to build graph '
                                    '(default is 20)'))
 
+    make_parser.add_argument('-e', '--executor', dest='executor',
+                             choices=['thread', 'process', 'async'], default='thread',
+                             type=str,
+                             help=('How to build the graph: thread fetches and parses in '
+                                   'a thread pool, process and async fetch in a thread '
+                                   'pool and parse in a process pool (default is thread)'))
+
+    make_parser.add_argument('--fetch-workers', dest='fetch_workers',
+                             default=None, type=int,
+                             help=('Number of recipes fetched concurrently '
+                                   '(default is --max-workers)'))
+
+    make_parser.add_argument('--parse-workers', dest='parse_workers',
+                             default=None, type=int,
+                             help=('Number of recipes parsed concurrently '
+                                   '(default is --max-workers)'))
+
+    make_parser.add_argument('--write-workers', dest='write_workers',
+                             default=None, type=int,
+                             help=('Number of node attribute files written concurrently '
+                                   '(default is --max-workers)'))
+
+    make_parser.add_argument('-i', '--incremental', dest='incremental',
+                             action='store_true',
+                             help=('Only refetch feedstocks whose default branch has new '
+                                   'commits since the last build (uses ~/.netrc for '
+                                   'authentication)'))
+
+    _add_fetch_cache_arguments(make_parser)
+
     make_parser.set_defaults(func=_make_graph_handle_args)
 
     info_parser = subparsers.add_parser('info',
@@ -260,16 +477,43 @@ def graph_utils():
 
     info_parser.add_argument('-f', '--filepath', dest='filepath',
                              default='graph.json', type=str,
-                             help=('Path to JSON file where the graph is stored'))
+                             help=('Path to JSON file or graph store (.db) where the graph is stored'))
 
     info_parser.add_argument('-p', '--package', dest='package',
+                             default=None, type=str, nargs='+',
+                             help=('Package(s) to get information about'))
+
+    info_parser.add_argument('-n', '--names', dest='names',
                              default=None, type=str,
-                             help=('Package to get information about'))
+                             help=('filepath to text file with more packages to get information '
+                                   'about, one per line (- for stdin)'))
 
     info_parser.add_argument('-q', '--query', dest='query',
-                             choices=['depends_on', 'depends_of'], default=None,
-                             type=str,
-                             help=('Type of information to get from the graph'))
+                             choices=QUERIES, default=None, type=str, nargs='+',
+                             help=('Type(s) of information to get from the graph: direct dependents '
+                                   '(depends_on) or dependencies (depends_of), transitive dependents '
+                                   '(descendants) or dependencies (ancestors), the build order of '
+                                   'the given packages (build_order) or the shortest dependency '
+                                   'path from a package to --target (path)'))
+
+    info_parser.add_argument('--json', dest='json',
+                             action='store_true',
+                             help=('Print one JSON object per package and query (JSON lines)'))
+
+    info_parser.add_argument('-s', '--server', dest='server',
+                             default=None, type=str,
+                             help=('Ask a graph-utils serve server at host:port or at the path '
+                                   'of its Unix socket (optionally prefixed with unix:) instead of loading '
+                                   'the graph'))
+
+    info_parser.add_argument('-d', '--depth', dest='depth',
+                             default=None, type=int,
+                             help=('Maximum number of dependency levels to follow for '
+                                   'descendants and ancestors queries'))
+
+    info_parser.add_argument('-t', '--target', dest='target',
+                             default=None, type=str,
+                             help=('Package that requires --package for path queries'))
 
     info_parser.set_defaults(func=_query_graph_handle_args)
 
@@ -281,11 +525,59 @@ def graph_utils():
                                default='graph.json', type=str,
                                help=('Path to JSON file where the graph is stored'))
 
+    update_parser.add_argument('-j', '--jobs', dest='jobs',
+                               default=None, type=int,
+                               help=('Number of packages to check for new versions at once '
+                                     '(default is 20)'))
+
     update_parser.set_defaults(func=_update_handle_args)
 
+    serve_parser = subparsers.add_parser('serve',
+                                         help=('Load the graph once and answer info queries over '
+                                               'localhost HTTP or a Unix socket'))
+
+    serve_parser.add_argument('-f', '--filepath', dest='filepath',
+                              default='graph.json', type=str,
+                              help=('Path to JSON file or graph store (.db) where the graph is stored'))
+
+    serve_parser.add_argument('--host', dest='host',
+                              default='127.0.0.1', type=str,
+                              help=('Interface to listen on (default is 127.0.0.1)'))
+
+    serve_parser.add_argument('--port', dest='port',
+                              default=DEFAULT_PORT, type=int,
+                              help=(f'Port to listen on (default is {DEFAULT_PORT})'))
+
+    serve_parser.add_argument('--socket', dest='socket',
+                              default=None, type=str,
+                              help=('Listen on this Unix socket instead of --host and --port'))
+
+    serve_parser.add_argument('--interval', dest='interval',
+                              default=2, type=float,
+                              help=('Seconds between checks of the graph file for changes '
+                                    '(default is 2)'))
+
+    serve_parser.set_defaults(func=_serve_handle_args)
+
+    convert_parser = subparsers.add_parser('convert',
+                                           help=('Convert a graph.json and its node_attrs/ to a '
+                                                 'single-file graph store (.db) or back'))
+
+    convert_parser.add_argument('source', type=str,
+                                help=('graph.json or graph store to read'))
+
+    convert_parser.add_argument('destination', type=str,
+                                help=('graph store or graph.json to write'))
+
+    convert_parser.set_defaults(func=_convert_handle_args)
+
     args = parser.parse_args()
 
-    args.func(args)
+    if args.func is _make_graph_handle_args:
+        with _fetch_cache_from_args(args):
+            args.func(args)
+    else:
+        args.func(args)
 
 
 def auto_tick():
@@ -4,10 +4,23 @@ https://github.com/xpdAcq/mission-control/blob/master/tools/update_readme.py
 This version was not importable so the
 functions had to be re-implemented here.
 """
+import hashlib
+import json
+import logging
+import os
+import time
 from urllib.parse import urlparse, ParseResultBytes
 
 from .all_feedstocks import get_all_feedstocks
-from .meta_utils import get_attribute
+from .graph_utils import get_feedstock_shas
+from .meta_utils import get_attributes
+
+logger = logging.getLogger(__name__)
+
+# Number of packages whose recipes are fetched at once
+MAX_WORKERS = 20
+# Appended to the dashboard path to get the path of its index
+INDEX_SUFFIX = '.index.json'
 
 
 def _extract_github_org_and_repo_from_url(url):
@@ -24,18 +37,205 @@ def _extract_github_org_and_repo_from_url(url):
     return ('', '')
 
 
-def _extract_github_org_and_repo(pkg, feedstock_org='nsls-ii-forge'):
+_BADGES = dict(
+    build='[![Build Status](https://dev.azure.com/nsls2forge/nsls2forge/_apis/build/status/{name}-feedstock)]'
+          '(https://dev.azure.com/nsls2forge/nsls2forge/_build)',
+    health='[![Code Health](https://landscape.io/github/nsls-ii-forge/{name}-feedstock/master/'
+           'landscape.svg?style=flat)](https://landscape.io/github/nsls-ii-forge/{name}-feedstock/master)',
+    cf_version='[![conda-forge version](https://img.shields.io/conda/vn/conda-forge/{name})]'
+               '(https://anaconda.org/conda-forge/{name})',
+    nsls_version='[![nsls2forge version](https://img.shields.io/conda/vn/nsls2forge/{name})]'
+                 '(https://anaconda.org/nsls2forge/{name})',
+    defaults_version='[![defaults version](https://img.shields.io/conda/vn/anaconda/{name})]'
+                     '(https://anaconda.org/anaconda/{name})',
+    pypi_version='[![PyPI version](https://img.shields.io/pypi/v/{name})](https://pypi.org/project/{name}/)',
+    github_version='[![GitHub version](https://img.shields.io/github/v/tag/{org}/{repo})]'
+                   '(https://github.com/{org}/{repo})',
+    downloads='[![Downloads](https://img.shields.io/conda/dn/nsls2forge/{name})]'
+              '(https://anaconda.org/nsls2forge/{name})')
+
+_ROW_STRING = ('|{index}|[{name}](https://github.com/nsls-ii-forge/{name}-feedstock)|{build} <br/> {health}'
+               '|{nsls_version} <br/> {pypi_version} <br/> {defaults_version} <br/> '
+               '{cf_version} <br/> {github_version}|{downloads}|\n')
+
+HEADER = ('# Feedstock Packages Build Status\n\n'
+          '| # | Repo | Build <br/> Health | nsls2forge <br/> PyPI <br/> defaults <br/> conda-forge <br/>'
+          ' GitHub <br/> Versions | Downloads|\n|:---:|:-------:|'
+          ':-----------:|---------------:|:--------------:|\n')
+
+
+def _compile_row_template(row_string, badges):
+    '''
+    Substitutes the badges into the row once so that each row
+    only needs a single format call for its own fields
+    '''
+    fields = {field: '{' + field + '}' for field in ('index', 'name', 'org', 'repo')}
+    return row_string.format(**badges, **fields)
+
+
+ROW_TEMPLATE = _compile_row_template(_ROW_STRING, _BADGES)
+
+
+def _org_and_repo_from_about(about):
     # get org from home url
-    home_str = get_attribute('about home', pkg, feedstock_org)
-    org, repo = _extract_github_org_and_repo_from_url(home_str)
+    org, repo = _extract_github_org_and_repo_from_url(about.get('about home'))
     # if home url failed try dev_url
     if org == '':
-        dev_url = get_attribute('about dev_url', pkg, feedstock_org)
-        org, repo = _extract_github_org_and_repo_from_url(dev_url)
+        org, repo = _extract_github_org_and_repo_from_url(about.get('about dev_url'))
     return org, repo
 
 
-def create_dashboard_from_list(names=[]):
+def _extract_github_org_and_repo(pkg, feedstock_org='nsls-ii-forge'):
+    about = get_attributes([pkg], ['about home', 'about dev_url'], feedstock_org)[pkg]
+    return _org_and_repo_from_about(about)
+
+
+def read_graph_about(graph_path):
+    '''
+    Reads the about home and dev_url of every feedstock in a graph.json
+    written by graph-utils make from the node attributes stored next
+    to it, without any network requests.
+
+    Parameters
+    ----------
+    graph_path: str
+        Path to graph.json. Node attributes are read from the
+        node_attrs/ directory in the same directory.
+
+    Returns
+    -------
+    dict
+        Maps each feedstock name to a dict with 'about home' and
+        'about dev_url', like meta_utils.get_attributes. Archived and
+        stub nodes without a recipe are left out.
+    '''
+    with open(graph_path, 'r') as f:
+        graph = json.load(f)
+    graph_dir = os.path.dirname(os.path.abspath(graph_path))
+    about = {}
+    for node in graph['nodes']:
+        payload = node.get('payload')
+        if isinstance(payload, dict) and '__lazy_json__' in payload:
+            try:
+                with open(os.path.join(graph_dir, payload['__lazy_json__']), 'r') as f:
+                    payload = json.load(f)
+            except FileNotFoundError:
+                continue
+        if not isinstance(payload, dict) or payload.get('archived'):
+            continue
+        meta_yaml = payload.get('meta_yaml')
+        if not meta_yaml:
+            continue
+        node_about = meta_yaml.get('about') or {}
+        about[node['id']] = {'about home': node_about.get('home'),
+                             'about dev_url': node_about.get('dev_url')}
+    return about
+
+
+def _extract_all_github_orgs_and_repos(names, max_workers=None, feedstock_org='nsls-ii-forge'):
+    '''
+    Looks up the upstream GitHub org and repo of every package,
+    fetching all of their recipes in one batch.
+
+    Returns
+    -------
+    list
+        (org, repo) tuples in the order of names
+    '''
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    start = time.time()
+    about = get_attributes(names, ['about home', 'about dev_url'], feedstock_org,
+                           max_connections=max_workers)
+    results = [_org_and_repo_from_about(about[pkg]) for pkg in names]
+    print(f'Formatted {len(names)} packages in {time.time() - start:.2f}s '
+          f'with {max_workers} connections')
+    return results
+
+
+def _lookup_orgs_and_repos(names, max_workers=None, about=None):
+    if about is None:
+        return _extract_all_github_orgs_and_repos(names, max_workers=max_workers)
+    return [_org_and_repo_from_about(about.get(pkg, {})) for pkg in names]
+
+
+def iter_dashboard(names, org_repos):
+    '''
+    Yields the table header and then one row per package
+
+    Parameters
+    ----------
+    names: list
+        Feedstock package names in the order of the rows
+    org_repos: list
+        Upstream (org, repo) on GitHub of each package
+
+    Yields
+    ------
+    str
+        Markdown lines of the table
+    '''
+    yield HEADER
+    row_format = ROW_TEMPLATE.format
+    for i, (pkg, (org, repo)) in enumerate(zip(names, org_repos), 1):
+        yield row_format(index=i, name=pkg, org=org, repo=repo or pkg)
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _load_index(index_path):
+    try:
+        with open(index_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _recipe_hashes(names, about=None, organization='nsls-ii-forge'):
+    '''
+    Returns a hash per package that changes whenever the part of its
+    recipe used by the dashboard may have changed: the about fields
+    when they are already known, otherwise the commit at the head of
+    its feedstock. Packages whose hash is unknown map to None.
+    '''
+    if about is not None:
+        return {pkg: _sha256(json.dumps(about.get(pkg, {}), sort_keys=True)) for pkg in names}
+    try:
+        return get_feedstock_shas(names, organization)
+    except Exception as e:
+        logger.warning(f'Could not get feedstock commits, regenerating all rows: {e!r}')
+        return {pkg: None for pkg in names}
+
+
+def _incremental_orgs_and_repos(names, index, max_workers=None, about=None):
+    '''
+    Reuses the org and repo of every package whose recipe hash matches
+    the one in index and only looks up the others.
+
+    Returns
+    -------
+    tuple
+        (org, repo) tuples in the order of names and the updated
+        index rows
+    '''
+    old_rows = index.get('rows', {})
+    hashes = _recipe_hashes(names, about=about)
+    stale = [pkg for pkg in names
+             if hashes.get(pkg) is None or old_rows.get(pkg, {}).get('recipe') != hashes[pkg]]
+    fresh = dict(zip(stale, _lookup_orgs_and_repos(stale, max_workers=max_workers, about=about)))
+    org_repos = [fresh[pkg] if pkg in fresh else tuple(old_rows[pkg]['org_repo']) for pkg in names]
+    n_new = sum(1 for pkg in stale if pkg not in old_rows)
+    n_removed = sum(1 for pkg in old_rows if pkg not in hashes)
+    print(f'Dashboard rows: {len(names) - len(stale)} unchanged, {len(stale) - n_new} recomputed, '
+          f'{n_new} added, {n_removed} removed')
+    rows = {pkg: {'recipe': hashes.get(pkg), 'org_repo': list(org_repo)}
+            for pkg, org_repo in zip(names, org_repos)}
+    return org_repos, rows
+
+
+def create_dashboard_from_list(names=[], max_workers=None, about=None):
     '''
     Creates a table of packages with their build status, health, versions,
     and downloads. Feedstocks must be from the nsls-ii-forge GitHub organization.
@@ -44,50 +244,23 @@ def create_dashboard_from_list(names=[]):
     ----------
     names: list
         List of feedstock package names to use as entries in the dashboard
+    max_workers: int, optional
+        Number of recipes fetched at once. Default is MAX_WORKERS.
+    about: dict, optional
+        'about home' and 'about dev_url' of each package, e.g. from
+        read_graph_about. When given, no recipes are fetched.
 
     Returns
     -------
     str
         Dashboard content in formatted string
     '''
-    main_format = dict(
-      build='[![Build Status](https://dev.azure.com/nsls2forge/nsls2forge/_apis/build/status/{name}-feedstock)]'
-            '(https://dev.azure.com/nsls2forge/nsls2forge/_build)',
-      health='[![Code Health](https://landscape.io/github/nsls-ii-forge/{name}-feedstock/master/'
-             'landscape.svg?style=flat)](https://landscape.io/github/nsls-ii-forge/{name}-feedstock/master)',
-      cf_version='[![conda-forge version](https://img.shields.io/conda/vn/conda-forge/{name})]'
-                 '(https://anaconda.org/conda-forge/{name})',
-      nsls_version='[![nsls2forge version](https://img.shields.io/conda/vn/nsls2forge/{name})]'
-                   '(https://anaconda.org/nsls2forge/{name})',
-      defaults_version='[![defaults version](https://img.shields.io/conda/vn/anaconda/{name})]'
-                       '(https://anaconda.org/anaconda/{name})',
-      pypi_version='[![PyPI version](https://img.shields.io/pypi/v/{name})](https://pypi.org/project/{name}/)',
-      github_version='[![GitHub version](https://img.shields.io/github/v/tag/{org}/{repo})]'
-                     '(https://github.com/{org}/{repo})',
-      downloads='[![Downloads](https://img.shields.io/conda/dn/nsls2forge/{name})]'
-                '(https://anaconda.org/nsls2forge/{name})')
-
-    row_string = ('|{index}|[{name}](https://github.com/nsls-ii-forge/{name}-feedstock)|{build} <br/> {health}'
-                  '|{nsls_version} <br/> {pypi_version} <br/> {defaults_version} <br/> '
-                  '{cf_version} <br/> {github_version}|{downloads}|\n')
-    header = ('# Feedstock Packages Build Status\n\n'
-              '| # | Repo | Build <br/> Health | nsls2forge <br/> PyPI <br/> defaults <br/> conda-forge <br/>'
-              ' GitHub <br/> Versions | Downloads|\n|:---:|:-------:|'
-              ':-----------:|---------------:|:--------------:|\n')
-
-    dashboard = header
-    for i, pkg in enumerate(names):
-        print(f'Formatting {pkg}...')
-        org, repo = _extract_github_org_and_repo(pkg)
-        if repo == '':
-            repo = pkg
-        tmp = row_string.format(**main_format, index=(i+1), name=pkg,
-                                org=org, repo=repo)
-        dashboard += tmp.format(name=pkg, org=org, repo=repo)
-    return dashboard
-
-
-def create_dashboard(names=None, write_to='README.md'):
+    org_repos = _lookup_orgs_and_repos(names, max_workers=max_workers, about=about)
+    return ''.join(iter_dashboard(names, org_repos))
+
+
+def create_dashboard(names=None, write_to='README.md', max_workers=None, graph=None,
+                     incremental=False):
     '''
     Creates a table of packages with their build status, health, conda-forge version,
     nsls2forge version, PyPI version, Anaconda version, GitHub version,
@@ -101,6 +274,17 @@ def create_dashboard(names=None, write_to='README.md'):
         without the -feedstock suffix
     write_to: str, optional
         filepath to markdown file to write output to
+    max_workers: int, optional
+        Number of recipes fetched at once. Default is MAX_WORKERS.
+    graph: str, optional
+        Path to a graph.json written by graph-utils make. Rows are built
+        from the recipes stored with the graph instead of fetching them,
+        and all feedstocks in the graph are listed unless names is given.
+    incremental: bool, optional
+        Keep an index next to write_to with the recipe hash and upstream
+        GitHub org/repo of every row, only look up packages whose recipe
+        changed since the last run, and only rewrite write_to if its
+        content changed.
 
     Returns
     -------
@@ -109,13 +293,42 @@ def create_dashboard(names=None, write_to='README.md'):
     '''
     description = '''# Project Management\nReleases, Installers, Specs, and more!\n'''
     out = description
-    if names is None:
+    about = None
+    if graph is not None:
+        about = read_graph_about(graph)
+    if names is not None:
+        pkgs = sorted(get_all_feedstocks(cached=True, filepath=names))
+    elif about is not None:
+        pkgs = sorted(about)
+    else:
         pkgs = sorted(get_all_feedstocks(organization='nsls-ii-forge'))
+    if not incremental:
+        org_repos = _lookup_orgs_and_repos(pkgs, max_workers=max_workers, about=about)
+        with open(write_to, 'w') as f:
+            f.write(out)
+            f.writelines(iter_dashboard(pkgs, org_repos))
+        return len(pkgs)
+
+    index_path = write_to + INDEX_SUFFIX
+    index = _load_index(index_path)
+    org_repos, rows = _incremental_orgs_and_repos(pkgs, index, max_workers=max_workers,
+                                                  about=about)
+    out += ''.join(iter_dashboard(pkgs, org_repos))
+    content_hash = _sha256(out)
+    try:
+        with open(write_to, 'r') as f:
+            unchanged = _sha256(f.read()) == content_hash
+    except FileNotFoundError:
+        unchanged = False
+    if unchanged:
+        print(f'{write_to} is up to date')
     else:
-        pkgs = sorted(get_all_feedstocks(cached=True, filepath=names))
-    out += create_dashboard_from_list(pkgs)
-    with open(write_to, 'w') as f:
-        f.write(out)
+        with open(write_to, 'w') as f:
+            f.write(out)
+    new_index = {'content': content_hash, 'rows': rows}
+    if new_index != index:
+        with open(index_path, 'w') as f:
+            json.dump(new_index, f, indent=1, sort_keys=True)
     return len(pkgs)
 
 
@@ -0,0 +1,255 @@
+'''
+Transitive queries on the dependency graph built by graph-utils make.
+Edges point from a dependency to the packages that require it.
+
+A GraphIndex collapses the strongly connected components of the graph
+(packages that depend on each other in a cycle) and stores, for every
+component, the set of components reachable from it and the set that
+reach it as bitsets, so transitive queries only cost as much as the
+size of their answer.
+'''
+import weakref
+from collections import deque
+
+import networkx as nx
+
+QUERIES = ('depends_on', 'depends_of', 'descendants', 'ancestors', 'build_order', 'path')
+
+_INDEXES = weakref.WeakKeyDictionary()
+
+
+def _bits(bitset):
+    '''
+    Yields the positions of the bits set in bitset
+    '''
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+
+class GraphIndex:
+    '''
+    Reachability index of a dependency graph
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Graph with packages as nodes and edges from each dependency
+        to the packages that require it
+    '''
+    def __init__(self, gx):
+        self._gx = weakref.ref(gx)
+        self.n_nodes = gx.number_of_nodes()
+        self.n_edges = gx.number_of_edges()
+        cgx = nx.condensation(gx)
+        # number the components in build order so that bit positions
+        # double as topological ranks
+        order = list(nx.lexicographical_topological_sort(
+            cgx, key=lambda c: min(cgx.nodes[c]['members'])))
+        position = {c: i for i, c in enumerate(order)}
+        self.members = [sorted(cgx.nodes[c]['members']) for c in order]
+        self.component = {node: position[cgx.graph['mapping'][node]] for node in gx.nodes}
+        successors = [[position[s] for s in cgx.successors(c)] for c in order]
+        predecessors = [[position[p] for p in cgx.predecessors(c)] for c in order]
+        self.descendant_bits = [0] * len(order)
+        for i in reversed(range(len(order))):
+            bits = 0
+            for s in successors[i]:
+                bits |= (1 << s) | self.descendant_bits[s]
+            self.descendant_bits[i] = bits
+        self.ancestor_bits = [0] * len(order)
+        for i in range(len(order)):
+            bits = 0
+            for p in predecessors[i]:
+                bits |= (1 << p) | self.ancestor_bits[p]
+            self.ancestor_bits[i] = bits
+
+    @property
+    def gx(self):
+        return self._gx()
+
+    def is_current(self, gx):
+        '''
+        Returns whether the index still matches gx. Only detects changes
+        that add or remove nodes or edges.
+        '''
+        return (gx is self.gx and gx.number_of_nodes() == self.n_nodes
+                and gx.number_of_edges() == self.n_edges)
+
+    def _check(self, pkg):
+        if pkg not in self.component:
+            raise KeyError(f'{pkg} is not in the graph')
+        return self.component[pkg]
+
+    def _expand(self, bitset, exclude=None):
+        return [node for c in _bits(bitset) for node in self.members[c] if node != exclude]
+
+    def _bounded(self, pkg, depth, neighbors):
+        seen = {pkg: 0}
+        queue = deque([pkg])
+        while queue:
+            node = queue.popleft()
+            if seen[node] == depth:
+                continue
+            for other in neighbors(node):
+                if other not in seen:
+                    seen[other] = seen[node] + 1
+                    queue.append(other)
+        del seen[pkg]
+        return self.build_order(seen)
+
+    def descendants(self, pkg, depth=None):
+        '''
+        Returns every package that requires pkg directly or transitively,
+        i.e. everything that must be rebuilt if pkg changes, in build order
+
+        Parameters
+        ----------
+        pkg: str
+            Name of software package
+        depth: int, optional
+            Only follow this many dependency edges from pkg
+        '''
+        c = self._check(pkg)
+        if depth is not None:
+            return self._bounded(pkg, depth, self.gx.successors)
+        bits = self.descendant_bits[c]
+        if len(self.members[c]) > 1:
+            bits |= 1 << c
+        return self._expand(bits, exclude=pkg)
+
+    def ancestors(self, pkg, depth=None):
+        '''
+        Returns every package that pkg requires directly or transitively,
+        i.e. its full build closure, in build order
+
+        Parameters
+        ----------
+        pkg: str
+            Name of software package
+        depth: int, optional
+            Only follow this many dependency edges from pkg
+        '''
+        c = self._check(pkg)
+        if depth is not None:
+            return self._bounded(pkg, depth, self.gx.predecessors)
+        bits = self.ancestor_bits[c]
+        if len(self.members[c]) > 1:
+            bits |= 1 << c
+        return self._expand(bits, exclude=pkg)
+
+    def requires(self, pkg, dependency):
+        '''
+        Returns whether pkg requires dependency directly or transitively
+        '''
+        c = self._check(pkg)
+        d = self._check(dependency)
+        if c == d:
+            return pkg != dependency or len(self.members[c]) > 1
+        return bool(self.ancestor_bits[c] >> d & 1)
+
+    def build_order(self, pkgs):
+        '''
+        Sorts packages so that every package comes after the packages
+        it depends on. Packages that depend on each other in a cycle
+        are sorted by name.
+        '''
+        for pkg in pkgs:
+            self._check(pkg)
+        return sorted(set(pkgs), key=lambda pkg: (self.component[pkg], pkg))
+
+    def shortest_path(self, dependency, pkg):
+        '''
+        Returns the shortest chain of packages from dependency to a
+        package pkg that requires it, or None if pkg does not require
+        dependency
+        '''
+        if not self.requires(pkg, dependency):
+            return None
+        return nx.shortest_path(self.gx, dependency, pkg)
+
+
+def graph_index(gx):
+    '''
+    Returns the GraphIndex of gx, building it the first time it is
+    requested and again whenever nodes or edges were added or removed
+    '''
+    index = _INDEXES.get(gx)
+    if index is None or not index.is_current(gx):
+        index = GraphIndex(gx)
+        _INDEXES[gx] = index
+    return index
+
+
+def answer_query(gx, query, package, depth=None, target=None):
+    '''
+    Answers one query about package
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Dependency graph
+    query: str
+        One of QUERIES except build_order
+    package: str
+        Name of software package
+    depth: int, optional
+        Maximum number of dependency levels for descendants and ancestors
+    target: str, optional
+        Package that requires package for path queries
+
+    Returns
+    -------
+    list or None
+        Package names, or the dependency path from package to target
+        (None if there is none)
+    '''
+    if package not in gx:
+        raise KeyError(f'{package} is not in the graph')
+    if query == 'depends_on':
+        return list(gx.successors(package))
+    if query == 'depends_of':
+        return list(gx.predecessors(package))
+    if query == 'descendants':
+        return graph_index(gx).descendants(package, depth=depth)
+    if query == 'ancestors':
+        return graph_index(gx).ancestors(package, depth=depth)
+    if query == 'path':
+        if target is None:
+            raise ValueError('a target is required for path queries')
+        return graph_index(gx).shortest_path(package, target)
+    raise ValueError(f'Unknown query type: {query}')
+
+
+def run_queries(gx, queries, packages, depth=None, target=None):
+    '''
+    Answers several queries about many packages against one graph
+
+    Yields
+    ------
+    dict
+        query, package (and target for path queries) and result of each
+        query for each package, or error instead of result if it could
+        not be answered.
+        build_order is answered once for all packages, with packages
+        instead of package.
+    '''
+    for query in queries:
+        if query == 'build_order':
+            answer = {'query': query, 'packages': list(packages)}
+            try:
+                answer['result'] = graph_index(gx).build_order(packages)
+            except KeyError as e:
+                answer['error'] = e.args[0]
+            yield answer
+            continue
+        for package in packages:
+            answer = {'query': query, 'package': package}
+            if query == 'path':
+                answer['target'] = target
+            try:
+                answer['result'] = answer_query(gx, query, package, depth=depth, target=target)
+            except (KeyError, ValueError) as e:
+                answer['error'] = e.args[0]
+            yield answer
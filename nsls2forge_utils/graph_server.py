@@ -0,0 +1,280 @@
+'''
+Long-running dependency graph query server. The graph is loaded once,
+reloaded in the background when its file changes, and queries are
+answered as JSON over localhost HTTP or a Unix socket.
+
+Queries are sent as a POST to /query with a JSON body like
+{"queries": ["descendants"], "packages": ["numpy"], "depth": null,
+"target": null} and answered with {"answers": [...]} where every answer
+is a dict as yielded by graph_query.run_queries. GET /status describes
+the loaded graph.
+'''
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .graph_query import graph_index, run_queries
+from .graph_store import load_graph_readonly
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+
+class _GraphRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/status':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        self._send_json(200, self.server.graph.status())
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            answers = self.server.graph.query(request.get('queries', []),
+                                              request.get('packages', []),
+                                              depth=request.get('depth'),
+                                              target=request.get('target'))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            self._send_json(400, {'error': repr(e)})
+            return
+        except Exception as e:
+            logger.exception(f'Could not answer {self.path}')
+            self._send_json(500, {'error': repr(e)})
+            return
+        self._send_json(200, {'answers': answers})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class ServedGraph:
+    '''
+    Dependency graph that is reloaded when its file changes
+
+    Parameters
+    ----------
+    path: str
+        Path to graph.json or a graph store
+    interval: float, optional
+        Seconds between checks of the file for changes
+    '''
+    def __init__(self, path, interval=2):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.gx = None
+        self.loaded = None
+        self.reload()
+
+    def reload(self):
+        '''
+        Loads the graph if its file changed since it was last loaded.
+        Returns whether it was reloaded.
+        '''
+        start = time.time()
+        gx = load_graph_readonly(self.path)
+        if gx is self.gx:
+            return False
+        # build the reachability index before answering queries from it
+        graph_index(gx)
+        with self._lock:
+            self.gx = gx
+            self.loaded = time.time()
+        logger.info(f'Loaded {self.path} ({gx.number_of_nodes()} nodes) '
+                    f'in {time.time() - start:.2f}s')
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f'Could not reload {self.path}: {e!r}')
+
+    def start_watching(self):
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    def query(self, queries, packages, depth=None, target=None):
+        with self._lock:
+            gx = self.gx
+        return list(run_queries(gx, queries, packages, depth=depth, target=target))
+
+    def status(self):
+        with self._lock:
+            gx = self.gx
+            loaded = self.loaded
+        return {'path': os.path.abspath(self.path), 'nodes': gx.number_of_nodes(),
+                'edges': gx.number_of_edges(), 'loaded': loaded}
+
+
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def make_server(path, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None, interval=2):
+    '''
+    Creates a server answering queries about the graph at path
+
+    Parameters
+    ----------
+    path: str
+        Path to graph.json or a graph store
+    host: str, optional
+        Interface to listen on. Default is localhost only.
+    port: int, optional
+        Port to listen on. Default is DEFAULT_PORT, 0 picks a free port.
+    socket_path: str, optional
+        Listen on this Unix socket instead of host and port
+    interval: float, optional
+        Seconds between checks of the graph file for changes
+
+    Returns
+    -------
+    socketserver.BaseServer
+        Call serve_forever() to start answering queries. server.graph is
+        the ServedGraph, which is already watching the graph file.
+    '''
+    graph = ServedGraph(path, interval=interval)
+    if socket_path is not None:
+        if _is_socket(socket_path):
+            # left behind by a server that did not shut down cleanly
+            os.remove(socket_path)
+        elif os.path.exists(socket_path):
+            raise FileExistsError(f'{socket_path} exists and is not a socket')
+        server = _UnixHTTPServer(socket_path, _GraphRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _GraphRequestHandler)
+        server.daemon_threads = True
+    server.graph = graph
+    graph.start_watching()
+    return server
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class GraphClient:
+    '''
+    Client of a graph-utils serve server
+
+    Parameters
+    ----------
+    address: str
+        host:port or http://host:port of a server listening on TCP,
+        or the path of its Unix socket, optionally prefixed with unix:
+    timeout: float, optional
+        Seconds to wait for an answer
+
+    Examples
+    --------
+    >>> GraphClient('localhost:8765').query(['depends_on'], ['numpy'])
+    [{'query': 'depends_on', 'package': 'numpy', 'result': ['scipy']}]
+    '''
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.address.startswith('unix:'):
+            return _UnixHTTPConnection(self.address[len('unix:'):], timeout=self.timeout)
+        if _is_socket(self.address):
+            return _UnixHTTPConnection(self.address, timeout=self.timeout)
+        host = self.address.split('://', 1)[-1].rstrip('/')
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _request(self, method, path, data=None):
+        conn = self._connection()
+        try:
+            body = None if data is None else json.dumps(data)
+            headers = {} if data is None else {'Content-Type': 'application/json'}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        try:
+            result = json.loads(body)
+        except ValueError:
+            raise RuntimeError(f'Graph server error {response.status}: {body[:200]!r}')
+        if response.status != 200:
+            raise RuntimeError(f'Graph server error {response.status}: {result.get("error")}')
+        return result
+
+    def query(self, queries, packages, depth=None, target=None):
+        '''
+        Answers queries like graph_query.run_queries on the server
+
+        Returns
+        -------
+        list
+            One dict per answer
+        '''
+        return self._request('POST', '/query', {'queries': list(queries),
+                                                'packages': list(packages),
+                                                'depth': depth, 'target': target})['answers']
+
+    def status(self):
+        return self._request('GET', '/status')
+
+
+def _serve_handle_args(args):
+    server = make_server(args.filepath, host=args.host, port=args.port,
+                         socket_path=args.socket, interval=args.interval)
+    where = args.socket or '{}:{}'.format(*server.server_address[:2])
+    print(f'Serving {args.filepath} on {where} (Ctrl-C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.graph.stop_watching()
+        server.server_close()
+        if args.socket is not None and _is_socket(args.socket):
+            os.remove(args.socket)
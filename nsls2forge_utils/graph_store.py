@@ -0,0 +1,332 @@
+'''
+Single-file SQLite store for the dependency graph built by graph-utils make.
+
+graph.json only lists node names and edges, and every node's attributes
+live in a separate node_attrs/{name}.json file, so answering one query
+means parsing the whole graph and resolving its lazy payloads. The store
+keeps nodes, indexed edges and payloads in one database that can be
+opened read-only and loaded in milliseconds, and converts to and from
+the graph.json layout for compatibility with conda_forge_tick.
+'''
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+GRAPH_STORE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+# Bytes of a graph store SQLite may memory-map instead of reading
+MMAP_SIZE = 256 * 1024 * 1024
+# Number of loaded graphs kept by load_graph_readonly
+GRAPH_CACHE_SIZE = 4
+
+_GRAPH_CACHE = OrderedDict()
+_GRAPH_CACHE_LOCK = threading.Lock()
+
+_SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    attrs TEXT NOT NULL,
+    payload TEXT
+);
+CREATE TABLE edges (
+    src INTEGER NOT NULL REFERENCES nodes(id),
+    dst INTEGER NOT NULL REFERENCES nodes(id),
+    attrs TEXT,
+    PRIMARY KEY (src, dst)
+) WITHOUT ROWID;
+CREATE INDEX edges_dst ON edges (dst, src);
+'''
+
+
+def is_graph_store(path):
+    '''
+    Returns whether path names a graph store rather than a graph.json
+    '''
+    return path.endswith(GRAPH_STORE_SUFFIXES)
+
+
+def _read_payload(payload, graph_dir):
+    if isinstance(payload, dict) and '__lazy_json__' in payload:
+        try:
+            with open(os.path.join(graph_dir, payload['__lazy_json__']), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            logger.warning(f'Missing node attributes {payload["__lazy_json__"]}')
+            return None
+    if payload is None:
+        return None
+    return json.dumps(payload, sort_keys=True)
+
+
+def import_graph_json(graph_path, store_path):
+    '''
+    Creates a graph store from a graph.json written by graph-utils make,
+    including the node attributes in the node_attrs/ directory next to it.
+    An existing store at store_path is replaced.
+
+    Parameters
+    ----------
+    graph_path: str
+        Path to graph.json
+    store_path: str
+        Path of the store to create
+
+    Returns
+    -------
+    int
+        Number of nodes in the store
+    '''
+    with open(graph_path, 'r') as f:
+        data = json.load(f)
+    graph_dir = os.path.dirname(os.path.abspath(graph_path))
+    edges_key = 'links' if 'links' in data else 'edges'
+    tmp_path = f'{store_path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_SCHEMA)
+        meta = {
+            'graph': json.dumps(data.get('graph', {}), sort_keys=True),
+            'directed': json.dumps(data.get('directed', True)),
+            'multigraph': json.dumps(data.get('multigraph', False)),
+            'edges_key': edges_key,
+        }
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', meta.items())
+        ids = {}
+        rows = []
+        for i, node in enumerate(data['nodes']):
+            node = dict(node)
+            name = node.pop('id')
+            payload = _read_payload(node.pop('payload', None), graph_dir)
+            ids[name] = i
+            rows.append((i, name, json.dumps(node, sort_keys=True), payload))
+        conn.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?)', rows)
+        edges = []
+        for edge in data.get(edges_key, []):
+            edge = dict(edge)
+            src = ids[edge.pop('source')]
+            dst = ids[edge.pop('target')]
+            edges.append((src, dst, json.dumps(edge, sort_keys=True) if edge else None))
+        conn.executemany('INSERT OR REPLACE INTO edges VALUES (?, ?, ?)', edges)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, store_path)
+    return len(rows)
+
+
+def export_graph_json(store_path, graph_path):
+    '''
+    Writes a graph store back to a graph.json and the node_attrs/
+    directory next to it, in the layout conda_forge_tick's load_graph reads
+
+    Parameters
+    ----------
+    store_path: str
+        Path to the graph store
+    graph_path: str
+        Path of the graph.json to write
+
+    Returns
+    -------
+    int
+        Number of nodes written
+    '''
+    graph_dir = os.path.dirname(os.path.abspath(graph_path))
+    with GraphStore(store_path) as store:
+        meta = store.meta
+        names = {}
+        nodes = []
+        for node_id, name, attrs, payload in store.conn.execute(
+                'SELECT id, name, attrs, payload FROM nodes ORDER BY id'):
+            names[node_id] = name
+            node = {'id': name, **json.loads(attrs)}
+            if payload is not None:
+                lazy_path = f'node_attrs/{name}.json'
+                os.makedirs(os.path.join(graph_dir, 'node_attrs'), exist_ok=True)
+                with open(os.path.join(graph_dir, lazy_path), 'w') as f:
+                    f.write(payload)
+                node['payload'] = {'__lazy_json__': lazy_path}
+            nodes.append(node)
+        edges = []
+        for src, dst, attrs in store.conn.execute('SELECT src, dst, attrs FROM edges'):
+            edges.append({'source': names[src], 'target': names[dst],
+                          **(json.loads(attrs) if attrs else {})})
+    data = {
+        'directed': json.loads(meta['directed']),
+        'multigraph': json.loads(meta['multigraph']),
+        'graph': json.loads(meta['graph']),
+        'nodes': nodes,
+        meta['edges_key']: edges,
+    }
+    with open(graph_path, 'w') as f:
+        json.dump(data, f, sort_keys=True, indent=1)
+    return len(nodes)
+
+
+class GraphStore:
+    '''
+    Read-only view of a graph store
+
+    Parameters
+    ----------
+    path: str
+        Path to the store created by import_graph_json
+
+    Examples
+    --------
+    >>> with GraphStore('graph.db') as store:
+    ...     store.successors('numpy')
+    '''
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True,
+                                    check_same_thread=False)
+        self.conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        self.meta = dict(self.conn.execute('SELECT key, value FROM meta'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def nodes(self):
+        return [name for name, in self.conn.execute('SELECT name FROM nodes ORDER BY id')]
+
+    def __contains__(self, name):
+        return self.conn.execute('SELECT 1 FROM nodes WHERE name = ?', (name,)).fetchone() is not None
+
+    def successors(self, name):
+        '''
+        Returns the packages that require name
+        '''
+        return [row[0] for row in self.conn.execute(
+            'SELECT d.name FROM nodes s JOIN edges e ON e.src = s.id '
+            'JOIN nodes d ON d.id = e.dst WHERE s.name = ? ORDER BY d.id', (name,))]
+
+    def predecessors(self, name):
+        '''
+        Returns the packages that name requires
+        '''
+        return [row[0] for row in self.conn.execute(
+            'SELECT s.name FROM nodes d JOIN edges e ON e.dst = d.id '
+            'JOIN nodes s ON s.id = e.src WHERE d.name = ? ORDER BY s.id', (name,))]
+
+    def payload(self, name):
+        '''
+        Returns the node attributes of name as stored in node_attrs/,
+        or None if it has none
+        '''
+        row = self.conn.execute('SELECT payload FROM nodes WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(f'{name} is not in the graph')
+        return None if row[0] is None else json.loads(row[0])
+
+    def to_networkx(self):
+        '''
+        Builds the dependency graph without node payloads, which is
+        enough for all dependency queries
+
+        Returns
+        -------
+        nx.DiGraph
+        '''
+        gx = nx.DiGraph()
+        gx.graph.update(json.loads(self.meta['graph']))
+        names = {}
+        for node_id, name, attrs in self.conn.execute('SELECT id, name, attrs FROM nodes ORDER BY id'):
+            names[node_id] = name
+            gx.add_node(name, **json.loads(attrs))
+        gx.add_edges_from((names[src], names[dst]) for src, dst in
+                          self.conn.execute('SELECT src, dst FROM edges'))
+        return gx
+
+
+def load_graph_store(path):
+    '''
+    Loads the dependency graph from a graph store without node payloads
+    '''
+    with GraphStore(path) as store:
+        return store.to_networkx()
+
+
+def load_graph_json(path):
+    '''
+    Loads the dependency graph from a graph.json without resolving
+    node payloads, so node_attrs/ is not read and conda_forge_tick
+    is not needed
+    '''
+    with open(path, 'rb') as f:
+        data = json.load(f)
+    gx = nx.DiGraph()
+    gx.graph.update(data.get('graph', {}))
+    for node in data['nodes']:
+        attrs = {k: v for k, v in node.items() if k not in ('id', 'payload')}
+        gx.add_node(node['id'], **attrs)
+    edges = data['links'] if 'links' in data else data.get('edges', [])
+    gx.add_edges_from((edge['source'], edge['target']) for edge in edges)
+    return gx
+
+
+def load_graph_readonly(path='graph.json'):
+    '''
+    Loads the dependency graph at path for queries, from a graph.json
+    or a graph store, without node payloads. The file is only read, and
+    the GRAPH_CACHE_SIZE most recently loaded graphs are kept in memory
+    until their file changes, so repeated calls are free. The returned
+    graph is shared and must not be modified.
+
+    Parameters
+    ----------
+    path: str, optional
+        Path to graph.json or a graph store. Default is graph.json.
+
+    Returns
+    -------
+    nx.DiGraph
+    '''
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _GRAPH_CACHE_LOCK:
+        cached = _GRAPH_CACHE.get(key)
+        if cached is not None and cached[0] == stamp:
+            _GRAPH_CACHE.move_to_end(key)
+            return cached[1]
+    if is_graph_store(path):
+        gx = load_graph_store(path)
+    else:
+        gx = load_graph_json(path)
+    with _GRAPH_CACHE_LOCK:
+        _GRAPH_CACHE[key] = (stamp, gx)
+        _GRAPH_CACHE.move_to_end(key)
+        while len(_GRAPH_CACHE) > GRAPH_CACHE_SIZE:
+            _GRAPH_CACHE.popitem(last=False)
+    return gx
+
+
+def _convert_handle_args(args):
+    if is_graph_store(args.source) and not is_graph_store(args.destination):
+        n_nodes = export_graph_json(args.source, args.destination)
+    elif is_graph_store(args.destination) and not is_graph_store(args.source):
+        n_nodes = import_graph_json(args.source, args.destination)
+    else:
+        print('ERROR: Exactly one of the files must be a graph store '
+              f'({", ".join(GRAPH_STORE_SUFFIXES)}). Use -h or --help for help.')
+        return
+    print(f'Converted {n_nodes} nodes from {args.source} to {args.destination}')
@@ -6,17 +6,24 @@ here and reimplemented.
 We still import some functionality from conda_forge_tick
 '''
 import re
+import asyncio
+import json
 import logging
+import multiprocessing
 import os
+import sys
 import time
-from concurrent.futures import as_completed
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import networkx as nx
-from shutil import copyfile
 
 from .all_feedstocks import get_all_feedstocks
-from .io import _fetch_file
+from .graph_query import run_queries
+from .graph_server import GraphClient
+from .graph_store import is_graph_store, load_graph_readonly
+from .io import fetch_files, read_file_to_list, _github_graphql
+from .pipeline import Pipeline, Stage
+from .versions import update_upstream_versions
 
 logger = logging.getLogger(__name__)
 pin_sep_pat = re.compile(r" |>|<|=|\[")
@@ -24,9 +31,95 @@ pin_sep_pat = re.compile(r" |>|<|=|\[")
 MAX_WORKERS = 20
 NUM_GITHUB_THREADS = 2
 DEBUG = False
+# one of BUILDERS
+EXECUTOR = "thread"
+# workers per stage of the graph build, MAX_WORKERS if None
+FETCH_WORKERS = None
+PARSE_WORKERS = None
+WRITE_WORKERS = None
+RECIPE_FILES = ("recipe/meta.yaml", "conda-forge.yml")
+SHA_BATCH_SIZE = 100
 
 
-def get_attrs(name, organization):
+def _node_attrs(name):
+    '''
+    Returns the LazyJson holding the attributes of the node name
+    in node_attrs/{name}.json
+    '''
+    from conda_forge_tick.utils import LazyJson
+    return LazyJson(f"node_attrs/{name}.json")
+
+
+def _fetch_recipe_files(name, organization, branches=None, complete=None):
+    '''
+    Fetches the meta.yaml and conda-forge.yml of a feedstock
+
+    Parameters
+    ----------
+    name: str
+        Feedstock repo name to fetch recipe files from
+    organization: str
+        Name of GitHub organization containing feedstock repos.
+    branches: dict, optional
+        Default branch of feedstocks, master for feedstocks not in it
+    complete: set, optional
+        name is added to it if both files were fetched
+
+    Returns
+    -------
+    tuple
+        (meta_yaml, conda_forge_yaml) as text, or requests.Response
+        for files that could not be fetched
+    '''
+    branch = (branches or {}).get(name) or "master"
+    files = fetch_files(organization, [(name, path) for path in RECIPE_FILES], branch=branch)
+    for result in files.values():
+        if isinstance(result, Exception):
+            raise result
+    if complete is not None and all(isinstance(text, str) for text in files.values()):
+        complete.add(name)
+    return files[(name, "recipe/meta.yaml")], files[(name, "conda-forge.yml")]
+
+
+def _parse_attrs(name, meta_yaml, conda_forge_yaml):
+    '''
+    Parses the recipe files of a feedstock into node attributes.
+    Runs in worker processes when parsing with a process pool.
+
+    Returns
+    -------
+    attrs: dict
+        Feedstock attributes parsed from the recipe files
+    '''
+    from conda_forge_tick.make_graph import populate_feedstock_attributes
+    attrs = {}
+    populate_feedstock_attributes(
+        name,
+        attrs,
+        meta_yaml=meta_yaml,
+        conda_forge_yaml=conda_forge_yaml
+    )
+    return attrs
+
+
+def _write_attrs(name, attrs):
+    '''
+    Merges parsed attributes into node_attrs/{name}.json, keeping
+    attributes added by the bot (e.g. PRed) from previous runs
+
+    Returns
+    -------
+    tuple
+        Requirements index entry of the feedstock (see _requirements_entry)
+    '''
+    lzj = _node_attrs(name)
+    with lzj as sub_graph:
+        sub_graph.update(attrs)
+        entry = _requirements_entry(sub_graph)
+    return entry
+
+
+def get_attrs(name, organization, index=None, branches=None, complete=None):
     '''
     Generates node attributes for feedstocks from their recipe files
 
@@ -36,6 +129,13 @@ def get_attrs(name, organization):
         Feedstock repo name to fetch recipe files from
     organization: str
         Name of GitHub organization containing feedstock repos.
+    index: dict, optional
+        Requirements index to add the feedstock's entry to
+        (see _requirements_entry) while its attributes are loaded
+    branches: dict, optional
+        Default branch of feedstocks, master for feedstocks not in it
+    complete: set, optional
+        name is added to it if all recipe files were fetched
 
     Returns
     -------
@@ -43,26 +143,127 @@ def get_attrs(name, organization):
         Dictionary containing feedstock attributes with ability to dump
         to a JSON file
     '''
-    # These fetches could be done via async/multiprocessing
-    from conda_forge_tick.make_graph import populate_feedstock_attributes
-    from conda_forge_tick.utils import LazyJson
-    meta_yaml = _fetch_file(organization, name, "recipe/meta.yaml")
-    conda_forge_yaml = _fetch_file(organization, name, "conda-forge.yml")
+    meta_yaml, conda_forge_yaml = _fetch_recipe_files(name, organization, branches=branches,
+                                                      complete=complete)
+    entry = _write_attrs(name, _parse_attrs(name, meta_yaml, conda_forge_yaml))
+    if index is not None:
+        index[name] = entry
+    return _node_attrs(name)
 
-    lzj = LazyJson(f"node_attrs/{name}.json")
-    with lzj as sub_graph:
-        populate_feedstock_attributes(
-            name,
-            sub_graph,
-            meta_yaml=meta_yaml,
-            conda_forge_yaml=conda_forge_yaml
+
+def get_feedstock_shas(names, organization, token=None, url=None, branches=None):
+    '''
+    Gets the commit SHA at the head of the default branch of each feedstock
+    using batched GitHub GraphQL queries
+
+    Parameters
+    ----------
+    names: list
+        Feedstock repo names without the -feedstock suffix
+    organization: str
+        Name of GitHub organization containing feedstock repos.
+    token: str, optional
+        GitHub token for authentication. Uses value from ~/.netrc if not specified.
+    url: str, optional
+        GraphQL endpoint to query. Default is the GitHub API.
+    branches: dict, optional
+        The name of each feedstock's default branch is added to it
+
+    Returns
+    -------
+    shas: dict
+        Maps each name to its commit SHA, or None if the
+        repository or its default branch could not be found
+    '''
+    shas = {}
+    for start in range(0, len(names), SHA_BATCH_SIZE):
+        batch = names[start:start + SHA_BATCH_SIZE]
+        fields = " ".join(
+            f"r{i}: repository(owner: {json.dumps(organization)}, "
+            f"name: {json.dumps(name + '-feedstock')}) "
+            "{ defaultBranchRef { name target { oid } } }"
+            for i, name in enumerate(batch)
         )
-    return lzj
+        data = _github_graphql(f"query {{ {fields} }}", token=token, url=url)
+        for i, name in enumerate(batch):
+            repo = data.get(f"r{i}") or {}
+            ref = repo.get("defaultBranchRef") or {}
+            shas[name] = (ref.get("target") or {}).get("oid")
+            if branches is not None and ref.get("name"):
+                branches[name] = ref["name"]
+    return shas
+
+
+def _names_to_refresh(gx, names, shas):
+    '''
+    Returns the names whose nodes are missing or whose recorded
+    commit SHA differs from the one in shas
+    '''
+    return [
+        name for name in names
+        if name not in gx.nodes
+        or shas.get(name) is None
+        or gx.nodes[name].get("sha") != shas[name]
+    ]
+
+
+def _add_payload(gx, name, new_names, payload):
+    sub_graph = {"payload": payload}
+    if name in new_names:
+        gx.add_node(name, **sub_graph)
+    else:
+        gx.nodes[name].update(**sub_graph)
+
+
+class _Progress:
+    '''
+    Logs the number of feedstocks left to build and an estimated time
+    until the build finishes
+    '''
+    def __init__(self, n_tot):
+        self.n_tot = n_tot
+        self.n_left = n_tot
+        self.start = time.time()
+        self.eta = -1
+
+    def done(self, name, error=None):
+        self.n_left -= 1
+        if self.n_left % 10 == 0:
+            self.eta = (time.time() - self.start) / (self.n_tot - self.n_left) * self.n_left
+        if error is None:
+            logger.info("itr % 5d - eta % 5ds: finished %s", self.n_left, self.eta, name)
+        else:
+            logger.error(
+                "itr % 5d - eta % 5ds: Error adding %s to the graph: %s",
+                self.n_left,
+                self.eta,
+                name,
+                repr(error),
+            )
+
+
+def _process_pool(max_workers):
+    '''
+    Returns a pool of processes for parsing recipes. The pool starts its
+    workers lazily from threads that may hold the HTTP session's or
+    logging's locks, so they are spawned instead of forked, which could
+    deadlock on a lock copied while held.
+    '''
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context("spawn"))
+
 
+def _stage_workers(workers):
+    return MAX_WORKERS if workers is None else workers
 
-def _build_graph_process_pool(gx, names, new_names, organization):
+
+def _build_graph_pipeline(gx, names, new_names, organization, index=None,
+                          branches=None, complete=None, parse_in_processes=False):
     '''
-    Builds feedstock dependency graph using multiprocessing.
+    Builds feedstock dependency graph with a pipeline of fetch, parse
+    and write stages which each have their own workers (FETCH_WORKERS,
+    PARSE_WORKERS and WRITE_WORKERS) and bounded queues between them.
+    Statistics about each stage are printed when the build finishes.
 
     Parameters
     ----------
@@ -74,46 +275,162 @@ def _build_graph_process_pool(gx, names, new_names, organization):
         Subset of names containing new feedstock repo names
     organization: str
         Name of GitHub organization containing feedstock repos.
+    index: dict, optional
+        Requirements index to add entries for built feedstocks to
+    branches: dict, optional
+        Default branch of feedstocks, master for feedstocks not in it
+    complete: set, optional
+        Names of feedstocks whose recipe files were all fetched are added to it
+    parse_in_processes: bool, optional
+        Parse recipe files in a pool of processes instead of threads
+
+    Returns
+    -------
+    built: list
+        Names of feedstocks that were successfully added/updated
+    '''
+    parse_workers = _stage_workers(PARSE_WORKERS)
+    cpu_pool = None
+    if parse_in_processes:
+        cpu_pool = _process_pool(parse_workers)
+
+    def fetch(name, _):
+        return _fetch_recipe_files(name, organization, branches=branches, complete=complete)
+
+    def parse(name, files):
+        if cpu_pool is None:
+            return _parse_attrs(name, *files)
+        return cpu_pool.submit(_parse_attrs, name, *files).result()
+
+    pipeline = Pipeline([
+        Stage("fetch", fetch, _stage_workers(FETCH_WORKERS)),
+        Stage("parse", parse, parse_workers),
+        Stage("write", _write_attrs, _stage_workers(WRITE_WORKERS)),
+    ])
+    built = []
+    progress = _Progress(len(names))
+    results = pipeline.run((name, None) for name in names)
+    try:
+        for name, entry, error in results:
+            progress.done(name, error=error)
+            if error is not None:
+                continue
+            if index is not None:
+                index[name] = entry
+            _add_payload(gx, name, new_names, _node_attrs(name))
+            built.append(name)
+    finally:
+        # stops the pipeline's threads if adding a feedstock failed
+        results.close()
+        if cpu_pool is not None:
+            cpu_pool.shutdown()
+    print('Stage statistics:')
+    for line in pipeline.format_stats():
+        print(f'  {line}')
+    return built
+
+
+def _build_graph_thread_pool(gx, names, new_names, organization, index=None,
+                             branches=None, complete=None):
+    '''
+    Builds feedstock dependency graph, parsing recipe files in threads.
+    See _build_graph_pipeline.
     '''
-    from conda_forge_tick.utils import executor
-    with executor("thread", max_workers=MAX_WORKERS) as pool:
-        futures = {
-            pool.submit(get_attrs, name, organization): name
-            for name in names
-        }
-        logger.info("submitted all nodes")
-
-        n_tot = len(futures)
-        n_left = len(futures)
-        start = time.time()
-        eta = -1
-        for f in as_completed(futures):
-            n_left -= 1
-            if n_left % 10 == 0:
-                eta = (time.time() - start) / (n_tot - n_left) * n_left
-            name = futures[f]
-            try:
-                sub_graph = {"payload": f.result()}
-                logger.info("itr % 5d - eta % 5ds: finished %s", n_left, eta, name)
-            except Exception as e:
-                logger.error(
-                    "itr % 5d - eta % 5ds: Error adding %s to the graph: %s",
-                    n_left,
-                    eta,
-                    name,
-                    repr(e),
-                )
-            else:
-                if name in new_names:
-                    gx.add_node(name, **sub_graph)
-                else:
-                    gx.nodes[name].update(**sub_graph)
-
-
-def _build_graph_sequential(gx, names, new_names, organization):
+    return _build_graph_pipeline(gx, names, new_names, organization, index=index,
+                                 branches=branches, complete=complete)
+
+
+def _build_graph_process_pool(gx, names, new_names, organization, index=None,
+                              branches=None, complete=None):
+    '''
+    Builds feedstock dependency graph, parsing recipe files in a pool of
+    processes. See _build_graph_pipeline.
+    '''
+    return _build_graph_pipeline(gx, names, new_names, organization, index=index,
+                                 branches=branches, complete=complete,
+                                 parse_in_processes=True)
+
+
+def _build_graph_async(gx, names, new_names, organization, index=None,
+                       branches=None, complete=None):
+    '''
+    Builds feedstock dependency graph from an asyncio event loop which
+    fetches recipe files and writes attributes in a pool of threads and
+    parses them in a pool of processes, merging feedstocks into gx as
+    they finish. Each stage is limited to FETCH_WORKERS, PARSE_WORKERS
+    and WRITE_WORKERS concurrent items.
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Directional graph to update/add nodes
+    names: list
+        Full list of feedstock repo names
+    new_names: list
+        Subset of names containing new feedstock repo names
+    organization: str
+        Name of GitHub organization containing feedstock repos.
+    index: dict, optional
+        Requirements index to add entries for built feedstocks to
+    branches: dict, optional
+        Default branch of feedstocks, master for feedstocks not in it
+    complete: set, optional
+        Names of feedstocks whose recipe files were all fetched are added to it
+
+    Returns
+    -------
+    built: list
+        Names of feedstocks that were successfully added/updated
+    '''
+    async def build(loop, io_pool, cpu_pool, limits, name):
+        fetch_limit, parse_limit, write_limit = limits
+        try:
+            async with fetch_limit:
+                meta_yaml, conda_forge_yaml = await loop.run_in_executor(
+                    io_pool, _fetch_recipe_files, name, organization, branches, complete)
+            async with parse_limit:
+                attrs = await loop.run_in_executor(
+                    cpu_pool, _parse_attrs, name, meta_yaml, conda_forge_yaml)
+            async with write_limit:
+                entry = await loop.run_in_executor(io_pool, _write_attrs, name, attrs)
+        except Exception as e:
+            return name, None, e
+        return name, entry, None
+
+    async def build_all():
+        loop = asyncio.get_running_loop()
+        built = []
+        fetch_workers = _stage_workers(FETCH_WORKERS)
+        parse_workers = _stage_workers(PARSE_WORKERS)
+        write_workers = _stage_workers(WRITE_WORKERS)
+        limits = (asyncio.Semaphore(fetch_workers), asyncio.Semaphore(parse_workers),
+                  asyncio.Semaphore(write_workers))
+        with ThreadPoolExecutor(max_workers=fetch_workers + write_workers) as io_pool, \
+                _process_pool(parse_workers) as cpu_pool:
+            tasks = [build(loop, io_pool, cpu_pool, limits, name) for name in names]
+            logger.info("submitted all nodes")
+            progress = _Progress(len(tasks))
+            for task in asyncio.as_completed(tasks):
+                name, entry, error = await task
+                progress.done(name, error=error)
+                if error is not None:
+                    continue
+                if index is not None:
+                    index[name] = entry
+                _add_payload(gx, name, new_names, _node_attrs(name))
+                built.append(name)
+        return built
+
+    if not names:
+        return []
+    return asyncio.run(build_all())
+
+
+def _build_graph_sequential(gx, names, new_names, organization, index=None,
+                            branches=None, complete=None):
     '''
     Builds feedstock dependency graph. Useful for debugging.
-    Use _build_graph_process_pool instead.
+    Use one of the BUILDERS instead.
 
     Parameters
     ----------
@@ -125,22 +442,195 @@ def _build_graph_sequential(gx, names, new_names, organization):
         Subset of names containing new feedstock repo names.
     organization: str
         Name of GitHub organization containing feedstock repos.
+    index: dict, optional
+        Requirements index to add entries for built feedstocks to
+    branches: dict, optional
+        Default branch of feedstocks, master for feedstocks not in it
+    complete: set, optional
+        Names of feedstocks whose recipe files were all fetched are added to it
+
+    Returns
+    -------
+    built: list
+        Names of feedstocks that were successfully added/updated
     '''
+    built = []
     for name in names:
         try:
-            sub_graph = {
-                "payload": get_attrs(name, organization)
-            }
+            payload = get_attrs(name, organization, index, branches=branches,
+                                complete=complete)
         except Exception as e:
             logger.error(f"Error adding {name} to the graph: {e}")
         else:
-            if name in new_names:
-                gx.add_node(name, **sub_graph)
-            else:
-                gx.nodes[name].update(**sub_graph)
+            _add_payload(gx, name, new_names, payload)
+            built.append(name)
+    return built
+
+
+BUILDERS = {
+    "thread": _build_graph_thread_pool,
+    "process": _build_graph_process_pool,
+    "async": _build_graph_async,
+}
+
+
+def _requirements_entry(attrs):
+    '''
+    Extracts the data needed to infer edges from feedstock attributes
+
+    Parameters
+    ----------
+    attrs: dict or LazyJson
+        Feedstock attributes
+
+    Returns
+    -------
+    tuple
+        (requirements, outputs_names, strong_exports) where requirements
+        maps each section to a set of package names
+    '''
+    requirements = {
+        section: set(reqs)
+        for section, reqs in (attrs.get("requirements") or {}).items()
+    }
+    return (
+        requirements,
+        set(attrs.get("outputs_names", [])),
+        attrs.get("strong_exports", False),
+    )
+
+
+def _dependency_snapshot(gx, index=None):
+    '''
+    Collects the requirements index entry of every node so that edges can
+    be rebuilt without copying or rewriting the payloads
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Graph with feedstock attributes stored in node payloads
+    index: dict, optional
+        Entries already collected while fetching, the payloads
+        of these nodes are not read again
+
+    Returns
+    -------
+    snapshot: dict
+        Maps node names to their requirements index entry
+        (see _requirements_entry), ordered like gx.nodes
+    '''
+    if index is None:
+        index = {}
+    snapshot = {}
+    for node_name, node in gx.nodes.items():
+        if node_name in index:
+            snapshot[node_name] = index[node_name]
+        else:
+            snapshot[node_name] = _requirements_entry(node.get("payload") or {})
+    return snapshot
+
 
+def _infer_edges(gx, snapshot):
+    '''
+    Rebuilds all edges of the dependency graph in memory from a snapshot
+    of node requirements. Packages which aren't feedstocks or outputs are
+    added as stub nodes without a payload.
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Graph with feedstock attributes stored in node payloads
+    snapshot: dict
+        Output of _dependency_snapshot(gx)
 
-def make_graph(names, organization, gx=None):
+    Returns
+    -------
+    gx: nx.DiGraph
+        Copy of gx with the same nodes and only the inferred edges
+    strong_export_updates: dict
+        Maps node names to the strong run exports missing
+        from their host/run requirements
+    stubs: list
+        Names of the stub nodes that were added
+    '''
+    # make the outputs look up table so we can link properly
+    outputs_lut = {
+        k: node_name
+        for node_name, (_, outputs_names, _) in snapshot.items()
+        for k in outputs_names
+    }
+    strong_exports = {
+        node_name
+        for node_name, (_, _, strong) in snapshot.items()
+        if strong
+    }
+    # This drops all the edge data and only keeps the node data
+    gx = nx.create_empty_copy(gx)
+    # add this as an attr so we can use later
+    gx.graph["outputs_lut"] = outputs_lut
+    strong_export_updates = {}
+    stubs = []
+    # TODO: label these edges with the kind of dep they are and their platform
+    for node, (requirements, _, _) in snapshot.items():
+        # replace output package names with feedstock names via LUT
+        deps = {outputs_lut.get(x, x) for x in set().union(*requirements.values())}
+
+        # handle strong run exports
+        overlap = deps & strong_exports
+        if requirements and (overlap - requirements["host"] or overlap - requirements["run"]):
+            strong_export_updates[node] = overlap
+
+        for dep in deps:
+            if dep not in gx.nodes:
+                # for packages which aren't feedstocks and aren't outputs
+                # usually these are stubs
+                gx.add_node(dep)
+                stubs.append(dep)
+            gx.add_edge(dep, node)
+    return gx, strong_export_updates, stubs
+
+
+def _flush_node_attrs(gx, strong_export_updates, stubs):
+    '''
+    Writes the results of edge inference to node_attrs/ in one batch
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Graph returned by _infer_edges
+    strong_export_updates: dict
+        Maps node names to strong run exports to add to their
+        host/run requirements
+    stubs: list
+        Names of nodes that need a stub payload
+    '''
+    def _add_strong_exports(node, overlap):
+        with gx.nodes[node]["payload"] as attrs:
+            attrs["requirements"]["host"].update(overlap)
+            attrs["requirements"]["run"].update(overlap)
+
+    def _make_stub(dep):
+        lzj = _node_attrs(dep)
+        lzj.update(feedstock_name=dep, bad=False, archived=True)
+        return lzj
+
+    if not strong_export_updates and not stubs:
+        return
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [
+            pool.submit(_add_strong_exports, node, overlap)
+            for node, overlap in strong_export_updates.items()
+        ]
+        stub_payloads = pool.map(_make_stub, stubs)
+        for dep, lzj in zip(stubs, stub_payloads):
+            gx.nodes[dep]["payload"] = lzj
+        for f in futures:
+            f.result()
+    logger.info(f"updated {len(strong_export_updates)} nodes with strong run exports "
+                f"and added {len(stubs)} stub nodes")
+
+
+def make_graph(names, organization, gx=None, incremental=False):
     '''
     Creates/Updates a dependency graph based on names of packages.
     The dependency graph is used to decide which packages
@@ -154,6 +644,9 @@ def make_graph(names, organization, gx=None):
         Name of GitHub organization containing feedstock repos.
     gx: nx.DiGraph, optional
         Dependency graph to be updated.
+    incremental: bool, optional
+        Only refetch attributes of feedstocks whose default branch
+        has moved since the commit SHA recorded on their node.
 
     Returns
     -------
@@ -161,7 +654,6 @@ def make_graph(names, organization, gx=None):
         New/Updated dependency graph displaying the relationships
         between packages listed in names.
     '''
-    from conda_forge_tick.utils import LazyJson
     logger.info("reading graph")
     if gx is None:
         print('Creating graph from scratch...')
@@ -173,81 +665,54 @@ def make_graph(names, organization, gx=None):
     assert gx is not None
     old_names = sorted(old_names, key=lambda n: gx.nodes[n].get("time", 0))
     total_names = new_names + old_names
+    shas = {}
+    branches = {}
+    if incremental:
+        print('Checking feedstocks for new commits...')
+        shas = get_feedstock_shas(total_names, organization, branches=branches)
+        total_names = _names_to_refresh(gx, total_names, shas)
+        print(f'{len(total_names)} of {len(names)} feedstocks changed')
     logger.info("start feedstock fetch loop")
     print('Fetching feedstock attributes...')
 
-    builder = _build_graph_sequential if DEBUG else _build_graph_process_pool
-    builder(gx, total_names, new_names, organization)
+    builder = _build_graph_sequential if DEBUG else BUILDERS[EXECUTOR]
+    index = {}
+    complete = set()
+    built = builder(gx, total_names, new_names, organization, index,
+                    branches=branches, complete=complete)
+    for name in built:
+        # feedstocks that could not be fetched are retried on the next run
+        if (shas.get(name) is not None and name in complete
+                and not gx.nodes[name]["payload"].get("bad")):
+            gx.nodes[name]["sha"] = shas[name]
     logger.info("feedstock fetch loop completed")
     print('Finished fetching feedstock attributes')
 
-    gx2 = deepcopy(gx)
     logger.info("inferring nodes and edges")
     print('Creating nodes and edges...')
-    # make the outputs look up table so we can link properly
-    outputs_lut = {
-        k: node_name
-        for node_name, node in gx.nodes.items()
-        for k in node.get("payload", {}).get("outputs_names", [])
-    }
-    # add this as an attr so we can use later
-    gx.graph["outputs_lut"] = outputs_lut
-    strong_exports = {
-        node_name
-        for node_name, node in gx.nodes.items()
-        if node.get("payload").get("strong_exports", False)
-    }
-    # This drops all the edge data and only keeps the node data
-    gx = nx.create_empty_copy(gx)
-    # TODO: label these edges with the kind of dep they are and their platform
-    for node, node_attrs in gx2.nodes.items():
-        with node_attrs["payload"] as attrs:
-            # replace output package names with feedstock names via LUT
-            deps = set(
-                map(
-                    lambda x: outputs_lut.get(x, x),
-                    set().union(*attrs.get("requirements", {}).values()),
-                )
-            )
-
-            # handle strong run exports
-            overlap = deps & strong_exports
-            requirements = attrs.get("requirements")
-            if requirements:
-                requirements["host"].update(overlap)
-                requirements["run"].update(overlap)
-
-        for dep in deps:
-            if dep not in gx.nodes:
-                # for packages which aren't feedstocks and aren't outputs
-                # usually these are stubs
-                lzj = LazyJson(f"node_attrs/{dep}.json")
-                lzj.update(feedstock_name=dep, bad=False, archived=True)
-                gx.add_node(dep, payload=lzj)
-            gx.add_edge(dep, node)
+    gx, strong_export_updates, stubs = _infer_edges(gx, _dependency_snapshot(gx, index))
+    _flush_node_attrs(gx, strong_export_updates, stubs)
     logger.info("new nodes and edges infered")
     print('Dependency graph complete')
     return gx
 
 
-def update_versions_in_graph(gx):
+def update_versions_in_graph(gx, max_workers=None):
     '''
     Updates the version numbers for packages in the graph if new
-    versions are available
+    versions are available, checking upstream sources concurrently
+    (see nsls2forge_utils.versions)
     Stores result in directory ./versions/
 
     Parameters
     ----------
     gx: nx.DiGraph
         Dependency graph to be updated
+    max_workers: int, optional
+        Number of packages checked at once. Default is versions.MAX_WORKERS.
     '''
-    from conda_forge_tick.update_upstream_versions import update_upstream_versions
-    from conda_forge_tick.make_graph import update_nodes_with_new_versions
-    os.makedirs("versions", exist_ok=True)
     print('Fetching new versions from their sources...')
-    update_upstream_versions(gx)
-    print('Updating versions in dependency graph...')
-    update_nodes_with_new_versions(gx)
+    update_upstream_versions(gx, max_workers=max_workers)
     print('Finished')
 
 
@@ -299,6 +764,12 @@ def _make_graph_handle_args(args):
     DEBUG = args.debug
     global MAX_WORKERS
     MAX_WORKERS = args.max_workers
+    global EXECUTOR
+    EXECUTOR = args.executor
+    global FETCH_WORKERS, PARSE_WORKERS, WRITE_WORKERS
+    FETCH_WORKERS = args.fetch_workers
+    PARSE_WORKERS = args.parse_workers
+    WRITE_WORKERS = args.write_workers
     organization = args.organization
     names = get_all_feedstocks(cached=args.cached, filepath=args.filepath,
                                organization=organization)
@@ -306,38 +777,67 @@ def _make_graph_handle_args(args):
         gx = load_graph()
     else:
         gx = None
-    print(f'Using {MAX_WORKERS} workers in process pool')
-    gx = make_graph(names, organization, gx=gx)
+    print(f'Using {MAX_WORKERS} workers with {EXECUTOR} executor')
+    gx = make_graph(names, organization, gx=gx, incremental=args.incremental)
     print("nodes w/o payload:", [k for k, v in gx.nodes.items() if "payload" not in v])
     update_nodes_with_bot_rerun(gx)
     print('Saving graph to graph.json')
     dump_graph(gx)
 
 
+_QUERY_MESSAGES = {
+    'depends_on': 'The following packages require {package} to be installed:',
+    'depends_of': '{package} requires the following packages to be installed:',
+    'descendants': 'The following packages must be rebuilt if {package} changes{depth}:',
+    'ancestors': '{package} is built on the following packages{depth}:',
+    'build_order': 'Build the packages in the following order:',
+}
+
+
+def _print_answer(answer, depth=None):
+    if 'error' in answer:
+        print(f'ERROR: {answer["error"]}')
+    elif answer['query'] == 'path':
+        if answer['result'] is None:
+            print(f'{answer["target"]} does not require {answer["package"]}')
+        else:
+            print(' -> '.join(answer['result']))
+    else:
+        print(_QUERY_MESSAGES[answer['query']].format(
+            package=answer.get('package'),
+            depth=f' (up to {depth} levels)' if depth is not None else ''))
+        for pkg in answer['result']:
+            print(pkg)
+        print(f'Total: {len(answer["result"])}')
+
+
 def _query_graph_handle_args(args):
-    from conda_forge_tick.utils import load_graph
-    if args.filepath != 'graph.json':
-        copyfile(args.filepath, 'graph.json')
-    gx = load_graph()
-    if args.query == 'depends_on':
-        dependencies = list_dependencies_on(gx, args.package)
-        print(f'The following packages require {args.package} to be installed:')
-        for dep in dependencies:
-            print(dep)
-        print(f'Total: {len(dependencies)}')
-    elif args.query == 'depends_of':
-        dependencies = list_dependencies_of(gx, args.package)
-        print(f'{args.package} requires the following packages to be installed:')
-        for dep in dependencies:
-            print(dep)
-        print(f'Total: {len(dependencies)}')
+    if not args.query:
+        print('ERROR: A query type must be specified. Use -h or --help for help.')
+        return
+    packages = list(args.package or [])
+    if args.names == '-':
+        packages.extend(line.strip() for line in sys.stdin if line.strip())
+    elif args.names is not None:
+        packages.extend(name for name in read_file_to_list(args.names) if name)
+    if args.server is not None:
+        answers = GraphClient(args.server).query(args.query, packages, depth=args.depth,
+                                                 target=args.target)
     else:
-        print(f'Unknown query type: {args.query}')
+        gx = load_graph_readonly(args.filepath)
+        answers = run_queries(gx, args.query, packages, depth=args.depth, target=args.target)
+    for answer in answers:
+        if args.json:
+            print(json.dumps(answer))
+        else:
+            _print_answer(answer, depth=args.depth)
 
 
 def _update_handle_args(args):
     from conda_forge_tick.utils import load_graph
-    if args.filepath != 'graph.json':
-        copyfile(args.filepath, 'graph.json')
-    gx = load_graph()
-    update_versions_in_graph(gx)
+    if is_graph_store(args.filepath):
+        print('ERROR: Versions can only be updated in a graph.json. Export the graph '
+              'store with graph-utils convert first.')
+        return
+    gx = load_graph(args.filepath)
+    update_versions_in_graph(gx, max_workers=args.jobs)
@@ -1,4 +1,26 @@
+import atexit
+import logging
+import netrc
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RAW_GITHUB_URL = 'https://raw.githubusercontent.com'
+GITHUB_GRAPHQL_URL = 'https://api.github.com/graphql'
+MAX_CONNECTIONS = 20
+# FetchCache used by _fetch_file when no cache is passed explicitly,
+# see nsls2forge_utils.cache.fetch_cache
+FETCH_CACHE = None
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_POOL = None
+_POOL_LOCK = threading.Lock()
 
 
 def read_file_to_list(path):
@@ -41,7 +63,82 @@ def _write_list_to_file(contents, path, sort=False):
             fp.write(f'{item}\n')
 
 
-def _fetch_file(organization, name, filepath):
+def _get_session():
+    '''
+    Returns the shared HTTP session used for fetching files.
+    Connections are kept alive and pooled so that repeated
+    requests to the same host skip the TCP/TLS handshake.
+    '''
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS,
+                                  pool_maxsize=MAX_CONNECTIONS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SESSION = session
+    return _SESSION
+
+
+def _get_pool():
+    '''
+    Returns the pool of MAX_CONNECTIONS threads shared by all calls
+    of fetch_files, so that small batches do not start threads of
+    their own.
+    '''
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS,
+                                       thread_name_prefix='fetch-files')
+    return _POOL
+
+
+def shutdown_pool(wait=True):
+    '''
+    Shuts down the thread pool of fetch_files and closes the shared
+    HTTP session. Both are created again when next needed. Called at
+    exit.
+
+    Parameters
+    ----------
+    wait: bool, optional
+        Wait for the fetches in progress to finish. Default is True.
+    '''
+    global _POOL, _SESSION
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    with _SESSION_LOCK:
+        session, _SESSION = _SESSION, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+    if session is not None:
+        session.close()
+
+
+def _reset_after_fork():
+    # the threads of the pool do not exist in the child and the locks
+    # may have been held by them; the session's sockets stay with the
+    # parent, so both are dropped without being shut down or closed
+    global _POOL, _POOL_LOCK, _SESSION, _SESSION_LOCK
+    _POOL, _POOL_LOCK = None, threading.Lock()
+    _SESSION, _SESSION_LOCK = None, threading.Lock()
+
+
+atexit.register(shutdown_pool)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _raw_file_url(organization, name, filepath, branch='master', base_url=None):
+    if base_url is None:
+        base_url = RAW_GITHUB_URL
+    return f"{base_url}/{organization}/{name}-feedstock/{branch}/{filepath}"
+
+
+def _fetch_file(organization, name, filepath, branch='master', base_url=None,
+                cache=None):
     '''
     Fetches a file from specified GitHub organization and
     returns the text
@@ -54,11 +151,36 @@ def _fetch_file(organization, name, filepath):
         Feedstock repository name belonging to organization
     filepath: str
         Path to requested file in feedstock repository
+    branch: str, optional
+        Branch of the feedstock repository. Default is master.
+    base_url: str, optional
+        Server to fetch raw files from. Default is RAW_GITHUB_URL.
+    cache: FetchCache, optional
+        Cache to revalidate the file against with a conditional request.
+        Default is FETCH_CACHE.
+
+    Returns
+    -------
+    str or requests.Response
+        Text of the file, or the response if the request failed
     '''
-    response = requests.get(
-        "https://raw.githubusercontent.com/"
-        f"{organization}/{name}-feedstock/master/{filepath}",
+    if cache is None:
+        cache = FETCH_CACHE
+    entry = None
+    headers = {}
+    if cache is not None:
+        key = cache.key(organization, name, branch, filepath)
+        entry = cache.get(key)
+        headers = cache.conditional_headers(entry)
+    response = _get_session().get(
+        _raw_file_url(organization, name, filepath, branch=branch, base_url=base_url),
+        headers=headers,
     )
+    if response.status_code == 304 and entry is not None:
+        cache.hit(key)
+        return entry['text']
+    if cache is not None:
+        cache.miss()
     if response.status_code != 200:
         print(
             f"Something odd happened when fetching recipe {name}: {response.status_code}",
@@ -66,4 +188,117 @@ def _fetch_file(organization, name, filepath):
         return response
 
     text = response.content.decode("utf-8")
+    if cache is not None:
+        cache.put(key, text, etag=response.headers.get('ETag'),
+                  last_modified=response.headers.get('Last-Modified'))
     return text
+
+
+def _fetch_file_or_error(organization, name, filepath, branch, base_url, cache):
+    try:
+        return _fetch_file(organization, name, filepath, branch=branch,
+                           base_url=base_url, cache=cache)
+    except Exception as e:
+        return e
+
+
+def fetch_files(organization, files, max_connections=None, branch='master',
+                base_url=None, cache=None):
+    '''
+    Fetches many files from feedstocks in a GitHub organization
+    concurrently over a shared pool of keep-alive connections, using
+    a thread pool shared by all calls. Can be called from any thread,
+    including one running an event loop.
+
+    Parameters
+    ----------
+    organization: str
+        GitHub organization the files belong to
+    files: list
+        (name, filepath) tuples where name is the feedstock name
+        without the -feedstock suffix
+    max_connections: int, optional
+        Maximum number of requests of this call in flight at once,
+        at most MAX_CONNECTIONS. Default is MAX_CONNECTIONS.
+    branch: str, optional
+        Branch of the feedstock repositories. Default is master.
+    base_url: str, optional
+        Server to fetch raw files from. Default is RAW_GITHUB_URL.
+    cache: FetchCache, optional
+        Cache to revalidate files against. Default is FETCH_CACHE.
+
+    Returns
+    -------
+    dict
+        Maps each (name, filepath) tuple to the text of the file,
+        the requests.Response if the request failed, or the exception
+        raised while fetching it
+
+    Examples
+    --------
+    >>> files = fetch_files('nsls-ii-forge', [('event-model', 'recipe/meta.yaml'),
+    ...                                       ('event-model', 'conda-forge.yml')])
+    '''
+    files = [tuple(f) for f in files]
+    if not files:
+        return {}
+    if max_connections is None:
+        max_connections = MAX_CONNECTIONS
+    max_connections = max(1, min(max_connections, len(files)))
+    logger.info(f'Fetching {len(files)} files from {organization} '
+                f'with {max_connections} connections')
+    pool = _get_pool()
+    results = {}
+    pending = {}
+    for name, filepath in files:
+        if len(pending) >= max_connections:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+        future = pool.submit(_fetch_file_or_error, organization, name, filepath,
+                             branch, base_url, cache)
+        pending[future] = (name, filepath)
+    for future, key in pending.items():
+        results[key] = future.result()
+    return {key: results[key] for key in files}
+
+
+def _github_graphql(query, variables=None, token=None, url=None):
+    '''
+    Sends a query to the GitHub GraphQL API.
+
+    Parameters
+    ----------
+    query: str
+        GraphQL query
+    variables: dict, optional
+        Variables referenced by query
+    token: str, optional
+        GitHub token for authentication. Uses value from ~/.netrc if not specified.
+    url: str, optional
+        GraphQL endpoint. Default is GITHUB_GRAPHQL_URL.
+
+    Returns
+    -------
+    dict
+        The data field of the response. Fields that could not be resolved
+        (e.g. repositories that do not exist) are None.
+    '''
+    if url is None:
+        url = GITHUB_GRAPHQL_URL
+    if token is None:
+        netrc_file = netrc.netrc()
+        _, _, token = netrc_file.hosts['github.com']
+    response = _get_session().post(
+        url,
+        json={'query': query, 'variables': variables or {}},
+        headers={'Authorization': f'bearer {token}'},
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f'GitHub GraphQL request failed: {response.status_code}')
+    result = response.json()
+    for error in result.get('errors', []):
+        logger.warning(f'GitHub GraphQL error: {error.get("message")}')
+    if result.get('data') is None:
+        raise RuntimeError('GitHub GraphQL request returned no data')
+    return result['data']
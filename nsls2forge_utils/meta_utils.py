@@ -1,29 +1,165 @@
 import hashlib
+import logging
 import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
-from nsls2forge_utils.io import _fetch_file
+from nsls2forge_utils.io import _get_session, fetch_files
 
+logger = logging.getLogger(__name__)
 
-def _fetch_and_parse_meta_yaml(name, organization=None, cached=False):
+# Maximum number of parsed recipes kept in memory by _get_meta_yamls
+RECIPE_CACHE_SIZE = 256
+# Bytes read and hashed at a time when downloading sources
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# SourceCache consulted before downloading sources,
+# see nsls2forge_utils.cache.source_cache
+SOURCE_CACHE = None
+
+_RECIPE_CACHE = OrderedDict()
+_RECIPE_CACHE_LOCK = threading.Lock()
+
+
+def _read_meta_yaml(name):
+    filepath = f'./{name}-feedstock/recipe/meta.yaml'
+    if not os.path.exists(filepath):
+        filepath = filepath.replace('./', 'feedstocks/', 1)
+    if not os.path.exists(filepath):
+        raise RuntimeError(f'Cached feedstock {name} does not exist. Place '
+                           'cloned repo in ./ or ./feedstocks/ and try again.')
+    with open(filepath, 'r') as f:
+        return f.read()
+
+
+def _fetch_and_parse_meta_yamls(names, organization=None, cached=False,
+                                max_connections=None):
+    '''
+    Returns the parsed meta.yaml of each feedstock in names, or None
+    for recipes that could not be fetched. Remote recipes are fetched
+    in a single fetch_files batch.
+    '''
     from conda_forge_tick.utils import parse_meta_yaml
     if cached:
-        filepath = f'./{name}-feedstock/recipe/meta.yaml'
-        if not os.path.exists(filepath):
-            filepath = filepath.replace('./', 'feedstocks/', 1)
-        if not os.path.exists(filepath):
-            raise RuntimeError(f'Cached feedstock {name} does not exist. Place '
-                               'cloned repo in ./ or ./feedstocks/ and try again.')
-        with open(filepath, 'r') as f:
-            meta_yaml = f.read()
+        texts = {name: _read_meta_yaml(name) for name in names}
     else:
         if organization is None:
-            raise ValueError(f'No organization provided for {name}')
-        meta_yaml = _fetch_file(organization, name, 'recipe/meta.yaml')
-    if isinstance(meta_yaml, requests.Response):
+            raise ValueError(f'No organization provided for {", ".join(names)}')
+        fetched = fetch_files(organization, [(name, 'recipe/meta.yaml') for name in names],
+                              max_connections=max_connections)
+        texts = {name: fetched[(name, 'recipe/meta.yaml')] for name in names}
+    meta_yamls = {}
+    for name, text in texts.items():
+        if isinstance(text, Exception):
+            raise text
+        meta_yamls[name] = None if isinstance(text, requests.Response) else parse_meta_yaml(text)
+    return meta_yamls
+
+
+def _get_meta_yamls(names, organization=None, cached=False, max_connections=None):
+    '''
+    Returns the parsed meta.yaml of each feedstock in names, fetching
+    and parsing each one only the first time it is requested, and all
+    of those not seen before at once. The RECIPE_CACHE_SIZE most
+    recently used recipes are kept, keyed by organization, name and
+    whether they were read from a local clone. Recipes that could not
+    be fetched map to None and are not cached. The returned dicts are
+    shared and must not be modified.
+    '''
+    source = 'cached' if cached else 'remote'
+    meta_yamls = {}
+    with _RECIPE_CACHE_LOCK:
+        for name in names:
+            key = (organization, name, source)
+            if key in _RECIPE_CACHE:
+                _RECIPE_CACHE.move_to_end(key)
+                meta_yamls[name] = _RECIPE_CACHE[key]
+    missing = [name for name in dict.fromkeys(names) if name not in meta_yamls]
+    if missing:
+        fetched = _fetch_and_parse_meta_yamls(missing, organization=organization, cached=cached,
+                                              max_connections=max_connections)
+        meta_yamls.update(fetched)
+        with _RECIPE_CACHE_LOCK:
+            for name, meta_yaml in fetched.items():
+                if meta_yaml is None:
+                    continue
+                key = (organization, name, source)
+                _RECIPE_CACHE[key] = meta_yaml
+                _RECIPE_CACHE.move_to_end(key)
+            while len(_RECIPE_CACHE) > RECIPE_CACHE_SIZE:
+                _RECIPE_CACHE.popitem(last=False)
+    return meta_yamls
+
+
+def _get_meta_yaml(name, organization=None, cached=False):
+    '''
+    Returns the parsed meta.yaml of a feedstock, see _get_meta_yamls
+    '''
+    return _get_meta_yamls([name], organization=organization, cached=cached)[name]
+
+
+def clear_recipe_cache():
+    '''
+    Forgets all parsed recipes, e.g. after feedstocks were updated
+    '''
+    with _RECIPE_CACHE_LOCK:
+        _RECIPE_CACHE.clear()
+
+
+def _lookup_attribute(meta_yaml, attribute):
+    if meta_yaml is None:
         return None
-    return parse_meta_yaml(meta_yaml)
+    curr_attr = meta_yaml
+    for tag in attribute.split(' '):
+        if not isinstance(curr_attr, dict) or tag not in curr_attr:
+            return None
+        curr_attr = curr_attr[tag]
+    return curr_attr
+
+
+def get_attributes(names, attributes, organization=None, cached=False,
+                   max_connections=None):
+    '''
+    Gets several attributes for several packages from their feedstock
+    meta.yaml files, fetching all recipes at once and parsing each
+    recipe only once
+
+    Parameters
+    ----------
+    names: list
+        Package names of feedstocks (must be feedstocks in organization)
+    attributes: list
+        Attributes to get, each in the form accepted by get_attribute
+    organization: str, optional
+        GitHub organization to fetch the meta.yaml files from
+    cached: bool
+        When True, uses local feedstocks/ directory to pull recipes from
+        associated feedstocks
+    max_connections: int, optional
+        Maximum number of recipes fetched at once, see io.fetch_files
+
+    Returns
+    -------
+    dict
+        Maps each name to a dict of attribute to value. Values are None
+        when the attribute or the recipe could not be found.
+
+    Examples
+    --------
+    >>> get_attributes(['event-model'], ['about home', 'about dev_url'],
+    ...                organization='nsls-ii-forge')
+    {'event-model': {'about home': 'https://github.com/bluesky/event-model',
+                     'about dev_url': None}}
+    '''
+    meta_yamls = _get_meta_yamls(names, organization=organization, cached=cached,
+                                 max_connections=max_connections)
+    return {name: {attribute: _lookup_attribute(meta_yamls[name], attribute)
+                   for attribute in attributes}
+            for name in names}
 
 
 def get_attribute(attribute, name, organization=None, cached=False):
@@ -56,23 +192,150 @@ def get_attribute(attribute, name, organization=None, cached=False):
     >>> get_attribute('requirements run', 'event-model', organization='nsls-ii-forge')
     ['python >=3.6', 'jsonschema', 'numpy']
     '''
-    meta_yaml = _fetch_and_parse_meta_yaml(name,
-                                           organization=organization,
-                                           cached=cached)
-    if meta_yaml is None:
+    return get_attributes([name], [attribute], organization=organization,
+                          cached=cached)[name][attribute]
+
+
+def _part_path(url, filename):
+    '''
+    Returns the path partial downloads of url to filename are kept at,
+    so that a partial file is only ever resumed from the same url
+    '''
+    return f'{filename}.{hashlib.sha256(url.encode()).hexdigest()[:12]}.part'
+
+
+def _content_range(response):
+    '''
+    Parses the Content-Range header of a response
+
+    Returns
+    -------
+    tuple
+        (start, total) where start is None for unsatisfied ranges
+        ("bytes */total") and total is None if it is unknown,
+        or None if the header is missing or malformed
+    '''
+    value = response.headers.get('Content-Range', '')
+    unit, _, spec = value.partition(' ')
+    if unit != 'bytes' or '/' not in spec:
         return None
-    tags = attribute.split(' ')
-    curr_attr = meta_yaml
-    for tag in tags:
-        if tag not in curr_attr:
-            return None
-        curr_attr = curr_attr[tag]
-    return curr_attr
+    span, _, total = spec.partition('/')
+    try:
+        total = None if total == '*' else int(total)
+        start = None if span == '*' else int(span.split('-')[0])
+    except ValueError:
+        return None
+    return start, total
+
+
+def _download(url, filename, chunk_size=None):
+    '''
+    Streams url to filename in chunks while computing its sha256 hash.
+    Data is written to a partial file next to filename first, so an
+    interrupted download is resumed with a Range request the next time
+    instead of starting over, and filename only appears once the
+    download is complete. The download starts over if the server's
+    Content-Range does not continue the partial file.
+
+    Parameters
+    ----------
+    url: str
+        URL to download
+    filename: str
+        Path to write the downloaded file to
+    chunk_size: int, optional
+        Bytes to read at a time. Default is DOWNLOAD_CHUNK_SIZE.
+
+    Returns
+    -------
+    str
+        sha256 hash of the downloaded file
+    '''
+    if chunk_size is None:
+        chunk_size = DOWNLOAD_CHUNK_SIZE
+    part = _part_path(url, filename)
+    sha256 = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part):
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+                offset += len(chunk)
+    while True:
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with _get_session().get(url, stream=True, headers=headers) as response:
+            content_range = _content_range(response)
+            if response.status_code == 416 and offset:
+                if content_range is not None and content_range[1] == offset:
+                    # the partial file already holds the whole source
+                    os.replace(part, filename)
+                    return sha256.hexdigest()
+                mode = None
+            elif response.status_code == 206 and offset:
+                mode = 'ab' if content_range is not None and content_range[0] == offset else None
+            elif response.status_code == 200:
+                # the server ignored the Range header, start over
+                sha256 = hashlib.sha256()
+                mode = 'wb'
+            else:
+                raise RuntimeError(f'Failed to get package from {url}: {response.status_code}')
+            if mode is None:
+                logger.warning(f'Partial download of {url} does not match the server, '
+                               'starting over')
+                os.remove(part)
+                sha256 = hashlib.sha256()
+                offset = 0
+                continue
+            with open(part, mode) as f:
+                for chunk in response.raw.stream(chunk_size, decode_content=False):
+                    f.write(chunk)
+                    sha256.update(chunk)
+        break
+    os.replace(part, filename)
+    return sha256.hexdigest()
+
+
+def _fetch_source(url, filename, expected_sha256=None, cache=None):
+    '''
+    Copies a source from the source cache to filename, or downloads it
+    and adds it to the cache if it matches expected_sha256. Sources
+    without expected_sha256 are always downloaded and not cached.
+
+    Returns
+    -------
+    tuple[str, bool]
+        sha256 hash of the file and whether it came from the cache
+    '''
+    if cache is None:
+        cache = SOURCE_CACHE
+    if not expected_sha256:
+        cache = None
+    if cache is not None:
+        path = cache.lookup(expected_sha256)
+        if path is not None:
+            shutil.copyfile(path, filename)
+            return os.path.basename(path), True
+    sha256_hash = _download(url, filename)
+    if cache is not None and expected_sha256.lower() == sha256_hash:
+        cache.add(filename, sha256_hash, url=url)
+    return sha256_hash, False
+
+
+def _recipe_sources(meta_yaml):
+    '''
+    Returns the sources of a recipe as a list, whether source is a
+    single mapping or a list of them
+    '''
+    sources = meta_yaml.get('source') or []
+    if isinstance(sources, dict):
+        sources = [sources]
+    return [source for source in sources if source.get('url')]
 
 
 def download_from_source(name, organization=None, cached=False):
     '''
-    Downloads a package given a feedstock meta.yaml
+    Downloads a package given a feedstock meta.yaml. The source is
+    copied from SOURCE_CACHE instead when it is cached there.
 
     Parameters
     ----------
@@ -88,17 +351,132 @@ def download_from_source(name, organization=None, cached=False):
     -------
     tuple[str, str]
         Source url and sha256 hash for downloaded file
+
+    Raises
+    ------
+    RuntimeError
+        If the download fails or the file does not match source sha256
+        in the recipe. A mismatching file is removed.
     '''
-    meta_yaml = _fetch_and_parse_meta_yaml(name,
-                                           organization=organization,
-                                           cached=cached)
-    url = meta_yaml['source']['url']
+    meta_yaml = _get_meta_yaml(name, organization=organization, cached=cached)
+    source = _recipe_sources(meta_yaml)[0]
+    url = source['url']
+    if isinstance(url, list):
+        url = url[0]
     filename = os.path.split(url)[-1]
-    response = requests.get(url, stream=True)
-    if response.status_code != 200:
-        raise RuntimeError(f'Failed to get package from {url}: {response.status_code}')
-    with open(filename, 'wb') as f:
-        contents = response.raw.read()
-        f.write(contents)
-        sha256_hash = hashlib.sha256(contents).hexdigest()
+    expected = source.get('sha256')
+    sha256_hash, _ = _fetch_source(url, filename, expected_sha256=expected)
+    if expected and expected.lower() != sha256_hash:
+        os.remove(filename)
+        raise RuntimeError(f'sha256 of {url} does not match the recipe: '
+                           f'expected {expected}, got {sha256_hash}')
     return (url, sha256_hash)
+
+
+def _report_entry(name, url=None, expected_sha256=None, error=None):
+    return {
+        'name': name,
+        'url': url,
+        'filename': None,
+        'expected_sha256': expected_sha256.lower() if expected_sha256 else None,
+        'sha256': None,
+        'bytes': 0,
+        'seconds': 0.0,
+        'mb_per_sec': 0.0,
+        'cached': False,
+        'ok': False,
+        'error': error,
+    }
+
+
+def _download_source(name, source, dest_dir='.'):
+    '''
+    Downloads one source of a recipe into dest_dir/name/, trying its
+    mirrors in order until one of them gives a file matching the sha256
+    in the recipe, and returns its report entry
+    '''
+    urls = source['url'] if isinstance(source['url'], list) else [source['url']]
+    expected = source.get('sha256')
+    entry = _report_entry(name, url=urls[0], expected_sha256=expected)
+    # sources of different packages often share a file name (e.g. v1.0.0.tar.gz)
+    package_dir = os.path.join(dest_dir, name)
+    os.makedirs(package_dir, exist_ok=True)
+    start = time.time()
+    for url in urls:
+        filename = os.path.join(package_dir, source.get('fn') or os.path.split(url)[-1])
+        try:
+            sha256_hash, from_cache = _fetch_source(url, filename, expected_sha256=expected)
+        except Exception as e:
+            entry.update(url=url, error=str(e))
+            continue
+        entry.update(url=url, sha256=sha256_hash, cached=from_cache,
+                     bytes=os.path.getsize(filename))
+        if expected and entry['expected_sha256'] != sha256_hash:
+            os.remove(filename)
+            entry.update(filename=None, error=f'sha256 of {url} does not match the recipe')
+            continue
+        entry.update(filename=filename, error=None)
+        break
+    entry['seconds'] = time.time() - start
+    if entry['seconds'] > 0:
+        entry['mb_per_sec'] = entry['bytes'] / entry['seconds'] / 1024**2
+    entry['ok'] = entry['error'] is None
+    return entry
+
+
+def download_sources(names, organization=None, cached=False, max_workers=None,
+                     dest_dir='.'):
+    '''
+    Downloads and verifies the sources of many packages concurrently.
+    Every source of recipes with several sources is downloaded.
+
+    Parameters
+    ----------
+    names: list
+        Package names of feedstocks (must be feedstocks in organization)
+    organization: str, optional
+        GitHub organization to fetch the meta.yaml files from
+    cached: bool
+        When True, uses local feedstocks/ directory to pull recipes from
+        associated feedstocks
+    max_workers: int, optional
+        Number of sources downloaded at once.
+        Default is ThreadPoolExecutor's default.
+    dest_dir: str, optional
+        Directory to write the sources to, in one subdirectory per package.
+        Default is the current directory.
+
+    Returns
+    -------
+    list
+        One dict per source, in the order of names, with name, url,
+        filename, expected_sha256, sha256, bytes, seconds, mb_per_sec,
+        cached, ok and error. ok is False if the download failed or no
+        mirror gave a file matching the sha256 in the recipe. Mismatching
+        files are removed.
+    '''
+    os.makedirs(dest_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        def get_meta_yaml(name):
+            try:
+                return _get_meta_yaml(name, organization=organization, cached=cached)
+            except Exception:
+                return None
+
+        downloads = []
+        for name, meta_yaml in zip(names, pool.map(get_meta_yaml, names)):
+            sources = _recipe_sources(meta_yaml) if meta_yaml is not None else []
+            if not sources:
+                downloads.append((name, None))
+            downloads.extend((name, pool.submit(_download_source, name, source, dest_dir))
+                             for source in sources)
+        report = []
+        for name, future in downloads:
+            if future is None:
+                entry = _report_entry(name, error='no source found in recipe')
+            else:
+                entry = future.result()
+            status = 'ok' if entry['ok'] else f'FAILED: {entry["error"]}'
+            print(f'{name:<30} {entry["mb_per_sec"]:8.2f} MB/s  {status}')
+            report.append(entry)
+    return report
@@ -0,0 +1,235 @@
+'''
+A small staged pipeline where each stage has its own pool of worker
+threads and a bounded input queue, so a slow stage applies backpressure
+to the stages before it instead of letting work pile up in memory.
+'''
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Stop:
+    '''
+    Passed through the queues after the last item. Carries the exception
+    raised while iterating over the items, if any.
+    '''
+    def __init__(self, error=None):
+        self.error = error
+
+
+class Stage:
+    '''
+    One step of a Pipeline.
+
+    Parameters
+    ----------
+    name: str
+        Name of the stage used when logging statistics
+    func: callable
+        Called as func(key, value) for every item and returns the
+        value passed on to the next stage
+    workers: int
+        Number of items the stage processes concurrently
+    queue_size: int, optional
+        Maximum number of items waiting for the stage.
+        Default is twice the number of workers.
+    '''
+    def __init__(self, name, func, workers, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        if queue_size is None:
+            queue_size = 2 * self.workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.start = None
+        self.end = None
+        self._lock = threading.Lock()
+        self._running = self.workers
+
+    def _record(self, elapsed, failed):
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.busy += elapsed
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _worker_done(self):
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+            if last:
+                self.end = time.time()
+        return last
+
+    def stats(self):
+        '''
+        Returns a dict of statistics about the stage: processed and failed
+        item counts, throughput in items/sec over the time the stage was
+        running, utilization of its workers and the current and maximum
+        queue depths.
+        '''
+        end = self.end or time.time()
+        elapsed = max(end - (self.start or end), 1e-9)
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'items_per_sec': self.processed / elapsed,
+            'utilization': self.busy / (elapsed * self.workers),
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+        }
+
+
+class Pipeline:
+    '''
+    Runs items through a sequence of stages. Every stage runs in its own
+    threads, so e.g. network fetches and parsing overlap, and items are
+    yielded as soon as they leave the last stage.
+
+    Parameters
+    ----------
+    stages: list
+        Stage objects in the order items pass through them
+    log_interval: float, optional
+        Seconds between log messages with queue depths and throughput
+    '''
+    def __init__(self, stages, log_interval=10):
+        self.stages = stages
+        self.log_interval = log_interval
+        self._output = queue.Queue()
+        self._cancelled = threading.Event()
+
+    def _work(self, i):
+        stage = self.stages[i]
+        if i + 1 < len(self.stages):
+            next_queue = self.stages[i + 1].queue
+        else:
+            next_queue = self._output
+        while True:
+            item = stage.queue.get()
+            if isinstance(item, _Stop):
+                stop = item
+                break
+            if self._cancelled.is_set():
+                # drain the queue so that nothing blocks on putting into it
+                continue
+            key, value, error = item
+            if error is None:
+                start = time.time()
+                try:
+                    value = stage.func(key, value)
+                except Exception as e:
+                    error = e
+                stage._record(time.time() - start, error is not None)
+            next_queue.put((key, value, error))
+        if stage._worker_done():
+            if i + 1 < len(self.stages):
+                for _ in range(self.stages[i + 1].workers):
+                    next_queue.put(stop)
+            else:
+                next_queue.put(stop)
+
+    def _feed(self, items):
+        first = self.stages[0]
+        stop = _Stop()
+        try:
+            for key, value in items:
+                if self._cancelled.is_set():
+                    break
+                first.queue.put((key, value, None))
+        except Exception as e:
+            stop.error = e
+        for _ in range(first.workers):
+            first.queue.put(stop)
+
+    def close(self):
+        '''
+        Stops a running pipeline. No more items are read or passed to
+        stages; items already being processed are finished and dropped.
+        Called when the consumer of run stops iterating early.
+        '''
+        self._cancelled.set()
+
+    def run(self, items):
+        '''
+        Passes items through all stages.
+
+        Parameters
+        ----------
+        items: iterable
+            (key, value) pairs; value is passed to the first stage
+
+        Yields
+        ------
+        tuple
+            (key, value, error) for every item in the order they finish.
+            value is the output of the last stage and error is the
+            exception raised by the first stage that failed, if any.
+
+        Raises
+        ------
+        Exception
+            Whatever iterating over items raised, after the items read
+            before it have been yielded
+        '''
+        self._cancelled.clear()
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True,
+                                    name='pipeline-feed')]
+        for i, stage in enumerate(self.stages):
+            stage.start = time.time()
+            threads.extend(
+                threading.Thread(target=self._work, args=(i,), daemon=True,
+                                 name=f'pipeline-{stage.name}')
+                for _ in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        last_log = time.time()
+        item = None
+        try:
+            while True:
+                try:
+                    item = self._output.get(timeout=self.log_interval)
+                except queue.Empty:
+                    item = None
+                if time.time() - last_log >= self.log_interval:
+                    self.log_stats()
+                    last_log = time.time()
+                if isinstance(item, _Stop):
+                    break
+                if item is not None:
+                    yield item
+        finally:
+            if not isinstance(item, _Stop):
+                self.close()
+            for thread in threads:
+                thread.join()
+        if item.error is not None:
+            raise item.error
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def format_stats(self):
+        '''
+        Returns one line of statistics per stage
+        '''
+        return [
+            "{stage:<6} {processed:5d} done, {failed:3d} failed, {items_per_sec:7.2f} items/s, "
+            "{busy:3.0f}% busy, queue {queue_depth:3d} (max {max_queue_depth:3d})".format(
+                busy=100 * stats['utilization'], **stats)
+            for stats in self.stats()
+        ]
+
+    def log_stats(self, level=logging.INFO):
+        for line in self.format_stats():
+            logger.log(level, line)
@@ -0,0 +1,211 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer
+)
+
+import pytest
+
+
+class _RawGitHubHandler(SimpleHTTPRequestHandler):
+    '''
+    Serves files laid out like raw.githubusercontent.com
+    ({organization}/{name}-feedstock/{branch}/{filepath}) from a directory,
+    answers conditional requests with ETags and records the client
+    address and path of every request.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def _etag(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return '"{}"'.format(hashlib.sha256(f.read()).hexdigest())
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address, self.path))
+        self.etag = self._etag()
+        if self.etag is not None and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def end_headers(self):
+        if getattr(self, 'etag', None) is not None:
+            self.send_header('ETag', self.etag)
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _GraphQLHandler(BaseHTTPRequestHandler):
+    '''
+    Answers the subset of the GitHub GraphQL API used by this package
+    from the repositories in server.repos.
+    '''
+    protocol_version = 'HTTP/1.1'
+    repository_pat = re.compile(r'(\w+): repository\(owner: "([^"]+)", name: "([^"]+)"\)')
+    first_pat = re.compile(r'first: (\d+)')
+
+    def _organization_repositories(self, query, variables):
+        repos = sorted(self.server.repos.items(),
+                       key=lambda item: item[1]['updatedAt'], reverse=True)
+        first = int(self.first_pat.search(query).group(1))
+        start = int(variables.get('cursor') or 0)
+        page = repos[start:start + first]
+        return {'organization': {'repositories': {
+            'totalCount': len(repos),
+            'pageInfo': {'hasNextPage': start + first < len(repos),
+                         'endCursor': str(start + first)},
+            'nodes': [{'name': name,
+                       'isArchived': repo.get('archived', False),
+                       'pushedAt': repo['updatedAt'],
+                       'updatedAt': repo['updatedAt'],
+                       'defaultBranchRef': {'name': 'master'}}
+                      for name, repo in page],
+        }}}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.queries.append(body)
+        data = {}
+        if 'organization(login' in body['query']:
+            data = self._organization_repositories(body['query'], body['variables'])
+        for alias, _, name in self.repository_pat.findall(body['query']):
+            repo = self.server.repos.get(name)
+            if repo is None:
+                data[alias] = None
+            else:
+                data[alias] = {'defaultBranchRef': {
+                    'name': repo.get('branch', 'master'),
+                    'target': {'oid': repo['oid']},
+                }}
+        payload = json.dumps({'data': data}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _SourceHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the bytes in server.files (path -> bytes) and honours
+    single "bytes=start-" Range requests unless server.ranges is False.
+    If server.range_start is set, ranges start there instead of where
+    the client asked.
+    Records the Range header of every request.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        range_header = self.headers.get('Range')
+        self.server.ranges_requested.append(range_header)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        start = 0
+        if range_header and self.server.ranges:
+            start = int(range_header[len('bytes='):].rstrip('-'))
+            if self.server.range_start is not None:
+                start = self.server.range_start
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+@pytest.fixture
+def github_graphql():
+    '''
+    Local stand-in for the GitHub GraphQL API.
+    Repositories are added to server.repos
+    (name -> {'oid': ..., 'updatedAt': ..., 'archived': ..., 'branch': ...}) and
+    the URL to pass as url is server.url.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _GraphQLHandler)
+    server.daemon_threads = True
+    server.repos = {}
+    server.queries = []
+    server.url = _serve(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def raw_github(tmp_path):
+    '''
+    Local stand-in for raw.githubusercontent.com.
+    Yields the server; files are added with server.add_file and
+    the URL to pass as base_url is server.url.
+    '''
+    handler = functools.partial(_RawGitHubHandler, directory=str(tmp_path))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    server.requests = []
+    server.root = tmp_path
+    server.add_file = functools.partial(_add_raw_file, server)
+    server.url = _serve(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _add_raw_file(server, organization, name, filepath, text, branch='master'):
+    path = server.root / organization / f'{name}-feedstock' / branch / filepath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return path
+
+
+@pytest.fixture
+def source_server():
+    '''
+    Local server for package sources supporting Range requests.
+    Files are added to server.files (path -> bytes) and are served
+    at server.url + path.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SourceHandler)
+    server.daemon_threads = True
+    server.files = {}
+    server.ranges = True
+    server.range_start = None
+    server.ranges_requested = []
+    server.url = _serve(server)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -1,13 +1,42 @@
+import json
 import os
 import shutil
 import subprocess
+import sys
 
+import pytest
+import requests
+
+from nsls2forge_utils import all_feedstocks
 from nsls2forge_utils.all_feedstocks import (
     get_all_feedstocks_from_github,
+    get_all_feedstocks_from_graphql,
     get_all_feedstocks,
-    all_feedstocks_info
+    clone_all_feedstocks,
+    all_feedstocks_info,
+    _read_branch
 )
 
+GIT = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+
+
+def _commit(repo, filename, text):
+    with open(os.path.join(repo, filename), 'w') as f:
+        f.write(text)
+    subprocess.run(GIT + ['add', filename], cwd=repo, check=True)
+    subprocess.run(GIT + ['commit', '-q', '-m', filename], cwd=repo, check=True)
+
+
+def _make_remote(tmp_path, name):
+    work = str(tmp_path / 'work' / f'{name}-feedstock')
+    os.makedirs(work)
+    subprocess.run(['git', 'init', '-q', work], check=True)
+    _commit(work, 'README.md', name)
+    bare = str(tmp_path / 'remote' / 'org' / f'{name}-feedstock.git')
+    subprocess.run(['git', 'clone', '-q', '--bare', work, bare], check=True)
+    subprocess.run(['git', 'remote', 'add', 'origin', bare], cwd=work, check=True)
+    return work
+
 
 def test_all_feedstocks_from_github():
     names = get_all_feedstocks_from_github()
@@ -22,6 +51,113 @@ def test_all_feedstocks_from_github():
     assert size_include_archived > 0
 
 
+def test_all_feedstocks_from_graphql(github_graphql, tmp_path):
+    for i in range(150):
+        github_graphql.repos[f'pkg{i}-feedstock'] = {'updatedAt': f'2020-01-01T00:{i // 60:02d}:{i % 60:02d}Z'}
+    github_graphql.repos['old-feedstock'] = {'updatedAt': '2019-01-01T00:00:00Z', 'archived': True}
+    github_graphql.repos['docs'] = {'updatedAt': '2019-01-01T00:00:00Z'}
+    cache_path = str(tmp_path / 'listing.json')
+
+    names = get_all_feedstocks_from_graphql(organization='org', token='xyz',
+                                            cache_path=cache_path, url=github_graphql.url)
+    assert sorted(names) == sorted(f'pkg{i}' for i in range(150))
+    assert len(github_graphql.queries) == 2
+    with open(cache_path) as f:
+        listing = json.load(f)
+    assert listing['timestamp'] == '2020-01-01T00:02:29Z'
+    assert listing['repos']['old-feedstock']['archived']
+
+    # only repositories updated since the last listing are fetched
+    github_graphql.repos['new-feedstock'] = {'updatedAt': '2020-02-01T00:00:00Z'}
+    github_graphql.repos['pkg0-feedstock'] = {'updatedAt': '2020-02-01T00:00:00Z',
+                                              'archived': True}
+    names = get_all_feedstocks_from_graphql(organization='org', token='xyz',
+                                            include_archived=True,
+                                            cache_path=cache_path, url=github_graphql.url)
+    assert len(github_graphql.queries) == 3
+    assert len(names) == 152
+    assert 'new' in names
+    names = get_all_feedstocks_from_graphql(organization='org', token='xyz',
+                                            cache_path=cache_path, url=github_graphql.url)
+    assert 'pkg0' not in names
+
+    # a deleted repository forces a full listing
+    del github_graphql.repos['pkg1-feedstock']
+    n_queries = len(github_graphql.queries)
+    names = get_all_feedstocks_from_graphql(organization='org', token='xyz',
+                                            cache_path=cache_path, url=github_graphql.url)
+    assert 'pkg1' not in names
+    assert len(github_graphql.queries) == n_queries + 3
+
+
+def test_all_feedstocks_from_graphql_full_listing(github_graphql, tmp_path):
+    for i in range(3):
+        github_graphql.repos[f'pkg{i}-feedstock'] = {'updatedAt': f'2020-01-01T00:00:0{i}Z'}
+    cache_path = str(tmp_path / 'listing.json')
+
+    def get_names():
+        return sorted(get_all_feedstocks_from_graphql(organization='org', token='xyz',
+                                                      cache_path=cache_path, full_listing_every=2,
+                                                      url=github_graphql.url))
+
+    assert get_names() == ['pkg0', 'pkg1', 'pkg2']
+    # a repository last updated before the listing (e.g. transferred into
+    # the organization) added while another one is deleted keeps the count
+    del github_graphql.repos['pkg1-feedstock']
+    github_graphql.repos['new-feedstock'] = {'updatedAt': '2019-01-01T00:00:00Z'}
+    assert get_names() == ['pkg0', 'pkg1', 'pkg2']
+    assert get_names() == ['pkg0', 'pkg1', 'pkg2']
+    with open(cache_path) as f:
+        assert json.load(f)['incremental_runs'] == 2
+    # until the periodic full listing drops it
+    assert get_names() == ['new', 'pkg0', 'pkg2']
+    with open(cache_path) as f:
+        assert json.load(f)['incremental_runs'] == 0
+
+
+def test_clone_all_feedstocks(tmp_path):
+    works = {name: _make_remote(tmp_path, name) for name in ('a', 'b', 'c')}
+    url_template = f'file://{tmp_path}/remote/{{organization}}/{{name}}-feedstock.git'
+    feedstocks_dir = str(tmp_path / 'feedstocks')
+    results = clone_all_feedstocks('org', feedstocks_dir, jobs=2, depth=1,
+                                   blob_filter=True, names=['a', 'b', 'c', 'missing'],
+                                   url_template=url_template)
+    assert [results[name][0] for name in 'abc'] == ['cloned'] * 3
+    assert results['missing'][0] is None
+    assert results['missing'][2]
+
+    branch = subprocess.run(['git', 'rev-parse', '--abbrev-ref', 'HEAD'], cwd=works['a'],
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    _commit(works['a'], 'new.txt', 'new')
+    subprocess.run(['git', 'push', '-q', 'origin', branch.stdout.strip()],
+                   cwd=works['a'], check=True)
+    results = clone_all_feedstocks('org', feedstocks_dir, jobs=2, names=['a', 'b'],
+                                   url_template=url_template)
+    assert [results[name][0] for name in 'ab'] == ['updated'] * 2
+    assert os.path.exists(os.path.join(feedstocks_dir, 'a-feedstock', 'new.txt'))
+
+    with pytest.raises(ValueError):
+        clone_all_feedstocks('org', feedstocks_dir, depth=1, names=['a'])
+
+
+def test_clone_all_feedstocks_os_error(tmp_path, monkeypatch):
+    _make_remote(tmp_path, 'a')
+    url_template = f'file://{tmp_path}/remote/{{organization}}/{{name}}-feedstock.git'
+    clone_or_update = all_feedstocks._clone_or_update
+
+    def fail_b(name, *args, **kwargs):
+        if name == 'b':
+            raise OSError(28, 'No space left on device')
+        return clone_or_update(name, *args, **kwargs)
+
+    monkeypatch.setattr(all_feedstocks, '_clone_or_update', fail_b)
+    results = clone_all_feedstocks('org', str(tmp_path / 'feedstocks'), jobs=2,
+                                   names=['a', 'b'], url_template=url_template)
+    assert results['a'][0] == 'cloned'
+    assert results['b'][0] is None
+    assert 'No space left' in results['b'][2]
+
+
 def test_all_feedstocks():
     names = get_all_feedstocks()
     assert names is None
@@ -52,3 +188,65 @@ def test_all_feedstocks_info():
     assert list(df.columns) == ['Name', 'Branch', 'Changed?', 'Version']
     assert df['Name'].iloc[0] == 'event-model-feedstock'
     shutil.rmtree('./test_feedstocks')
+
+
+def test_all_feedstocks_info_local(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    url_template = f'file://{tmp_path}/remote/{{organization}}/{{name}}-feedstock.git'
+    feedstocks_dir = str(tmp_path / 'feedstocks') + '/'
+    for name in ('a', 'b'):
+        work = _make_remote(tmp_path, name)
+        os.makedirs(os.path.join(work, 'recipe'))
+        _commit(work, 'recipe/meta.yaml',
+                '{% set version = "1.2.3" %}\npackage:\n  name: a\n  version: {{ version }}\n')
+        subprocess.run(['git', 'push', '-q', 'origin', 'HEAD'], cwd=work, check=True)
+    clone_all_feedstocks('org', feedstocks_dir, jobs=2, names=['a', 'b'],
+                         url_template=url_template)
+    with open(os.path.join(feedstocks_dir, 'b-feedstock', 'README.md'), 'a') as f:
+        f.write('changed')
+    df = all_feedstocks_info(feedstocks_dir=feedstocks_dir, max_workers=2)
+    assert list(df['Name']) == ['a-feedstock', 'b-feedstock']
+    assert list(df['Changed?']) == [False, True]
+    branch = subprocess.run(['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
+                            cwd=os.path.join(feedstocks_dir, 'a-feedstock'), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    assert list(df['Branch']) == [branch.stdout.strip()] * 2
+    pytest.importorskip('conda_forge_tick')
+    assert list(df['Version']) == ['1.2.3', '1.2.3']
+
+
+def test_all_feedstocks_info_without_conda_forge_tick(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'conda_forge_tick', None)
+    monkeypatch.setattr(all_feedstocks, '_version_from_badge', lambda repo_path: '1.2.3')
+    repo = str(tmp_path / 'feedstocks' / 'a-feedstock')
+    subprocess.run(['git', 'init', '-q', repo], check=True)
+    _commit(repo, 'README.md', 'Conda Version badge')
+    df = all_feedstocks_info(feedstocks_dir=str(tmp_path / 'feedstocks') + '/',
+                             badge_fallback=True)
+    assert list(df['Version']) == ['1.2.3']
+
+
+def test_all_feedstocks_info_without_conda_forge_tick_offline(tmp_path, monkeypatch, capsys):
+    def request(*args, **kwargs):
+        raise AssertionError('no requests are sent without badge_fallback')
+
+    monkeypatch.setitem(sys.modules, 'conda_forge_tick', None)
+    monkeypatch.setattr(requests.Session, 'request', request)
+    repo = str(tmp_path / 'feedstocks' / 'a-feedstock')
+    subprocess.run(['git', 'init', '-q', repo], check=True)
+    _commit(repo, 'README.md', '![Conda Version](https://img.shields.io/conda/vn/org/a.svg)')
+    df = all_feedstocks_info(feedstocks_dir=str(tmp_path / 'feedstocks') + '/')
+    assert list(df['Version']) == ['']
+    assert 'Use --badge' in capsys.readouterr().out
+
+
+def test_read_branch(tmp_path):
+    repo = str(tmp_path / 'repo')
+    subprocess.run(['git', 'init', '-q', '-b', 'main', repo], check=True)
+    _commit(repo, 'README.md', 'text')
+    assert _read_branch(repo) == 'main'
+    worktree = str(tmp_path / 'worktree')
+    subprocess.run([*GIT, 'worktree', 'add', '-q', '-b', 'other', worktree], cwd=repo, check=True)
+    assert _read_branch(worktree) == 'other'
+    subprocess.run(['git', 'checkout', '-q', '--detach'], cwd=repo, check=True)
+    assert _read_branch(repo) == 'HEAD'
@@ -1,9 +1,13 @@
+import json
 import os
+import random
+import time
 
 import markdown
 from bs4 import BeautifulSoup
 
-from nsls2forge_utils.dashboard import create_dashboard
+from nsls2forge_utils import dashboard
+from nsls2forge_utils.dashboard import create_dashboard, create_dashboard_from_list
 
 
 def test_no_feedstocks():
@@ -106,3 +110,112 @@ def test_rows():
         assert expected_rows == len(svgs)
     os.remove('names.txt')
     os.remove('test.md')
+
+
+def test_rows_fetch_recipes_in_one_batch(monkeypatch):
+    calls = []
+
+    def get_attributes(names, attributes, organization=None, max_connections=None):
+        calls.append((list(names), organization, max_connections))
+        shuffled = random.sample(names, len(names))
+        return {pkg: {'about home': f'https://github.com/org/{pkg}-repo'} for pkg in shuffled}
+
+    monkeypatch.setattr(dashboard, 'get_attributes', get_attributes)
+    names = [f'pkg{i}' for i in range(50)]
+    rows = create_dashboard_from_list(names, max_workers=8).splitlines()[4:]
+    assert calls == [(names, 'nsls-ii-forge', 8)]
+    assert len(rows) == len(names)
+    for i, (row, name) in enumerate(zip(rows, names)):
+        assert row.startswith(f'|{i + 1}|[{name}](')
+        assert f'github/v/tag/org/{name}-repo)' in row
+
+
+def test_dashboard_from_graph(tmp_path, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError('recipes must not be fetched')
+
+    monkeypatch.setattr(dashboard, 'get_attributes', no_network)
+    node_attrs = tmp_path / 'node_attrs'
+    node_attrs.mkdir()
+    attrs = {
+        'event-model': {'meta_yaml': {'about': {'home': 'https://github.com/bluesky/event-model'}}},
+        'databroker': {'meta_yaml': {'about': {'home': 'https://blueskyproject.io',
+                                               'dev_url': 'https://github.com/bluesky/databroker'}}},
+        'python': {'feedstock_name': 'python', 'bad': False, 'archived': True},
+    }
+    for name, payload in attrs.items():
+        (node_attrs / f'{name}.json').write_text(json.dumps(payload))
+    graph = {
+        'directed': True, 'multigraph': False, 'graph': {},
+        'nodes': [{'id': name, 'payload': {'__lazy_json__': f'node_attrs/{name}.json'}}
+                  for name in attrs] + [{'id': 'numpy'}],
+        'links': [{'source': 'python', 'target': 'event-model'}],
+    }
+    (tmp_path / 'graph.json').write_text(json.dumps(graph))
+    write_to = str(tmp_path / 'README.md')
+    assert create_dashboard(write_to=write_to, graph=str(tmp_path / 'graph.json')) == 2
+    with open(write_to, 'r') as f:
+        html = BeautifulSoup(markdown.markdown(f.read()), features='lxml')
+    github = [str(img) for img in html.findAll('img', attrs={'alt': 'GitHub version'})]
+    assert len(github) == 2
+    assert 'github/v/tag/bluesky/databroker' in github[0]
+    assert 'github/v/tag/bluesky/event-model' in github[1]
+
+
+def test_10k_rows_benchmark():
+    names = [f'pkg{i}' for i in range(10000)]
+    about = {name: {'about home': f'https://github.com/org/{name}'} for name in names[::2]}
+    start = time.perf_counter()
+    table = create_dashboard_from_list(names, about=about)
+    # timing is only reported (pytest -s), it depends on the machine
+    print(f'Formatted {len(names)} rows in {time.perf_counter() - start:.3f}s')
+    rows = table.splitlines()[4:]
+    assert len(rows) == len(names)
+    assert rows[0].startswith('|1|[pkg0](https://github.com/nsls-ii-forge/pkg0-feedstock)|')
+    assert 'github/v/tag/org/pkg0)' in rows[0]
+    assert 'github/v/tag//pkg1)' in rows[1]
+    assert rows[-1].startswith('|10000|[pkg9999](')
+    assert '{' not in table
+
+
+def test_incremental_dashboard(tmp_path, monkeypatch, capsys):
+    shas = {'a': '1', 'b': '1', 'c': '1'}
+    homes = {'a': 'https://github.com/org/a', 'b': 'https://github.com/org/b',
+             'c': 'https://github.com/org/c', 'd': 'https://github.com/org/d'}
+    looked_up = []
+
+    def get_attributes(names, attributes, organization=None, max_connections=None):
+        looked_up.extend(names)
+        return {pkg: {'about home': homes[pkg]} for pkg in names}
+
+    monkeypatch.setattr(dashboard, 'get_attributes', get_attributes)
+    monkeypatch.setattr(dashboard, 'get_feedstock_shas',
+                        lambda names, organization: {name: shas.get(name) for name in names})
+    names = tmp_path / 'names.txt'
+    write_to = str(tmp_path / 'README.md')
+
+    def build(pkgs):
+        names.write_text('\n'.join(pkgs))
+        looked_up.clear()
+        create_dashboard(names=str(names), write_to=write_to, incremental=True)
+        with open(write_to, 'r') as f:
+            return f.read()
+
+    first = build(['a', 'b', 'c'])
+    assert sorted(looked_up) == ['a', 'b', 'c']
+    assert 'github/v/tag/org/b)' in first
+    capsys.readouterr()
+
+    assert build(['a', 'b', 'c']) == first
+    assert looked_up == []
+    assert 'README.md is up to date' in capsys.readouterr().out
+
+    shas['b'] = '2'
+    homes['b'] = 'https://github.com/other/b'
+    shas['d'] = '1'
+    content = build(['b', 'c', 'd'])
+    assert sorted(looked_up) == ['b', 'd']
+    assert 'github/v/tag/other/b)' in content
+    assert '[a](' not in content
+    assert content.splitlines()[-1].startswith('|3|[d](')
+    assert '1 unchanged, 1 recomputed, 1 added, 1 removed' in capsys.readouterr().out
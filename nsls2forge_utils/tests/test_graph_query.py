@@ -0,0 +1,107 @@
+import gc
+import io
+import json
+import sys
+import weakref
+
+import networkx as nx
+import pytest
+
+from nsls2forge_utils.cli import graph_utils
+from nsls2forge_utils.graph_query import GraphIndex, graph_index, run_queries
+
+
+@pytest.fixture
+def gx():
+    # python -> numpy -> scipy -> scikit-image
+    #           numpy -> scikit-image
+    # python -> a <-> b -> c
+    gx = nx.DiGraph()
+    gx.add_edges_from([
+        ('python', 'numpy'), ('numpy', 'scipy'), ('scipy', 'scikit-image'),
+        ('numpy', 'scikit-image'), ('python', 'a'), ('a', 'b'), ('b', 'a'),
+        ('b', 'c'),
+    ])
+    gx.add_node('lonely')
+    return gx
+
+
+def test_descendants_and_ancestors(gx):
+    index = GraphIndex(gx)
+    assert index.descendants('python') == ['a', 'b', 'c', 'numpy', 'scipy', 'scikit-image']
+    assert index.descendants('numpy') == ['scipy', 'scikit-image']
+    assert index.descendants('numpy', depth=1) == ['scipy', 'scikit-image']
+    assert index.descendants('python', depth=1) == ['a', 'numpy']
+    assert index.descendants('a') == ['b', 'c']
+    assert index.ancestors('scikit-image') == ['python', 'numpy', 'scipy']
+    assert index.ancestors('c') == ['python', 'a', 'b']
+    assert index.ancestors('c', depth=2) == ['a', 'b']
+    assert index.ancestors('lonely') == []
+    for node in gx.nodes:
+        assert set(index.descendants(node)) == nx.descendants(gx, node)
+        assert set(index.ancestors(node)) == nx.ancestors(gx, node)
+    with pytest.raises(KeyError):
+        index.descendants('missing')
+
+
+def test_build_order_and_paths(gx):
+    index = GraphIndex(gx)
+    assert index.build_order(['scikit-image', 'numpy', 'c', 'b', 'python']) == [
+        'python', 'b', 'c', 'numpy', 'scikit-image']
+    assert index.requires('scikit-image', 'python')
+    assert not index.requires('python', 'scikit-image')
+    assert index.requires('a', 'a')
+    assert index.shortest_path('python', 'scikit-image') == ['python', 'numpy', 'scikit-image']
+    assert index.shortest_path('scikit-image', 'python') is None
+    assert index.shortest_path('lonely', 'python') is None
+
+
+def test_graph_index_is_cached(gx):
+    index = graph_index(gx)
+    assert graph_index(gx) is index
+    gx.add_edge('scikit-image', 'napari')
+    index = graph_index(gx)
+    assert index.descendants('numpy') == ['scipy', 'scikit-image', 'napari']
+
+
+def test_graph_index_does_not_keep_graph_alive():
+    gx = nx.DiGraph([('a', 'b')])
+    graph_index(gx)
+    ref = weakref.ref(gx)
+    del gx
+    gc.collect()
+    assert ref() is None
+
+
+def test_run_queries(gx):
+    answers = list(run_queries(gx, ['depends_on', 'ancestors', 'path', 'build_order'],
+                               ['numpy', 'missing'], target='scikit-image'))
+    assert answers == [
+        {'query': 'depends_on', 'package': 'numpy', 'result': ['scipy', 'scikit-image']},
+        {'query': 'depends_on', 'package': 'missing', 'error': 'missing is not in the graph'},
+        {'query': 'ancestors', 'package': 'numpy', 'result': ['python']},
+        {'query': 'ancestors', 'package': 'missing', 'error': 'missing is not in the graph'},
+        {'query': 'path', 'package': 'numpy', 'target': 'scikit-image',
+         'result': ['numpy', 'scikit-image']},
+        {'query': 'path', 'package': 'missing', 'target': 'scikit-image',
+         'error': 'missing is not in the graph'},
+        {'query': 'build_order', 'packages': ['numpy', 'missing'],
+         'error': 'missing is not in the graph'},
+    ]
+
+
+def test_graph_utils_info_json_lines(gx, tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'graph.json'
+    path.write_text(json.dumps(nx.node_link_data(gx, edges='links')))
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('scipy\n\nc\n'))
+    monkeypatch.setattr(sys, 'argv', ['graph-utils', 'info', '-f', str(path), '-p', 'numpy',
+                                      '-n', '-', '-q', 'descendants', 'build_order', '--json'])
+    graph_utils()
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {'query': 'descendants', 'package': 'numpy', 'result': ['scipy', 'scikit-image']},
+        {'query': 'descendants', 'package': 'scipy', 'result': ['scikit-image']},
+        {'query': 'descendants', 'package': 'c', 'result': []},
+        {'query': 'build_order', 'packages': ['numpy', 'scipy', 'c'],
+         'result': ['c', 'numpy', 'scipy']},
+    ]
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import networkx as nx
+import pytest
+
+from nsls2forge_utils.cli import graph_utils
+from nsls2forge_utils.graph_server import GraphClient, make_server
+
+
+def _write_graph(path, edges, mtime_offset=0):
+    path.write_text(json.dumps(nx.node_link_data(nx.DiGraph(edges), edges='links')))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+
+
+@pytest.fixture(params=['tcp', 'unix'])
+def served(request, tmp_path):
+    path = tmp_path / 'graph.json'
+    _write_graph(path, [('python', 'numpy'), ('numpy', 'scipy')])
+    if request.param == 'unix':
+        server = make_server(str(path), socket_path=str(tmp_path / 'graph.sock'), interval=0.05)
+        address = str(tmp_path / 'graph.sock')
+    else:
+        server = make_server(str(path), port=0, interval=0.05)
+        address = '127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path, address
+    server.graph.stop_watching()
+    server.shutdown()
+    server.server_close()
+
+
+def test_graph_server(served):
+    path, address = served
+    client = GraphClient(address, timeout=5)
+    assert client.status()['nodes'] == 3
+    assert client.query(['depends_on', 'descendants'], ['python', 'missing']) == [
+        {'query': 'depends_on', 'package': 'python', 'result': ['numpy']},
+        {'query': 'depends_on', 'package': 'missing', 'error': 'missing is not in the graph'},
+        {'query': 'descendants', 'package': 'python', 'result': ['numpy', 'scipy']},
+        {'query': 'descendants', 'package': 'missing', 'error': 'missing is not in the graph'},
+    ]
+
+    _write_graph(path, [('python', 'numpy'), ('numpy', 'scipy'), ('scipy', 'scikit-image')],
+                 mtime_offset=10**9)
+    deadline = time.time() + 5
+    while client.status()['nodes'] != 4 and time.time() < deadline:
+        time.sleep(0.05)
+    assert client.query(['descendants'], ['numpy']) == [
+        {'query': 'descendants', 'package': 'numpy', 'result': ['scipy', 'scikit-image']}]
+    with pytest.raises(RuntimeError, match='400'):
+        client._request('POST', '/query', {'queries': 'depends_on', 'packages': 3})
+
+
+def test_graph_utils_info_server(served, monkeypatch, capsys):
+    path, address = served
+    monkeypatch.setattr(sys, 'argv', ['graph-utils', 'info', '-s', address, '-p', 'numpy',
+                                      '-q', 'ancestors', '--json'])
+    graph_utils()
+    assert json.loads(capsys.readouterr().out) == {
+        'query': 'ancestors', 'package': 'numpy', 'result': ['python']}
+
+
+def test_graph_server_relative_socket(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_graph(tmp_path / 'graph.json', [('python', 'numpy')])
+    (tmp_path / 'graph.sock').write_text('not a socket')
+    with pytest.raises(FileExistsError):
+        make_server('graph.json', socket_path='graph.sock')
+    (tmp_path / 'graph.sock').unlink()
+    server = make_server('graph.json', socket_path='graph.sock')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert GraphClient('graph.sock', timeout=5).status()['nodes'] == 2
+        assert GraphClient('unix:graph.sock', timeout=5).status()['nodes'] == 2
+
+        def fail(*args, **kwargs):
+            raise RuntimeError('broken')
+
+        monkeypatch.setattr(server.graph, 'query', fail)
+        with pytest.raises(RuntimeError, match="500.*broken"):
+            GraphClient('graph.sock', timeout=5).query(['depends_on'], ['python'])
+    finally:
+        server.graph.stop_watching()
+        server.shutdown()
+        server.server_close()
+    # a stale socket is replaced
+    server = make_server('graph.json', socket_path='graph.sock')
+    server.graph.stop_watching()
+    server.server_close()
@@ -0,0 +1,94 @@
+import json
+import os
+
+import pytest
+
+from nsls2forge_utils.graph_store import (
+    GraphStore,
+    export_graph_json,
+    import_graph_json,
+    is_graph_store,
+    load_graph_readonly,
+    load_graph_store
+)
+
+
+@pytest.fixture
+def graph_json(tmp_path):
+    node_attrs = tmp_path / 'node_attrs'
+    node_attrs.mkdir()
+    payloads = {
+        'python': {'feedstock_name': 'python', 'bad': False, 'archived': True},
+        'numpy': {'feedstock_name': 'numpy', 'version': '1.19.1',
+                  'requirements': {'host': {'__set__': True, 'elements': ['python']}}},
+        'scipy': {'feedstock_name': 'scipy', 'version': '1.5.2'},
+    }
+    for name, payload in payloads.items():
+        (node_attrs / f'{name}.json').write_text(json.dumps(payload, sort_keys=True, indent=2))
+    data = {
+        'directed': True, 'multigraph': False,
+        'graph': {'outputs_lut': {'numpy-base': 'numpy'}},
+        'nodes': [{'id': name, 'payload': {'__lazy_json__': f'node_attrs/{name}.json'}}
+                  for name in payloads] + [{'id': 'cython', 'sha': 'abc'}],
+        'links': [{'source': 'python', 'target': 'numpy'}, {'source': 'python', 'target': 'scipy'},
+                  {'source': 'numpy', 'target': 'scipy'}, {'source': 'cython', 'target': 'scipy'}],
+    }
+    path = tmp_path / 'graph.json'
+    path.write_text(json.dumps(data))
+    return path, data, payloads
+
+
+def test_graph_store_queries(graph_json, tmp_path):
+    path, data, payloads = graph_json
+    store_path = str(tmp_path / 'graph.db')
+    assert is_graph_store(store_path) and not is_graph_store(str(path))
+    assert import_graph_json(str(path), store_path) == 4
+    with GraphStore(store_path) as store:
+        assert store.nodes() == ['python', 'numpy', 'scipy', 'cython']
+        assert 'numpy' in store and 'missing' not in store
+        assert store.successors('python') == ['numpy', 'scipy']
+        assert store.predecessors('scipy') == ['python', 'numpy', 'cython']
+        assert store.payload('numpy') == payloads['numpy']
+        assert store.payload('cython') is None
+        with pytest.raises(KeyError):
+            store.payload('missing')
+    gx = load_graph_store(store_path)
+    assert sorted(gx.edges) == sorted((e['source'], e['target']) for e in data['links'])
+    assert gx.nodes['cython'] == {'sha': 'abc'}
+    assert gx.graph == data['graph']
+
+
+def test_graph_store_round_trip(graph_json, tmp_path):
+    path, data, payloads = graph_json
+    store_path = str(tmp_path / 'graph.db')
+    import_graph_json(str(path), store_path)
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    assert export_graph_json(store_path, str(out_dir / 'graph.json')) == 4
+    exported = json.loads((out_dir / 'graph.json').read_text())
+    assert exported['nodes'] == data['nodes']
+    assert sorted(map(json.dumps, exported['links'])) == sorted(map(json.dumps, data['links']))
+    assert exported['graph'] == data['graph']
+    for name, payload in payloads.items():
+        assert json.loads((out_dir / 'node_attrs' / f'{name}.json').read_text()) == payload
+
+
+def test_load_graph_readonly(graph_json, tmp_path, monkeypatch):
+    path, data, payloads = graph_json
+    monkeypatch.chdir(tmp_path / 'node_attrs')
+    gx = load_graph_readonly(str(path))
+    assert sorted(gx.edges) == sorted((e['source'], e['target']) for e in data['links'])
+    assert all('payload' not in attrs for _, attrs in gx.nodes(data=True))
+    assert load_graph_readonly(str(path)) is gx
+    assert not os.path.exists('graph.json')
+
+    data['links'].append({'source': 'cython', 'target': 'numpy'})
+    path.write_text(json.dumps(data))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    reloaded = load_graph_readonly(str(path))
+    assert reloaded is not gx
+    assert reloaded.has_edge('cython', 'numpy')
+
+    store_path = str(tmp_path / 'graph.db')
+    import_graph_json(str(path), store_path)
+    assert sorted(load_graph_readonly(store_path).edges) == sorted(reloaded.edges)
@@ -0,0 +1,205 @@
+import functools
+import json
+import os
+import shutil
+
+import networkx as nx
+import pytest
+
+from nsls2forge_utils import graph_utils, io
+from nsls2forge_utils.graph_utils import (
+    get_feedstock_shas,
+    make_graph,
+    _names_to_refresh,
+    _requirements_entry,
+    _dependency_snapshot,
+    _infer_edges,
+    _flush_node_attrs
+)
+
+
+def test_get_feedstock_shas(github_graphql, monkeypatch):
+    monkeypatch.setattr('nsls2forge_utils.graph_utils.SHA_BATCH_SIZE', 3)
+    names = [f'pkg{i}' for i in range(7)]
+    for i, name in enumerate(names):
+        github_graphql.repos[f'{name}-feedstock'] = {'oid': f'sha{i}'}
+    github_graphql.repos['pkg0-feedstock']['branch'] = 'main'
+    branches = {}
+    shas = get_feedstock_shas(names + ['missing'], 'org', token='xyz',
+                              url=github_graphql.url, branches=branches)
+    assert shas == {**{name: f'sha{i}' for i, name in enumerate(names)},
+                    'missing': None}
+    assert branches == {'pkg0': 'main', **{name: 'master' for name in names[1:]}}
+    assert len(github_graphql.queries) == 3
+
+
+def test_names_to_refresh():
+    gx = nx.DiGraph()
+    gx.add_node('same', sha='a')
+    gx.add_node('moved', sha='a')
+    gx.add_node('unrecorded')
+    gx.add_node('gone', sha='a')
+    shas = {'same': 'a', 'moved': 'b', 'unrecorded': 'c', 'gone': None, 'new': 'd'}
+    names = ['same', 'moved', 'unrecorded', 'gone', 'new']
+    assert _names_to_refresh(gx, names, shas) == ['moved', 'unrecorded', 'gone', 'new']
+
+
+class _Payload(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_infer_edges():
+    gx = nx.DiGraph()
+    gx.add_node('numpy', payload=_Payload(
+        requirements={'host': set(), 'run': set()},
+        outputs_names={'numpy', 'numpy-base'}, strong_exports=True))
+    gx.add_node('scipy', payload=_Payload(
+        requirements={'host': {'numpy-base'}, 'run': set()},
+        outputs_names={'scipy'}))
+    gx.add_node('app', payload=_Payload(
+        requirements={'host': set(), 'run': {'scipy'}},
+        outputs_names={'app'}))
+    gx.add_edge('app', 'numpy')
+    index = {'app': _requirements_entry(gx.nodes['app']['payload'])}
+    snapshot = _dependency_snapshot(gx, index)
+    assert list(snapshot) == ['numpy', 'scipy', 'app']
+    assert snapshot['app'] is index['app']
+    gx2, strong_export_updates, stubs = _infer_edges(gx, snapshot)
+    assert set(gx2.edges) == {('numpy', 'scipy'), ('scipy', 'app')}
+    assert gx2.graph['outputs_lut']['numpy-base'] == 'numpy'
+    assert strong_export_updates == {'scipy': {'numpy'}}
+    assert stubs == []
+    assert gx2.nodes['scipy']['payload']['requirements']['run'] == set()
+    _flush_node_attrs(gx2, strong_export_updates, stubs)
+    assert gx2.nodes['scipy']['payload']['requirements']['run'] == {'numpy'}
+    assert gx2.nodes['scipy']['payload']['requirements']['host'] == {'numpy-base', 'numpy'}
+
+
+class _FileAttrs(dict):
+    '''
+    Node attributes kept in node_attrs/{name}.json like conda_forge_tick's
+    LazyJson, written when the context exits
+    '''
+    def __init__(self, name):
+        self.path = os.path.join('node_attrs', f'{name}.json')
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.update(json.load(f))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        os.makedirs('node_attrs', exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self, f, default=sorted)
+
+
+def _parse_recipe(name, meta_yaml, conda_forge_yaml):
+    '''
+    Parses recipes written by the feedstocks fixture in place of
+    conda_forge_tick's populate_feedstock_attributes, which marks
+    feedstocks without a meta.yaml as bad
+    '''
+    if not isinstance(meta_yaml, str):
+        return {'feedstock_name': name, 'bad': f'make_graph: {meta_yaml.status_code}'}
+    return {'feedstock_name': name, 'bad': False, 'outputs_names': [name],
+            'requirements': json.loads(meta_yaml)}
+
+
+@pytest.fixture
+def feedstocks(raw_github, github_graphql, tmp_path, monkeypatch):
+    '''
+    Feedstocks of organization org served by local stand-ins for GitHub.
+    Yields a function adding a feedstock whose package requires deps,
+    or whose recipe is the text recipe.
+    '''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(io, 'RAW_GITHUB_URL', raw_github.url)
+    monkeypatch.setattr(graph_utils, '_parse_attrs', _parse_recipe)
+    monkeypatch.setattr(graph_utils, '_node_attrs', _FileAttrs)
+    monkeypatch.setattr(graph_utils, 'get_feedstock_shas',
+                        functools.partial(get_feedstock_shas, token='xyz', url=github_graphql.url))
+
+    def add(name, deps=(), branch='master', sha='1', recipe=True):
+        github_graphql.repos[f'{name}-feedstock'] = {'oid': sha, 'branch': branch,
+                                                     'updatedAt': '2020-01-01T00:00:00Z'}
+        raw_github.add_file('org', name, 'conda-forge.yml', '{}', branch=branch)
+        if recipe is True:
+            recipe = json.dumps({'host': [], 'run': list(deps)})
+        if recipe:
+            raw_github.add_file('org', name, 'recipe/meta.yaml', recipe, branch=branch)
+
+    add.requests = raw_github.requests
+    return add
+
+
+def test_make_graph_incremental_retries_failed_fetches(feedstocks):
+    feedstocks('numpy', branch='main')
+    feedstocks('scipy', ['numpy'])
+    feedstocks('app', ['scipy'], recipe=False)
+    names = ['numpy', 'scipy', 'app']
+    gx = make_graph(names, 'org', incremental=True)
+    assert gx.nodes['app']['payload']['bad'] == 'make_graph: 404'
+    assert 'sha' not in gx.nodes['app']
+    assert gx.nodes['numpy']['sha'] == '1'
+    assert ('numpy', 'scipy') in gx.edges
+    assert ('/org/numpy-feedstock/main/recipe/meta.yaml' in
+            [path for _, path in feedstocks.requests])
+
+    # the recipe is fetched again although the feedstock has no new commits
+    feedstocks('app', ['scipy'])
+    feedstocks.requests.clear()
+    gx = make_graph(names, 'org', gx=gx, incremental=True)
+    assert {path.split('/')[2] for _, path in feedstocks.requests} == {'app-feedstock'}
+    assert gx.nodes['app']['payload']['bad'] is False
+    assert gx.nodes['app']['sha'] == '1'
+    assert set(gx.edges) == {('numpy', 'scipy'), ('scipy', 'app')}
+
+    feedstocks.requests.clear()
+    make_graph(names, 'org', gx=gx, incremental=True)
+    assert feedstocks.requests == []
+
+
+def _graph_contents(gx):
+    return ({name: dict(node.get('payload') or {}) for name, node in gx.nodes.items()},
+            set(gx.edges))
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process', 'async'])
+def test_make_graph_executors(feedstocks, tmp_path, monkeypatch, executor):
+    feedstocks('numpy', ['python'])
+    feedstocks('scipy', ['numpy', 'python'])
+    feedstocks('scikit-image', ['scipy', 'numpy'])
+    feedstocks('app', recipe=False)
+    names = ['numpy', 'scipy', 'scikit-image', 'app']
+    monkeypatch.setattr(graph_utils, 'MAX_WORKERS', 2)
+    monkeypatch.setattr(graph_utils, 'DEBUG', True)
+    expected = _graph_contents(make_graph(names, 'org'))
+    assert expected[1] == {('python', 'numpy'), ('python', 'scipy'), ('numpy', 'scipy'),
+                           ('scipy', 'scikit-image'), ('numpy', 'scikit-image')}
+
+    shutil.rmtree(tmp_path / 'node_attrs')
+    monkeypatch.setattr(graph_utils, 'DEBUG', False)
+    monkeypatch.setattr(graph_utils, 'EXECUTOR', executor)
+    assert _graph_contents(make_graph(names, 'org')) == expected
+
+
+def test_make_graph_stage_statistics(feedstocks, monkeypatch, capsys):
+    feedstocks('numpy')
+    feedstocks('scipy', ['numpy'])
+    feedstocks('broken', recipe='not json')
+    monkeypatch.setattr(graph_utils, 'MAX_WORKERS', 2)
+    gx = make_graph(['numpy', 'scipy', 'broken'], 'org')
+    assert 'payload' not in gx.nodes.get('broken', {})
+    out = capsys.readouterr().out
+    stats = out[out.index('Stage statistics:'):].splitlines()[1:4]
+    assert [line.split()[:5] for line in stats] == [
+        ['fetch', '3', 'done,', '0', 'failed,'],
+        ['parse', '3', 'done,', '1', 'failed,'],
+        ['write', '2', 'done,', '0', 'failed,'],
+    ]
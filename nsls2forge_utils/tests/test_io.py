@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+
+import pytest
+import requests
+
+from nsls2forge_utils.cache import FetchCache
+from nsls2forge_utils import io
+from nsls2forge_utils.io import _fetch_file, _get_pool, fetch_files, shutdown_pool
+
+
+def test_fetch_file(raw_github):
+    raw_github.add_file('org', 'event-model', 'recipe/meta.yaml', 'name: event-model\n')
+    text = _fetch_file('org', 'event-model', 'recipe/meta.yaml', base_url=raw_github.url)
+    assert text == 'name: event-model\n'
+    response = _fetch_file('org', 'missing', 'recipe/meta.yaml', base_url=raw_github.url)
+    assert isinstance(response, requests.Response)
+    assert response.status_code == 404
+
+
+def test_fetch_files(raw_github):
+    names = [f'pkg{i}' for i in range(10)]
+    for name in names:
+        raw_github.add_file('org', name, 'recipe/meta.yaml', f'name: {name}\n')
+        raw_github.add_file('org', name, 'conda-forge.yml', '{}\n')
+    files = [(name, path) for name in names
+             for path in ('recipe/meta.yaml', 'conda-forge.yml')]
+    files.append(('missing', 'recipe/meta.yaml'))
+    results = fetch_files('org', files, max_connections=4, base_url=raw_github.url)
+    assert list(results) == files
+    for name in names:
+        assert results[(name, 'recipe/meta.yaml')] == f'name: {name}\n'
+        assert results[(name, 'conda-forge.yml')] == '{}\n'
+    assert results[('missing', 'recipe/meta.yaml')].status_code == 404
+    assert fetch_files('org', []) == {}
+
+
+def test_fetch_files_reuses_connections(raw_github):
+    names = [f'pkg{i}' for i in range(20)]
+    for name in names:
+        raw_github.add_file('org', name, 'recipe/meta.yaml', name)
+    files = [(name, 'recipe/meta.yaml') for name in names]
+    fetch_files('org', files, max_connections=2, base_url=raw_github.url)
+    clients = {address for address, _ in raw_github.requests}
+    assert len(raw_github.requests) == 20
+    assert len(clients) <= 2
+
+
+def test_fetch_files_shares_pool(raw_github):
+    names = [f'pkg{i}' for i in range(5)]
+    for name in names:
+        raw_github.add_file('org', name, 'recipe/meta.yaml', name)
+    files = [(name, 'recipe/meta.yaml') for name in names]
+
+    async def fetch():
+        # works from a thread that is running an event loop
+        return fetch_files('org', files, base_url=raw_github.url)
+
+    def pool_threads():
+        return {t for t in threading.enumerate() if t.name.startswith('fetch-files')}
+
+    pool = _get_pool()
+    for _ in range(3):
+        results = asyncio.run(fetch())
+        assert results == {f: f[0] for f in files}
+    # every call ran on the threads of the one shared pool
+    assert _get_pool() is pool
+    assert 0 < len(pool_threads()) <= pool._max_workers
+
+
+def test_shutdown_pool(raw_github):
+    raw_github.add_file('org', 'pkg', 'recipe/meta.yaml', 'pkg')
+    files = [('pkg', 'recipe/meta.yaml')]
+    fetch_files('org', files, base_url=raw_github.url)
+    pool = _get_pool()
+    shutdown_pool()
+    assert io._POOL is None and io._SESSION is None
+    with pytest.raises(RuntimeError):
+        pool.submit(print)
+    # a new pool and session are created when needed
+    assert fetch_files('org', files, base_url=raw_github.url) == {files[0]: 'pkg'}
+    assert _get_pool() is not pool
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_fetch_files_after_fork(raw_github):
+    raw_github.add_file('org', 'pkg', 'recipe/meta.yaml', 'pkg')
+    files = [('pkg', 'recipe/meta.yaml')]
+    fetch_files('org', files, base_url=raw_github.url)
+    pool = _get_pool()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = (io._POOL is None and io._SESSION is None
+                  and fetch_files('org', files, base_url=raw_github.url) == {files[0]: 'pkg'})
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert _get_pool() is pool
+
+
+def test_fetch_cache(raw_github, tmp_path):
+    cache = FetchCache(cache_dir=str(tmp_path / 'cache'))
+    raw_github.add_file('org', 'pkg', 'recipe/meta.yaml', 'version: 1\n')
+    for _ in range(3):
+        text = _fetch_file('org', 'pkg', 'recipe/meta.yaml', base_url=raw_github.url,
+                           cache=cache)
+        assert text == 'version: 1\n'
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    raw_github.add_file('org', 'pkg', 'recipe/meta.yaml', 'version: 2\n')
+    results = fetch_files('org', [('pkg', 'recipe/meta.yaml')], base_url=raw_github.url,
+                          cache=cache)
+    assert results[('pkg', 'recipe/meta.yaml')] == 'version: 2\n'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # a new cache in the same directory picks up the stored entries
+    cache = FetchCache(cache_dir=str(tmp_path / 'cache'))
+    text = _fetch_file('org', 'pkg', 'recipe/meta.yaml', base_url=raw_github.url,
+                       cache=cache)
+    assert text == 'version: 2\n'
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_fetch_cache_eviction(raw_github, tmp_path):
+    cache = FetchCache(cache_dir=str(tmp_path / 'cache'), max_size=1000)
+    for i in range(10):
+        raw_github.add_file('org', f'pkg{i}', 'recipe/meta.yaml', 'x' * 200)
+        _fetch_file('org', f'pkg{i}', 'recipe/meta.yaml', base_url=raw_github.url,
+                    cache=cache)
+        assert cache._size <= 1000
+    assert cache.get(cache.key('org', 'pkg9', 'master', 'recipe/meta.yaml')) is not None
+    assert cache.get(cache.key('org', 'pkg0', 'master', 'recipe/meta.yaml')) is None
@@ -0,0 +1,242 @@
+import hashlib
+import json
+
+import pytest
+
+from nsls2forge_utils import io, meta_utils
+from nsls2forge_utils.cache import SourceCache, source_cache
+from nsls2forge_utils.meta_utils import (
+    _download,
+    _part_path,
+    clear_recipe_cache,
+    download_from_source,
+    download_sources,
+    get_attribute,
+    get_attributes
+)
+
+
+@pytest.fixture
+def recipes(monkeypatch):
+    '''
+    Serves parsed recipes from a dict instead of GitHub and records
+    which recipes were fetched in each batch.
+    '''
+    fetched = []
+    recipes = {
+        'event-model': {
+            'package': {'name': 'event-model', 'version': '1.15.2'},
+            'about': {'home': 'https://github.com/bluesky/event-model'},
+        },
+        'databroker': {
+            'package': {'name': 'databroker', 'version': '1.0.6'},
+            'about': {'home': 'https://blueskyproject.io',
+                      'dev_url': 'https://github.com/bluesky/databroker'},
+        },
+    }
+
+    def fetch(names, organization=None, cached=False, max_connections=None):
+        fetched.append((organization, tuple(names), cached))
+        return {name: recipes.get(name) for name in names}
+
+    monkeypatch.setattr(meta_utils, '_fetch_and_parse_meta_yamls', fetch)
+    clear_recipe_cache()
+    yield fetched
+    clear_recipe_cache()
+
+
+def test_get_attributes_parses_once(recipes):
+    results = get_attributes(['event-model', 'databroker', 'missing'],
+                             ['about home', 'about dev_url', 'package version'],
+                             organization='org')
+    assert results == {
+        'event-model': {'about home': 'https://github.com/bluesky/event-model',
+                        'about dev_url': None,
+                        'package version': '1.15.2'},
+        'databroker': {'about home': 'https://blueskyproject.io',
+                       'about dev_url': 'https://github.com/bluesky/databroker',
+                       'package version': '1.0.6'},
+        'missing': {'about home': None, 'about dev_url': None, 'package version': None},
+    }
+    assert get_attribute('package name', 'event-model', organization='org') == 'event-model'
+    assert get_attribute('package version name', 'event-model', organization='org') is None
+    assert recipes == [('org', ('event-model', 'databroker', 'missing'), False)]
+    # recipes that could not be fetched are fetched again
+    get_attributes(['databroker', 'missing', 'missing'], ['about home'], organization='org')
+    assert recipes[1:] == [('org', ('missing',), False)]
+
+
+def test_get_attributes_fetches_in_one_batch(raw_github, monkeypatch):
+    pytest.importorskip('conda_forge_tick')
+    batches = []
+
+    def fetch_files(organization, files, **kwargs):
+        batches.append(list(files))
+        return io.fetch_files(organization, files, base_url=raw_github.url)
+
+    monkeypatch.setattr(meta_utils, 'fetch_files', fetch_files)
+    for name in ('a', 'b'):
+        raw_github.add_file('org', name, 'recipe/meta.yaml',
+                            f'package:\n  name: {name}\n  version: 1.0\n')
+    clear_recipe_cache()
+    results = get_attributes(['a', 'b', 'missing'], ['package name'], organization='org')
+    clear_recipe_cache()
+    assert results == {'a': {'package name': 'a'}, 'b': {'package name': 'b'},
+                       'missing': {'package name': None}}
+    assert batches == [[('a', 'recipe/meta.yaml'), ('b', 'recipe/meta.yaml'),
+                        ('missing', 'recipe/meta.yaml')]]
+
+
+def test_recipe_cache_is_bounded(recipes, monkeypatch):
+    monkeypatch.setattr(meta_utils, 'RECIPE_CACHE_SIZE', 1)
+    get_attribute('about home', 'event-model', organization='org')
+    get_attribute('about home', 'databroker', organization='org')
+    get_attribute('about home', 'databroker', organization='org')
+    get_attribute('about home', 'event-model', organization='org')
+    get_attribute('about home', 'event-model', organization='other')
+    assert recipes == [('org', ('event-model',), False), ('org', ('databroker',), False),
+                       ('org', ('event-model',), False), ('other', ('event-model',), False)]
+
+
+SOURCE = bytes(range(256)) * 4096
+
+
+def test_download_resumes_partial_file(source_server, tmp_path):
+    source_server.files['/pkg-1.0.tar.gz'] = SOURCE
+    url = f'{source_server.url}/pkg-1.0.tar.gz'
+    filename = str(tmp_path / 'pkg-1.0.tar.gz')
+    with open(_part_path(url, filename), 'wb') as f:
+        f.write(SOURCE[:100000])
+    sha256 = _download(url, filename, chunk_size=4096)
+    assert sha256 == hashlib.sha256(SOURCE).hexdigest()
+    assert source_server.ranges_requested == ['bytes=100000-']
+    with open(filename, 'rb') as f:
+        assert f.read() == SOURCE
+
+    # a server that ignores Range sends the whole file again
+    source_server.ranges = False
+    with open(_part_path(url, filename), 'wb') as f:
+        f.write(b'garbage')
+    assert _download(url, filename) == sha256
+    with open(filename, 'rb') as f:
+        assert f.read() == SOURCE
+    # partial files of other urls are not resumed
+    assert _part_path(url, filename) != _part_path(f'{url}?mirror', filename)
+
+
+def test_download_restarts_on_mismatched_range(source_server, tmp_path):
+    source_server.files['/pkg-1.0.tar.gz'] = SOURCE
+    url = f'{source_server.url}/pkg-1.0.tar.gz'
+    filename = str(tmp_path / 'pkg-1.0.tar.gz')
+    sha256 = hashlib.sha256(SOURCE).hexdigest()
+    # the server answers with a range that does not continue the partial file
+    source_server.range_start = 10
+    with open(_part_path(url, filename), 'wb') as f:
+        f.write(SOURCE[:100000])
+    assert _download(url, filename) == sha256
+    assert source_server.ranges_requested == ['bytes=100000-', None]
+
+    # a partial file longer than the source is not taken as complete
+    source_server.range_start = None
+    source_server.ranges_requested.clear()
+    with open(_part_path(url, filename), 'wb') as f:
+        f.write(SOURCE + b'extra')
+    assert _download(url, filename) == sha256
+    assert source_server.ranges_requested == [f'bytes={len(SOURCE) + 5}-', None]
+    with open(filename, 'rb') as f:
+        assert f.read() == SOURCE
+
+
+def test_download_from_source_verifies_sha256(source_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source_server.files['/pkg-1.0.tar.gz'] = SOURCE
+    url = f'{source_server.url}/pkg-1.0.tar.gz'
+    sha256 = hashlib.sha256(SOURCE).hexdigest()
+    meta_yaml = {'source': {'url': url, 'sha256': sha256.upper()}}
+    monkeypatch.setattr(meta_utils, '_get_meta_yaml', lambda name, **kwargs: meta_yaml)
+    assert download_from_source('pkg') == (url, sha256)
+    assert (tmp_path / 'pkg-1.0.tar.gz').read_bytes() == SOURCE
+
+    meta_yaml['source']['sha256'] = '0' * 64
+    with pytest.raises(RuntimeError, match='does not match'):
+        download_from_source('pkg')
+    assert not (tmp_path / 'pkg-1.0.tar.gz').exists()
+
+    meta_yaml['source']['url'] = f'{source_server.url}/missing.tar.gz'
+    with pytest.raises(RuntimeError, match='404'):
+        download_from_source('pkg')
+
+
+def test_download_sources(source_server, tmp_path, monkeypatch):
+    other = SOURCE[::-1]
+    source_server.files['/a/v1.0.tar.gz'] = SOURCE
+    source_server.files['/b/v1.0.tar.gz'] = other
+    source_server.files['/b-mirror/v1.0.tar.gz'] = SOURCE
+    source_server.files['/b-data.tar.gz'] = SOURCE[:1000]
+    recipes = {
+        'a': {'source': {'url': [f'{source_server.url}/missing.tar.gz',
+                                 f'{source_server.url}/a/v1.0.tar.gz'],
+                         'sha256': hashlib.sha256(SOURCE).hexdigest()}},
+        # the first mirror serves a file with the wrong sha256
+        'b': {'source': [{'url': [f'{source_server.url}/b-mirror/v1.0.tar.gz',
+                                  f'{source_server.url}/b/v1.0.tar.gz'],
+                          'sha256': hashlib.sha256(other).hexdigest()},
+                         {'url': f'{source_server.url}/b-data.tar.gz',
+                          'fn': 'data.tar.gz', 'sha256': '0' * 64}]},
+        'c': None,
+    }
+    monkeypatch.setattr(meta_utils, '_get_meta_yaml', lambda name, **kwargs: recipes[name])
+    report = download_sources(['a', 'b', 'c'], max_workers=3, dest_dir=str(tmp_path))
+    assert [(e['name'], e['url'], e['ok']) for e in report] == [
+        ('a', f'{source_server.url}/a/v1.0.tar.gz', True),
+        ('b', f'{source_server.url}/b/v1.0.tar.gz', True),
+        ('b', f'{source_server.url}/b-data.tar.gz', False),
+        ('c', None, False),
+    ]
+    assert report[0]['sha256'] == report[0]['expected_sha256']
+    assert report[0]['bytes'] == len(SOURCE)
+    assert report[1]['filename'] == str(tmp_path / 'b' / 'v1.0.tar.gz')
+    assert report[2]['sha256'] == hashlib.sha256(SOURCE[:1000]).hexdigest()
+    assert 'does not match' in report[2]['error']
+    assert sorted(str(p.relative_to(tmp_path)) for p in tmp_path.rglob('*') if p.is_file()) == [
+        'a/v1.0.tar.gz', 'b/v1.0.tar.gz']
+    assert (tmp_path / 'a' / 'v1.0.tar.gz').read_bytes() == SOURCE
+    assert (tmp_path / 'b' / 'v1.0.tar.gz').read_bytes() == other
+
+
+def test_source_cache(source_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source_server.files['/pkg-1.0.tar.gz'] = SOURCE
+    url = f'{source_server.url}/pkg-1.0.tar.gz'
+    sha256 = hashlib.sha256(SOURCE).hexdigest()
+    meta_yaml = {'source': {'url': url, 'sha256': sha256}}
+    monkeypatch.setattr(meta_utils, '_get_meta_yaml', lambda name, **kwargs: meta_yaml)
+    cache_dir = str(tmp_path / 'cache')
+    with source_cache(cache_dir=cache_dir) as cache:
+        assert download_from_source('pkg') == (url, sha256)
+        (tmp_path / 'pkg-1.0.tar.gz').unlink()
+        assert download_from_source('pkg') == (url, sha256)
+        assert (tmp_path / 'pkg-1.0.tar.gz').read_bytes() == SOURCE
+        # without a sha256 in the recipe the source is downloaded again,
+        # since the file behind the url may have changed
+        del meta_yaml['source']['sha256']
+        source_server.files['/pkg-1.0.tar.gz'] = b'changed'
+        assert download_from_source('pkg') == (url, hashlib.sha256(b'changed').hexdigest())
+        assert (cache.hits, cache.misses) == (1, 1)
+    assert len(source_server.ranges_requested) == 2
+
+    cache = SourceCache(cache_dir=cache_dir, max_size=len(SOURCE))
+    assert [(e['sha256'], e['size'], e['urls']) for e in cache.entries()] == [
+        (sha256, len(SOURCE), [url])]
+    other = tmp_path / 'other.tar.gz'
+    other.write_bytes(b'other')
+    cache.add(str(other), hashlib.sha256(b'other').hexdigest(), url=f'{url}.other')
+    # evicting a source drops its urls from the index
+    assert [(e['sha256'], e['urls']) for e in cache.entries()] == [
+        (hashlib.sha256(b'other').hexdigest(), [f'{url}.other'])]
+    assert json.loads((tmp_path / 'cache' / 'index.json').read_text()) == {
+        f'{url}.other': hashlib.sha256(b'other').hexdigest()}
+    assert cache.prune(max_size=0) == 5
+    assert cache.entries() == []
+    assert cache.lookup(sha256) is None
+    assert json.loads((tmp_path / 'cache' / 'index.json').read_text()) == {}
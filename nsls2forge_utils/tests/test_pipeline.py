@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from nsls2forge_utils.pipeline import Pipeline, Stage
+
+
+def test_pipeline():
+    def fetch(key, value):
+        time.sleep(0.001)
+        return value + 1
+
+    def parse(key, value):
+        if key == 3:
+            raise ValueError(key)
+        return value * 2
+
+    stages = [Stage('fetch', fetch, 4), Stage('parse', parse, 2, queue_size=1),
+              Stage('write', lambda key, value: -value, 3)]
+    pipeline = Pipeline(stages)
+    results = {key: (value, error) for key, value, error
+               in pipeline.run((i, i) for i in range(50))}
+    assert len(results) == 50
+    for key, (value, error) in results.items():
+        if key == 3:
+            assert isinstance(error, ValueError)
+        else:
+            assert error is None
+            assert value == -(key + 1) * 2
+    fetch_stats, parse_stats, write_stats = pipeline.stats()
+    assert (fetch_stats['processed'], fetch_stats['failed']) == (50, 0)
+    assert (parse_stats['processed'], parse_stats['failed']) == (50, 1)
+    assert (write_stats['processed'], write_stats['failed']) == (49, 0)
+    assert parse_stats['max_queue_depth'] <= 1
+    assert fetch_stats['items_per_sec'] > 0
+    assert len(pipeline.format_stats()) == 3
+
+
+def test_pipeline_empty():
+    pipeline = Pipeline([Stage('fetch', lambda key, value: value, 2)])
+    assert list(pipeline.run([])) == []
+
+
+def _pipeline_threads():
+    return [t for t in threading.enumerate() if t.name.startswith('pipeline-')]
+
+
+def test_pipeline_feed_error():
+    def items():
+        for i in range(10):
+            yield i, i
+        raise RuntimeError('listing failed')
+
+    pipeline = Pipeline([Stage('fetch', lambda key, value: value, 2, queue_size=1),
+                         Stage('parse', lambda key, value: value, 1, queue_size=1)])
+    results = []
+    with pytest.raises(RuntimeError, match='listing failed'):
+        for key, value, error in pipeline.run(items()):
+            results.append(key)
+    assert sorted(results) == list(range(10))
+    assert _pipeline_threads() == []
+
+
+def test_pipeline_close():
+    calls = []
+
+    def fetch(key, value):
+        calls.append(key)
+        time.sleep(0.001)
+        return value
+
+    pipeline = Pipeline([Stage('fetch', fetch, 2, queue_size=1),
+                         Stage('parse', lambda key, value: value, 1, queue_size=1)])
+    results = pipeline.run((i, i) for i in range(1000))
+    assert len([next(results) for _ in range(3)]) == 3
+    results.close()
+    assert _pipeline_threads() == []
+    assert len(calls) < 1000
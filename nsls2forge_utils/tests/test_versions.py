@@ -0,0 +1,102 @@
+import json
+import time
+
+import networkx as nx
+
+from nsls2forge_utils import versions
+from nsls2forge_utils.versions import (
+    PyPI,
+    _newer,
+    _next_versions,
+    _RateLimiter,
+    update_upstream_versions
+)
+
+
+class _Payload(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def _feedstock(version, url):
+    return _Payload(version=version, meta_yaml={'package': {'version': version},
+                                                'source': {'url': url}})
+
+
+def test_next_versions():
+    assert _next_versions('1.2.3') == ['1.2.4', '1.3.0', '2.0.0']
+    assert _next_versions('2020.1') == ['2020.2', '2021.0']
+    assert _next_versions('1.0rc1') == []
+
+
+def test_newer():
+    assert _newer('2.0.post1', '2.0')
+    assert _newer('1.10.0', '1.10.0rc1')
+    assert not _newer('1.9', '1.10.0rc1')
+    assert _newer('2021b', '2021a')
+    assert _newer('1.0', False)
+    assert _newer('r2021-02', 'r2021-01')
+    assert not _newer('r2021-01', 'r2021-01')
+
+
+def test_pypi_url():
+    pypi = PyPI()
+    assert pypi.get_url('https://pypi.io/packages/source/e/event-model/event-model-1.15.2.tar.gz',
+                        '1.15.2') == f'{versions.PYPI_URL}/event-model/json'
+    assert pypi.get_url('https://files.pythonhosted.org/packages/ab/cd/0123456789/'
+                        'event-model-1.15.2.tar.gz', '1.15.2') == f'{versions.PYPI_URL}/event-model/json'
+    assert pypi.get_url('https://github.com/bluesky/event-model/archive/v1.15.2.tar.gz',
+                        '1.15.2') is None
+
+
+def test_rate_limiter():
+    limiter = _RateLimiter(rates={'slow': 20}, default=1000)
+    start = time.time()
+    for _ in range(5):
+        limiter.wait('https://slow/a')
+        limiter.wait('https://fast/a')
+    assert 0.2 <= time.time() - start < 1
+
+
+def test_update_upstream_versions(source_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(versions, 'PYPI_URL', f'{source_server.url}/pypi')
+    monkeypatch.setattr(versions, 'GITHUB_API_URL', source_server.url)
+    source_server.files['/pypi/event-model/json'] = json.dumps(
+        {'info': {'version': '1.17.0'}}).encode()
+    source_server.files['/repos/bluesky/ophyd/tags?per_page=100'] = json.dumps(
+        [{'name': 'v1.6.0rc1'}, {'name': 'v1.5.10'}, {'name': 'v1.5.9'}, {'name': 'nightly'}]).encode()
+    for version in ('1.2.3', '1.2.4', '1.3.0', '1.3.1'):
+        source_server.files[f'/srw/srw-{version}.tar.gz'] = b'source'
+
+    gx = nx.DiGraph()
+    gx.add_node('event-model', payload=_feedstock(
+        '1.15.2', 'https://pypi.io/packages/source/e/event-model/event-model-1.15.2.tar.gz'))
+    gx.add_node('ophyd', payload=_feedstock(
+        '1.5.0', 'https://github.com/bluesky/ophyd/archive/v1.5.0.tar.gz'))
+    gx.add_node('srw', payload=_feedstock('1.2.3', f'{source_server.url}/srw/srw-1.2.3.tar.gz'))
+    gx.nodes['srw']['payload']['new_version'] = '1.3.5'
+    gx.nodes['event-model']['payload']['new_version'] = '1.16.0rc1'
+    gx.add_node('gone', payload=_feedstock('1.0', f'{source_server.url}/gone/gone-1.0.tar.gz'))
+    gx.add_node('missing', payload=_feedstock(
+        '0.1', 'https://pypi.io/packages/source/m/missing/missing-0.1.tar.gz'))
+    gx.add_node('archived', payload=_Payload(feedstock_name='archived', archived=True))
+    gx.add_node('stub')
+
+    results = update_upstream_versions(gx, max_workers=4)
+    assert results == {'event-model': '1.17.0', 'ophyd': '1.5.10', 'srw': '1.3.1',
+                       'gone': None, 'missing': None}
+    assert sorted(p.name for p in (tmp_path / 'versions').iterdir()) == [
+        'event-model.json', 'gone.json', 'missing.json', 'ophyd.json', 'srw.json']
+    assert json.loads((tmp_path / 'versions' / 'ophyd.json').read_text()) == {
+        'new_version': '1.5.10'}
+    missing = json.loads((tmp_path / 'versions' / 'missing.json').read_text())
+    assert missing['new_version'] is False
+    assert '404' in missing['bad']
+    assert gx.nodes['event-model']['payload']['new_version'] == '1.17.0'
+    assert gx.nodes['ophyd']['payload']['new_version'] == '1.5.10'
+    # a newer version found earlier is kept
+    assert gx.nodes['srw']['payload']['new_version'] == '1.3.5'
@@ -0,0 +1,345 @@
+'''
+Checks upstream sources for new versions of the packages in the
+dependency graph built by graph-utils make.
+
+Each feedstock's source url decides where its latest version is looked
+up: PyPI for packages hosted there, the tags of the GitHub repository
+for GitHub archives, and otherwise by probing the source url with the
+next version numbers. Packages are checked concurrently and requests to
+each host are spaced out to at most HOST_RATE_LIMITS[host] per second.
+'''
+import json
+import logging
+import netrc
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from packaging.version import InvalidVersion, Version
+
+from .io import _get_session
+
+logger = logging.getLogger(__name__)
+
+PYPI_URL = 'https://pypi.org/pypi'
+GITHUB_API_URL = 'https://api.github.com'
+MAX_WORKERS = 20
+# Requests per second sent to a host, DEFAULT_HOST_RATE for other hosts
+HOST_RATE_LIMITS = {
+    'pypi.org': 20,
+    'api.github.com': 5,
+}
+DEFAULT_HOST_RATE = 10
+# Next versions tried per package when probing source urls
+MAX_PROBES = 20
+
+_PYPI_HOSTS = ('pypi.io', 'pypi.org', 'pypi.python.org', 'files.pythonhosted.org')
+_GITHUB_PAT = re.compile(r'https?://github\.com/([^/]+)/([^/]+)/')
+
+
+class _RateLimiter:
+    '''
+    Spaces out requests to each host so that no more than its rate
+    are sent per second
+    '''
+    def __init__(self, rates=None, default=None):
+        self.rates = HOST_RATE_LIMITS if rates is None else rates
+        self.default = DEFAULT_HOST_RATE if default is None else default
+        self._lock = threading.Lock()
+        self._next = {}
+
+    def wait(self, url):
+        host = urlsplit(url).hostname
+        interval = 1 / self.rates.get(host, self.default)
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _parse_version(version):
+    try:
+        return Version(str(version))
+    except InvalidVersion:
+        return None
+
+
+def _newer(version, other):
+    '''
+    Returns whether version is newer than other, comparing them as
+    PEP 440 versions. When either of them is not a valid version, any
+    version other than other is taken to be newer.
+    '''
+    if not other:
+        return True
+    parsed, parsed_other = _parse_version(version), _parse_version(other)
+    if parsed is None or parsed_other is None:
+        return version != other
+    return parsed > parsed_other
+
+
+def _next_versions(version):
+    '''
+    Returns the versions that may follow version, smallest step first,
+    e.g. 1.2.3 -> 1.2.4, 1.3.0, 2.0.0
+    '''
+    parts = version.split('.')
+    if not all(part.isdigit() for part in parts):
+        return []
+    candidates = []
+    for i in reversed(range(len(parts))):
+        bumped = parts[:i] + [str(int(parts[i]) + 1)] + ['0'] * (len(parts) - i - 1)
+        candidates.append('.'.join(bumped))
+    return candidates
+
+
+class PyPI:
+    '''
+    Latest release on PyPI of packages whose source is hosted there
+    '''
+    name = 'pypi'
+
+    def get_url(self, source_url, version):
+        parts = urlsplit(source_url)
+        if parts.hostname not in _PYPI_HOSTS:
+            return None
+        path = parts.path.rstrip('/').split('/')
+        if 'source' in path[:-3]:
+            # .../packages/source/{letter}/{name}/{filename}
+            name = path[path.index('source') + 2]
+        elif version and f'-{version}' in path[-1]:
+            # .../packages/{hash}/{name}-{version}.tar.gz
+            name = path[-1].rsplit(f'-{version}', 1)[0]
+        else:
+            return None
+        return f'{PYPI_URL}/{name}/json'
+
+    def get_version(self, url, version, get):
+        response = get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        return response.json()['info']['version']
+
+
+class GitHub:
+    '''
+    Newest release tag of the GitHub repository of GitHub archives
+    '''
+    name = 'github'
+
+    def get_url(self, source_url, version):
+        match = _GITHUB_PAT.match(source_url)
+        if match is None:
+            return None
+        return f'{GITHUB_API_URL}/repos/{match.group(1)}/{match.group(2)}/tags?per_page=100'
+
+    def _headers(self):
+        # unauthenticated requests are limited to 60 per hour
+        try:
+            _, _, token = netrc.netrc().hosts['github.com']
+        except (OSError, netrc.NetrcParseError, KeyError):
+            return {}
+        return {'Authorization': f'token {token}'}
+
+    def get_version(self, url, version, get):
+        response = get(url, headers=self._headers())
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        releases = {}
+        for tag in response.json():
+            name = tag['name'][1:] if tag['name'].startswith('v') else tag['name']
+            parsed = _parse_version(name)
+            if parsed is not None and not parsed.is_prerelease:
+                releases[parsed] = name
+        if not releases:
+            return None
+        return releases[max(releases)]
+
+
+class RawURL:
+    '''
+    Newest version whose source url exists, found by substituting the
+    next version numbers into the current source url. Finds nothing if
+    no newer version exists.
+    '''
+    name = 'url'
+
+    def get_url(self, source_url, version):
+        if not version or version not in source_url:
+            return None
+        return source_url.replace(version, '{version}')
+
+    def get_version(self, url, version, get):
+        latest = version
+        for _ in range(MAX_PROBES):
+            for candidate in _next_versions(latest):
+                # GET without reading the body, servers often mishandle HEAD
+                response = get(url.replace('{version}', candidate), stream=True)
+                response.close()
+                if response.status_code == 200:
+                    latest = candidate
+                    break
+            else:
+                break
+        return latest if latest != version else None
+
+
+SOURCES = (PyPI(), GitHub(), RawURL())
+
+
+def _source_urls(meta_yaml):
+    sources = meta_yaml.get('source') or []
+    if isinstance(sources, dict):
+        sources = [sources]
+    urls = []
+    for source in sources:
+        url = source.get('url')
+        urls.extend(url if isinstance(url, list) else [url] if url else [])
+    return urls
+
+
+def _package_version(attrs):
+    version = attrs.get('version') or (attrs['meta_yaml'].get('package') or {}).get('version')
+    return None if version is None else str(version)
+
+
+def _checkable_nodes(gx):
+    '''
+    Returns (name, attrs) of the nodes to check, skipping bad and
+    archived feedstocks and the stub nodes added by make_graph
+    '''
+    nodes = []
+    for name, node in gx.nodes.items():
+        attrs = node.get('payload')
+        if not attrs or attrs.get('bad') or attrs.get('archived') or not attrs.get('meta_yaml'):
+            continue
+        nodes.append((name, attrs))
+    return nodes
+
+
+def get_latest_version(attrs, sources=None, limiter=None, timings=None):
+    '''
+    Looks up the latest upstream version of a feedstock, trying each of
+    sources in order until one of them finds a version
+
+    Parameters
+    ----------
+    attrs: dict
+        Node attributes of the feedstock
+    sources: list, optional
+        Version sources to try. Default is SOURCES.
+    limiter: _RateLimiter, optional
+        Rate limits for requests
+    timings: list, optional
+        (source name, seconds, found, failed) of every source checked
+        is appended to it
+
+    Returns
+    -------
+    tuple
+        (version, source name), or (None, None) if no source found one
+    '''
+    if sources is None:
+        sources = SOURCES
+    if limiter is None:
+        limiter = _RateLimiter()
+
+    def get(url, **kwargs):
+        limiter.wait(url)
+        return _get_session().get(url, timeout=30, **kwargs)
+
+    version = _package_version(attrs)
+    errors = []
+    for source in sources:
+        for source_url in _source_urls(attrs['meta_yaml']):
+            url = source.get_url(source_url, version)
+            if url is None:
+                continue
+            start = time.time()
+            new_version = error = None
+            try:
+                new_version = source.get_version(url, version, get)
+            except Exception as e:
+                error = e
+                errors.append(f'{source.name}: {e!r}')
+            if timings is not None:
+                timings.append((source.name, time.time() - start,
+                                new_version is not None, error is not None))
+            if new_version is not None:
+                return str(new_version), source.name
+    if errors:
+        raise RuntimeError('; '.join(errors))
+    return None, None
+
+
+def _write_version(name, new_version, error=None):
+    data = {'new_version': new_version or False}
+    if error is not None:
+        data['bad'] = f'Upstream: {error}'
+    with open(os.path.join('versions', f'{name}.json'), 'w') as f:
+        json.dump(data, f, sort_keys=True, indent=2)
+
+
+def update_upstream_versions(gx, max_workers=None, sources=None):
+    '''
+    Checks the upstream sources of every feedstock in the graph for new
+    versions concurrently, writes the result for each one to
+    versions/{name}.json and sets new_version in its node attributes
+    when a newer version was found. Prints a timing breakdown by source.
+
+    Parameters
+    ----------
+    gx: nx.DiGraph
+        Dependency graph with node attributes in LazyJson payloads
+    max_workers: int, optional
+        Number of feedstocks checked at once. Default is MAX_WORKERS.
+    sources: list, optional
+        Version sources to try, in order. Default is SOURCES.
+
+    Returns
+    -------
+    dict
+        Maps each checked node name to its latest upstream version,
+        or None if none was found
+    '''
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    os.makedirs('versions', exist_ok=True)
+    nodes = _checkable_nodes(gx)
+    limiter = _RateLimiter()
+    timings = []
+    results = {}
+    start = time.time()
+    step = max(1, len(nodes) // 10)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(get_latest_version, attrs, sources=sources,
+                               limiter=limiter, timings=timings): (name, attrs)
+                   for name, attrs in nodes}
+        for n_done, future in enumerate(as_completed(futures), 1):
+            name, attrs = futures[future]
+            try:
+                new_version, _ = future.result()
+            except Exception as e:
+                logger.warning(f'Could not check {name} for new versions: {e}')
+                new_version = None
+                _write_version(name, None, error=e)
+            else:
+                _write_version(name, new_version)
+            results[name] = new_version
+            if new_version is not None and _newer(new_version, attrs.get('new_version')):
+                with attrs as node_attrs:
+                    node_attrs['new_version'] = new_version
+            if n_done % step == 0 and n_done < len(nodes):
+                print(f'Checked {n_done}/{len(nodes)} packages ({time.time() - start:.1f}s)')
+    print(f'Checked {len(nodes)} packages in {time.time() - start:.2f}s '
+          f'with {max_workers} workers ({len(gx.nodes) - len(nodes)} archived or stub nodes skipped)')
+    for source in sorted({timing[0] for timing in timings}):
+        entries = [timing for timing in timings if timing[0] == source]
+        print(f'  {source}: {len(entries)} checked, {sum(e[2] for e in entries)} found, '
+              f'{sum(e[3] for e in entries)} errors, {sum(e[1] for e in entries):.2f}s')
+    return results
@@ -0,0 +1,135 @@
+'''
+Benchmarks edge inference in graph_utils.make_graph on a synthetic graph,
+comparing the snapshot-based pass, including writing its results to the
+node attributes, against deep copying the whole graph.
+
+Usage, from the root of the repository (unless nsls2forge_utils is installed):
+    PYTHONPATH=. python scripts/benchmark_edge_inference.py [--nodes 2000]
+'''
+import argparse
+import random
+import time
+import tracemalloc
+from copy import deepcopy
+
+import networkx as nx
+
+from nsls2forge_utils import graph_utils
+from nsls2forge_utils.graph_utils import _dependency_snapshot, _flush_node_attrs, _infer_edges
+
+
+class _Payload(dict):
+    '''
+    In-memory stand-in for a loaded LazyJson payload.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def _synthetic_graph(num_nodes, seed=0):
+    rng = random.Random(seed)
+    gx = nx.DiGraph()
+    names = [f'pkg{i}' for i in range(num_nodes)]
+    for i, name in enumerate(names):
+        deps = set(rng.sample(names[:i], min(i, rng.randint(0, 8))))
+        requirements = {
+            'build': set(),
+            'host': set(sorted(deps)[:2]),
+            'run': deps,
+            'test': set(),
+        }
+        meta_yaml = {
+            'package': {'name': name, 'version': '1.0.0'},
+            'source': {'url': f'https://pypi.io/{name}-1.0.0.tar.gz', 'sha256': '0' * 64},
+            'requirements': {k: sorted(v) for k, v in requirements.items()},
+            'about': {'home': f'https://github.com/org/{name}', 'summary': 'x' * 200},
+        }
+        gx.add_node(name, payload=_Payload(
+            feedstock_name=name,
+            requirements=requirements,
+            outputs_names={name},
+            strong_exports=(i % 50 == 0),
+            meta_yaml=meta_yaml,
+            raw_meta_yaml='\n'.join(f'# line {j} of the recipe' for j in range(100)),
+            PRed=[{'data': {'migrator_name': 'Version', 'version': f'0.{j}'}} for j in range(10)],
+        ))
+    return gx
+
+
+def _infer_edges_deepcopy(gx):
+    '''
+    Edge inference as previously done in make_graph.
+    '''
+    gx2 = deepcopy(gx)
+    outputs_lut = {
+        k: node_name
+        for node_name, node in gx.nodes.items()
+        for k in node.get("payload", {}).get("outputs_names", [])
+    }
+    gx.graph["outputs_lut"] = outputs_lut
+    strong_exports = {
+        node_name
+        for node_name, node in gx.nodes.items()
+        if node.get("payload").get("strong_exports", False)
+    }
+    gx = nx.create_empty_copy(gx)
+    for node, node_attrs in gx2.nodes.items():
+        with node_attrs["payload"] as attrs:
+            deps = set(
+                map(
+                    lambda x: outputs_lut.get(x, x),
+                    set().union(*attrs.get("requirements", {}).values()),
+                )
+            )
+            overlap = deps & strong_exports
+            requirements = attrs.get("requirements")
+            if requirements:
+                requirements["host"].update(overlap)
+                requirements["run"].update(overlap)
+        for dep in deps:
+            gx.add_edge(dep, node)
+    return gx
+
+
+def _infer_edges_snapshot(gx):
+    '''
+    Edge inference as done in make_graph, writes included.
+    '''
+    gx, strong_export_updates, stubs = _infer_edges(gx, _dependency_snapshot(gx))
+    _flush_node_attrs(gx, strong_export_updates, stubs)
+    return gx
+
+
+def _measure(func, gx):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(gx)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--nodes', dest='nodes', default=2000, type=int,
+                        help='Number of nodes in the synthetic graph (default is 2000)')
+    args = parser.parse_args()
+    # stub nodes get in-memory payloads instead of files in node_attrs/
+    graph_utils._node_attrs = lambda name: _Payload()
+
+    old, old_time, old_peak = _measure(_infer_edges_deepcopy, _synthetic_graph(args.nodes))
+    new, new_time, new_peak = _measure(_infer_edges_snapshot, _synthetic_graph(args.nodes))
+    assert set(old.edges) == set(new.edges)
+
+    print(f'{args.nodes} nodes, {new.number_of_edges()} edges')
+    print(f'{"":>10}{"time (s)":>12}{"peak (MiB)":>14}')
+    print(f'{"deepcopy":>10}{old_time:>12.3f}{old_peak / 2**20:>14.1f}')
+    print(f'{"snapshot":>10}{new_time:>12.3f}{new_peak / 2**20:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()